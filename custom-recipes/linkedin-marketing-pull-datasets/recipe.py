@@ -1,8 +1,19 @@
 # -*- coding: utf-8 -*-
-from api_format import format_to_df
-from api_call import check_params, query_ads, query_ad_analytics, set_accounts_filter
-from dku_constants import AuthenticationType, Constants, Category
+from api_call import check_input_params
+from checkpoint_store import CheckpointStore
+from dataset_writer import RecipeOutputs
+from pull_pipeline import PullSettings, build_pull_graph, create_client
+from parquet_export import ParquetExport
+from raw_response_store import RawResponseStore
+from sharded_pull import build_shards, check_shard_accounts, run_shards, write_shard_results
+from request_scheduler import RequestScheduler
+from response_cache import ResponseCache
+from run_metrics import RunMetrics
+from sync_state import SyncState
+from dku_constants import AuthenticationType, Backend, CACHE_TTL_SEC_DICT, Constants, Category
 from datetime import datetime
+import hashlib
+import tempfile
 
 import dataiku
 from dataiku.customrecipe import (
@@ -32,7 +43,29 @@ elif authentication_method == AuthenticationType.OAUTH:
 
 account_ids = config.get("account_id").split(",")
 batch_size = config.get("batch_size")
+rows_per_id_per_day = config.get("rows_per_id_per_day")
+if rows_per_id_per_day is None:
+    rows_per_id_per_day = Constants.DEFAULT_ROWS_PER_ID_PER_DAY
+concurrency = config.get("concurrency") or Constants.DEFAULT_MAX_WORKERS
+backend = Backend(config.get("backend") or Backend.SYNC.value)
+account_shards = min(config.get("account_shards") or 1, Constants.MAX_ACCOUNT_SHARDS)
+requests_per_second = config.get("requests_per_second") or Constants.DEFAULT_REQUESTS_PER_SECOND
+use_cache = config.get("use_cache", False)
+cache_ttl_minutes = config.get("cache_ttl_minutes") or Constants.DEFAULT_CACHE_TTL_MIN
 raw_reponse = config.get("raw_response")
+raw_response_output = config.get("raw_response_output") or "column"
+flatten_output = config.get("flatten_output", False)
+analytics_output = config.get("analytics_output") or "dataset"
+fields = {}
+if config.get("select_fields"):
+    selected_fields = {
+        Category.GROUP: config.get("campaign_group_fields"),
+        Category.CAMPAIGN: config.get("campaign_fields"),
+        Category.CREATIVE: config.get("creative_fields"),
+        Category.CAMPAIGN_ANALYTICS: config.get("analytics_metrics"),
+        Category.CREATIVE_ANALYTICS: config.get("analytics_metrics")
+    }
+    fields = {category: category_fields for category, category_fields in selected_fields.items() if category_fields}
 
 if config.get("date_manager") == "timerange":
     start_date = config.get("start")
@@ -45,58 +78,97 @@ elif config.get("date_manager") == "everyday":
     start_date = None
     end_date = None
 
-check_params(HEADERS, account_ids, batch_size, start_date, end_date)
-accounts_filter = set_accounts_filter(account_ids)
+cache_ttls = {**CACHE_TTL_SEC_DICT, **{category: cache_ttl_minutes * 60 for category in [Category.GROUP, Category.CAMPAIGN, Category.CREATIVE]}}
+cache_settings = {"ttls": cache_ttls, "namespace": hashlib.sha256(str(sorted(HEADERS.items())).encode("utf-8")).hexdigest(), "enabled": use_cache}
+incremental = config.get("sync_mode") == "incremental"
+lookback_days = config.get("lookback_days") or Constants.DEFAULT_LOOKBACK_DAYS
+if incremental:
+    if not get_output_names_for_role(Constants.SYNC_STATE_FOLDER):
+        raise ValueError("Please add a sync state folder as output to use the incremental sync")
+    sync_state_folder = dataiku.Folder(get_output_names_for_role(Constants.SYNC_STATE_FOLDER)[0])
+    sync_state = SyncState.load(sync_state_folder)
+else:
+    sync_state = None
+
+if raw_reponse and raw_response_output == "folder":
+    if not get_output_names_for_role(Constants.RAW_RESPONSE_FOLDER):
+        raise ValueError("Please add a raw responses folder as output to write the raw responses to a folder")
+    if account_shards > 1:
+        raise ValueError("The raw responses can only be written to a folder with a single account shard")
+    raw_response_store = RawResponseStore(dataiku.Folder(get_output_names_for_role(Constants.RAW_RESPONSE_FOLDER)[0]))
+    raw_reponse = False
+else:
+    raw_response_store = None
+
+if analytics_output == "parquet":
+    if not get_output_names_for_role(Constants.ANALYTICS_PARQUET_FOLDER):
+        raise ValueError("Please add an analytics Parquet folder as output to export the analytics as Parquet files")
+    if any(get_output_names_for_role(role) for role in Constants.ANALYTICS_DATASET_ROLES):
+        raise ValueError("The analytics are exported to the Parquet folder, please remove the analytics datasets from the outputs")
+    if incremental or account_shards > 1:
+        raise ValueError("The Parquet export of the analytics is only available with the full sync and a single account shard")
+    parquet_export = ParquetExport(dataiku.Folder(get_output_names_for_role(Constants.ANALYTICS_PARQUET_FOLDER)[0]))
+else:
+    parquet_export = None
+
+check_input_params(account_ids, batch_size, start_date, end_date)
+
+if get_output_names_for_role(Constants.CHECKPOINT_FOLDER):
+    if account_shards > 1:
+        raise ValueError("The runs can only be resumed from the checkpoint folder with a single account shard")
+    checkpoints = CheckpointStore(dataiku.Folder(get_output_names_for_role(Constants.CHECKPOINT_FOLDER)[0]), account_ids, start_date, end_date, batch_size)
+else:
+    checkpoints = None
+
+output_roles = [role for role in Constants.OUTPUT_DATASET_ROLES if get_output_names_for_role(role)]
+coalesce_analytics = config.get("coalesce_analytics", False) and not incremental and parquet_export is None \
+    and all(role in output_roles for role in Constants.ANALYTICS_DATASET_ROLES)
+output_names = {role: get_output_names_for_role(role)[0] for role in output_roles}
+outputs = RecipeOutputs(
+    {role: dataiku.Dataset(name) for role, name in output_names.items()},
+    {role: dataiku.Dataset(name, ignore_flow=True) for role, name in output_names.items()} if incremental else None
+)
+settings = PullSettings(account_ids, batch_size, start_date=start_date, end_date=end_date, raw_response=raw_reponse, flatten=flatten_output,
+                        rows_per_id_per_day=rows_per_id_per_day, sync_state=sync_state, lookback_days=lookback_days,
+                        raw_response_store=raw_response_store, parquet_export=parquet_export, fields=fields,
+                        coalesce_analytics=coalesce_analytics)
+targets = output_roles + (Constants.ANALYTICS_DATASET_ROLES if parquet_export else [])
 
 # ===============================================================================
-# RUN
+# RUN AND WRITE
+# Independent stages run concurrently, and each dataset is written as soon as its stage is done.
+# The accounts are checked in the background, before anything is written.
+# With several account shards, the accounts are checked first, then each shard runs the same stages in its own worker process
+# and spills its rows to a temporary folder, merged into the outputs at the end.
+# With a checkpoint folder, the queries finished by a failed run are skipped by its rerun
 # ===============================================================================
 
-group = query_ads(HEADERS, Category.GROUP, accounts_filter)
-campaign_groups_df = format_to_df(group, Category.GROUP, raw_reponse)
-
-if get_output_names_for_role(Constants.CAMPAIGN_DATASET) or get_output_names_for_role(Constants.CAMPAIGN_ANALYTICS_DATASET):
-    campaign = query_ads(HEADERS, Category.CAMPAIGN, accounts_filter)
-    campaigns_df = format_to_df(campaign, Category.CAMPAIGN, raw_reponse)
-
-if get_output_names_for_role(Constants.CREATIVE_DATASET) or get_output_names_for_role(Constants.CREATIVE_ANALYTICS_DATASET):
-    creative = query_ads(HEADERS, Category.CREATIVE, accounts_filter)
-    creatives_df = format_to_df(creative, Category.CREATIVE, raw_reponse)
-
-if get_output_names_for_role(Constants.CAMPAIGN_ANALYTICS_DATASET):
-    campaign_analytics = query_ad_analytics(HEADERS, Category.CAMPAIGN_ANALYTICS, campaigns_df, batch_size=batch_size, start_date=start_date, end_date=end_date)
-    campaign_analytics_df = format_to_df(campaign_analytics, Category.CAMPAIGN_ANALYTICS, raw_reponse)
-
-if get_output_names_for_role(Constants.CREATIVE_ANALYTICS_DATASET):
-    creative_analytics = query_ad_analytics(HEADERS, Category.CREATIVE_ANALYTICS, creatives_df, batch_size=batch_size, start_date=start_date, end_date=end_date)
-    creative_analytics_df = format_to_df(creative_analytics, Category.CREATIVE_ANALYTICS, raw_reponse)
-
+metrics = RunMetrics()
+if account_shards > 1:
+    check_shard_accounts(account_ids, HEADERS, requests_per_second, cache_settings, metrics)
+    with tempfile.TemporaryDirectory(prefix="linkedin-marketing-shards-") as spill_directory:
+        shards = build_shards(account_ids, account_shards, HEADERS, settings, output_roles, concurrency, requests_per_second,
+                              cache_settings, spill_directory, backend)
+        write_shard_results(run_shards(shards), outputs, output_roles, settings, metrics)
+else:
+    scheduler = RequestScheduler(requests_per_second=requests_per_second)
+    cache = ResponseCache(**cache_settings)
+    with create_client(HEADERS, backend, max_workers=concurrency, pool_size=concurrency, scheduler=scheduler, cache=cache,
+                       metrics=metrics, checkpoints=checkpoints) as client:
+        writers = build_pull_graph(client, settings, outputs).run(targets=targets)
+    if checkpoints:
+        checkpoints.finish([writers[target] for target in targets])
+
+if incremental:
+    sync_state.save(sync_state_folder)
 
 # ===============================================================================
-# WRITE
+# RUN METRICS
 # ===============================================================================
 
-if get_output_names_for_role(Constants.CAMPAIGN_GROUP_DATASET):
-    groups_name = get_output_names_for_role(Constants.CAMPAIGN_GROUP_DATASET)[0]
-    groups_dataset = dataiku.Dataset(groups_name)
-    groups_dataset.write_with_schema(campaign_groups_df)
-
-if get_output_names_for_role(Constants.CAMPAIGN_DATASET):
-    campaigns_names = get_output_names_for_role(Constants.CAMPAIGN_DATASET)[0]
-    campaigns_dataset = dataiku.Dataset(campaigns_names)
-    campaigns_dataset.write_with_schema(campaigns_df)
-
-if get_output_names_for_role(Constants.CREATIVE_DATASET):
-    creatives_names = get_output_names_for_role(Constants.CREATIVE_DATASET)[0]
-    creatives_dataset = dataiku.Dataset(creatives_names)
-    creatives_dataset.write_with_schema(creatives_df)
-
-if get_output_names_for_role(Constants.CAMPAIGN_ANALYTICS_DATASET):
-    campaigns_analytics_names = get_output_names_for_role(Constants.CAMPAIGN_ANALYTICS_DATASET)[0]
-    campaign_analytics_dataset = dataiku.Dataset(campaigns_analytics_names)
-    campaign_analytics_dataset.write_with_schema(campaign_analytics_df)
-
-if get_output_names_for_role(Constants.CREATIVE_ANALYTICS_DATASET):
-    creatives_analytics_names = get_output_names_for_role(Constants.CREATIVE_ANALYTICS_DATASET)[0]
-    creative_analytics_dataset = dataiku.Dataset(creatives_analytics_names)
-    creative_analytics_dataset.write_with_schema(creative_analytics_df)
+metrics.log_summary()
+if get_output_names_for_role(Constants.METRICS_FOLDER):
+    metrics_folder = dataiku.Folder(get_output_names_for_role(Constants.METRICS_FOLDER)[0])
+    metrics_folder.write_json(Constants.TRACE_FILE_NAME.format(metrics.started_at.strftime("%Y%m%dT%H%M%SZ")), metrics.get_trace())
+if get_output_names_for_role(Constants.REQUEST_LOG_DATASET):
+    dataiku.Dataset(get_output_names_for_role(Constants.REQUEST_LOG_DATASET)[0]).write_with_schema(metrics.get_request_log())
@@ -1,12 +1,16 @@
-import requests
 import numpy as np
-import pandas as pd
 from math import ceil
 import logging
 import time
-from datetime import datetime
-from api_format import format_to_df
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from itertools import islice
+from typing import Callable, Iterable, Iterator, List, Tuple
+from api_client import LinkedinClient
+from api_format import get_field_names, load_json
 from dku_constants import Constants, Category
+from parent_ids import ParentIds
 
 logger = logging.getLogger()
 logging.basicConfig(level=logging.INFO, format="LinkedIn Marketing plugin %(levelname)s - %(message)s")
@@ -15,29 +19,29 @@ logging.basicConfig(level=logging.INFO, format="LinkedIn Marketing plugin %(leve
 class LinkedinPluginError(ValueError):
     pass
 
-def check_params(headers: dict, account_ids: list, batchsize: int, start_date: datetime, end_date: datetime):
+def check_params(client: LinkedinClient, account_ids: list, batchsize: int, start_date: datetime, end_date: datetime):
     """Check if the account id and the access tokens are valid
 
-    :param dict headers:  Headers of the GET query, it contains the access token for the OAuth2 identification
+    :param LinkedinClient client:  HTTP client of the run, it holds the access token for the OAuth2 identification
     :param list account_ids:  list of IDs of the sponsored ad accounts
     :param int batch_size: number of ids by batch query (ex - 100)
     :param datetime start_date:  First day of the chosen time range (None for all time)
     :param datetime end_date:  Last day of the time range (None for today)
+    :raises: :class:`ValueError`: Invalid parameters
+    """
+    check_input_params(account_ids, batchsize, start_date, end_date)
+    check_accounts(client, account_ids)
+
+
+def check_input_params(account_ids: list, batchsize: int, start_date: datetime, end_date: datetime):
+    """Check the format of the parameters, without querying the API. See check_params
+
     :raises: :class:`ValueError`: Invalid parameters
     """
     for account_id in account_ids:
         if not account_id.strip().isnumeric():
             raise ValueError("Wrong format for the account id"+account_id +
                              ". It should be an integer that you can find using the following url : https://www.linkedin.com/campaignmanager/accounts")
-    account = query_ads(headers, Category.ACCOUNT, {})
-    exception = account.get("exception", None)
-    if exception:
-        raise ValueError(str(exception))
-    else:
-        account_df = format_to_df(account, Category.ACCOUNT, False)
-        for account_id in account_ids:
-            if int(account_id) not in account_df.id.values:
-                raise ValueError("Wrong account id or you don't have the permission to access the account "+account_id)
 
     if batchsize:
         if batchsize < 0 or batchsize > 600:
@@ -56,146 +60,538 @@ def check_params(headers: dict, account_ids: list, batchsize: int, start_date: d
             raise ValueError("Please select a valid end date")
 
 
-def query_ads(headers: dict, category: str, accounts_filter: dict) -> dict:
+def check_accounts(client: LinkedinClient, account_ids: list):
+    """Check that the access token can access the accounts. Only the configured accounts are queried.
+
+    :param list account_ids:  list of IDs of the sponsored ad accounts
+    :raises: :class:`ValueError`: Wrong account id or access token
+    """
+    account = query_ads(client, Category.ACCOUNT, set_account_ids_filter(account_ids))
+    exception = account.get("exception", None)
+    if exception:
+        raise ValueError(str(exception))
+    accessible_ids = {element.get("id") for element in account.get("elements", [])}
+    for account_id in account_ids:
+        if int(account_id) not in accessible_ids:
+            raise ValueError("Wrong account id or you don't have the permission to access the account "+account_id)
+
+
+def query_ads(client: LinkedinClient, category: str, accounts_filter: dict, fields: List[str] = None) -> dict:
     """Query the LinkedIn ad API. LinkedIn ad handles pagination
 
+    :param LinkedinClient client: HTTP client of the run
     :param str category: granularity of the data that you want to get -> ACCOUNT, GROUP, CAMPAIGN, CREATIVES, CAMPAIGN_ANALYTICS, CREATIVES_ANALYTICS
     :param dict accounts_filter: parameters used in the GET query to filter on ad accounts
+    :param list fields: fields to retrieve, see api_format.get_field_names (None for all of them)
 
     :returns: Response of the API
     :rtype: dict
     """
-    url, params = set_up_query(category, accounts_filter)
-    response = query_with_pagination(url, headers, params)
+    url, params = set_up_query(category, accounts_filter, fields)
+    response = query_with_pagination(url, client, params, cache_category=category)
     return response
 
 
-def query_ad_analytics(headers: dict, category: str, parent: pd.DataFrame, batch_size: int = Constants.DEFAULT_BATCH_SIZE, start_date: datetime = None, end_date: datetime = None) -> dict:
+def iter_ads(client: LinkedinClient, category: str, accounts_filter: dict, fields: List[str] = None) -> Iterator[dict]:
+    """Query the LinkedIn ad API page by page, see query_ads
+
+    :returns: Response of the API for each page
+    :rtype: generator
+    """
+    url, params = set_up_query(category, accounts_filter, fields)
+    return iter_pages(url, client, params, cache_category=category)
+
+
+def query_ad_analytics(client: LinkedinClient, category: str, parent: ParentIds, batch_size: int = Constants.DEFAULT_BATCH_SIZE, start_date: datetime = None, end_date: datetime = None,
+                       rows_per_id_per_day: float = Constants.DEFAULT_ROWS_PER_ID_PER_DAY, fields: List[str] = None) -> dict:
     """Query the ad analytics API. As it doesn't handle pagination, a batch query is performed.
     The batch size indicates how many entities (campaigns or creatives) should be returned by batch query.
+    The time range is also split into windows, so that each query is expected to return less than 1,000 entities.
 
-    :param pd.DataFrame parent: Dataframe which contains the ids used to filter the query.  Ex - parent : campaign -> child: campaign_analytics
+    :param LinkedinClient client: HTTP client of the run
+    :param ParentIds parent: ids used to filter the query, see ParentIds.from_entities.  Ex - parent : campaign -> child: campaign_analytics
     :param int batch_size: number of ids by batch query (ex - 100)
+    :param float rows_per_id_per_day: estimated number of analytics rows per id and per day, used to size the time windows
+    :param list fields: metrics to retrieve, see api_format.get_field_names (None for all of them)
 
     :returns: Response of the API
     :rtype: dict
     """
-    if parent.empty:
-        response = {"exception": "The parent dataframe is empty, so this dataset cannot be retrieved"}
+    response = {"elements": [], "exception": []}
+    for query_output in iter_ad_analytics(client, category, parent, batch_size, start_date, end_date, rows_per_id_per_day, fields):
+        if "elements" not in query_output:
+            return query_output
+        response["elements"].extend(query_output["elements"])
+    return response
+
+
+def iter_ad_analytics(client: LinkedinClient, category: str, parent: ParentIds, batch_size: int = Constants.DEFAULT_BATCH_SIZE, start_date: datetime = None, end_date: datetime = None,
+                      rows_per_id_per_day: float = Constants.DEFAULT_ROWS_PER_ID_PER_DAY, fields: List[str] = None) -> Iterator[dict]:
+    """Query the ad analytics API batch by batch, see query_ad_analytics
+
+    :returns: Response of the API for each batch query
+    :rtype: generator
+    """
+    parent_error = get_parent_error(parent)
+    if parent_error:
+        yield parent_error
+    else:
+        url, initial_params, analytics_requests = set_up_analytics_queries(category, parent, batch_size, start_date, end_date, rows_per_id_per_day, fields)
+        if not analytics_requests:
+            yield {"elements": []}
+        yield from iter_batches(analytics_requests, category, url, client, initial_params)
+
+
+def get_parent_error(parent: ParentIds) -> dict:
+    """Check that the analytics of the parent ids can be retrieved
+
+    :returns: the error to report, or None if the parent is valid
+    :rtype: dict
+    """
+    if parent.error:
+        return parent.error
+    if not len(parent):
+        return {"exception": "The parent dataframe is empty, so this dataset cannot be retrieved"}
+    return None
+
+
+def set_up_analytics_queries(category: str, parent: ParentIds, batch_size: int, start_date: datetime, end_date: datetime,
+                             rows_per_id_per_day: float, fields: List[str] = None) -> Tuple[str, dict, List[Tuple[np.ndarray, date, date]]]:
+    """Retrieve the url, initial parameters and planned requests of the analytics of the parent ids, see plan_analytics_requests
+
+    :rtype: tuple
+    """
+    url, initial_params = set_up_query(category, fields=fields)
+    first_day = start_date or parent.first_activity_date
+    last_day = end_date or datetime.now()
+    analytics_requests = plan_analytics_requests(parent.ids, batch_size, first_day, last_day, rows_per_id_per_day, parent.weights)
+    logger.info("Retrieving {} with {} queries".format(category, len(analytics_requests)))
+    return url, initial_params, analytics_requests
+
+
+def plan_analytics_requests(ids: list, batch_size: int, start_date: datetime, end_date: datetime,
+                            rows_per_id_per_day: float = Constants.DEFAULT_ROWS_PER_ID_PER_DAY,
+                            id_weights: np.ndarray = None) -> List[Tuple[np.ndarray, date, date]]:
+    """Split an analytics query across batches of ids and time windows (months, or weeks for busy batches),
+    so that each request is expected to return less than 1,000 entities.
+
+    :param list ids: list of entities used to filter the query
+    :param int batch_size: max number of ids by batch query
+    :param float rows_per_id_per_day: estimated number of analytics rows per id and per day (at most 1 with a DAILY granularity)
+    :param np.ndarray id_weights: number of pivot entities behind each id, ex - the creatives of the campaigns filtering the CREATIVE pivot.
+        The batches then hold as many pivot entities as batch_size ids would (None for one entity per id)
+
+    :returns: flat list of (ids, first day, last day) requests
+    :rtype: list
+    """
+    count = len(ids) if id_weights is None else max(1, int(np.sum(id_weights)))
+    ids_per_request = min(batch_size, count)
+    if rows_per_id_per_day > 0:
+        days_per_request = int(Constants.MAX_ENTITIES_PER_QUERY / (ids_per_request * rows_per_id_per_day))
+        if days_per_request < 7:
+            ids_per_request = max(1, min(ids_per_request, int(Constants.MAX_ENTITIES_PER_QUERY / (7 * rows_per_id_per_day))))
+            days_per_request = 7
+    else:
+        days_per_request = None
+    if id_weights is None:
+        chunks = [*np.array_split(ids, ceil(count / ids_per_request))]
     else:
-        invalid_parent = (parent["exception"].values.size == 0)
-        if invalid_parent:
-            response = {"exception": "The parent dataframe is invalid, so this dataset cannot be retrieved"}
+        chunks = split_by_weight(np.asarray(ids), np.asarray(id_weights), ids_per_request)
+    windows = split_time_range(start_date.date(), end_date.date(), days_per_request)
+    return [(chunk, window_start, window_end) for chunk in chunks for window_start, window_end in windows]
+
+
+def split_by_weight(ids: np.ndarray, id_weights: np.ndarray, max_weight: int) -> List[np.ndarray]:
+    """Split consecutive ids into chunks of at most max_weight, an id heavier than max_weight making a chunk on its own
+
+    :rtype: list
+    """
+    chunk_indices = np.zeros(len(ids), dtype=np.int64)
+    chunk_index, chunk_weight = 0, 0
+    for position, weight in enumerate(id_weights):
+        if chunk_weight and chunk_weight + weight > max_weight:
+            chunk_index, chunk_weight = chunk_index + 1, 0
+        chunk_indices[position] = chunk_index
+        chunk_weight += weight
+    return np.split(ids, np.flatnonzero(np.diff(chunk_indices)) + 1)
+
+
+def split_time_range(first_day: date, last_day: date, max_days: int = None) -> List[Tuple[date, date]]:
+    """Split a time range into windows of whole calendar months, or whole weeks if a month is longer than max_days.
+    The first and last windows are cut to the time range.
+
+    :param int max_days: max number of days per window (None for a single window)
+
+    :returns: (first day, last day) of each window, none if the time range is empty
+    :rtype: list
+    """
+    if first_day > last_day:
+        return []
+    if max_days is None or (last_day - first_day).days < max_days:
+        return [(first_day, last_day)]
+    windows = []
+    window_start = first_day
+    while window_start <= last_day:
+        if max_days >= 31:
+            months = max_days // 31
+            next_month = window_start.month - 1 + months
+            next_start = date(window_start.year + next_month // 12, next_month % 12 + 1, 1)
         else:
-            url, initial_params = set_up_query(category)
-            initial_params = date_filter(initial_params, start_date, end_date)
-            ids = parent["id"].values
-            count = len(ids)
-            if count >= batch_size:
-                response = query_by_batch(batch_size, ids, category, url, headers, initial_params)
-            else:
-                params = {**initial_params, **get_analytics_parameters(ids, category)}
-                response = query(url, headers, params)
-    return response
+            next_start = window_start + timedelta(days=7 * (max_days // 7))
+        windows.append((window_start, min(next_start - timedelta(days=1), last_day)))
+        window_start = next_start
+    return windows
 
 
-def query_with_pagination(url: str, headers: dict, parameters: dict, page_size: int = 100) -> dict:
+def query_with_pagination(url: str, client: LinkedinClient, parameters: dict, page_size: int = 100, cache_category: str = None) -> dict:
     """Handles queries with pagination. Pagination is only supported for campaign groups, campaigns and creatives
+    Once the total is known from the first page, the remaining pages are fetched concurrently by the workers of the client.
 
     :param str url: Url used for the GET query
     :param dict parameters: Parameters used for the GET query
     :param int page_size: Max entities per query (set to 100 in the case of the LinkedIn API)
+    :param str cache_category: category of the listing, to use the cache of the client (None to bypass it)
 
     :returns: Response of the API
     :rtype: dict
     """
-    parameters.update({"count": str(page_size)})
-    response = query(url, headers, parameters)
-    paging = response.get("paging", None)
-    if paging:
-        total_entities = paging.get("total", None)
-        if total_entities and total_entities > page_size:
-            for start in range(page_size, total_entities, page_size):
-                parameters.update({"start": str(start)})
-                response["elements"].extend(query(url, headers, parameters)["elements"])
-    else:
-        response["exception"] = response
+    pages = iter_pages(url, client, parameters, page_size, cache_category)
+    response = next(pages)
+    for page in pages:
+        if "elements" not in page:
+            return page
+        response["elements"].extend(page["elements"])
     return response
 
 
-def query_by_batch(batch_size: int, ids: list, category: str, url: str, headers: dict, initial_params: dict) -> dict:
-    """Perfom a batch get query with multiple filters
+def iter_pages(url: str, client: LinkedinClient, parameters: dict, page_size: int = 100, cache_category: str = None) -> Iterator[dict]:
+    """Handles queries with pagination page by page, see query_with_pagination.
+    The iteration stops after the first page in error. Its duration and rows are added to the metrics of the client.
+
+    :returns: Response of the API for each page
+    :rtype: generator
+    """
+    start_time = time.perf_counter()
+    rows = 0
+    try:
+        first_page_parameters = {**parameters, "count": str(page_size)}
+        response = query(url, client, first_page_parameters, cache_category)
+        paging = response.get("paging", None)
+        if not paging:
+            response["exception"] = response
+            yield response
+            return
+        rows += len(response.get("elements", []))
+        yield response
+        starts = get_next_page_starts(paging, page_size)
+        for page in iter_concurrently(lambda start: query(url, client, {**first_page_parameters, "start": str(start)}, cache_category), starts,
+                                      client.max_workers):
+            rows += len(page.get("elements", []))
+            yield page
+            if "elements" not in page:
+                return
+    finally:
+        client.metrics.record_operation("pagination", cache_category, time.perf_counter() - start_time, rows)
+
+
+def get_next_page_starts(paging: dict, page_size: int) -> range:
+    """Start index of each page after the first one, once the total is known from the paging of the first page
+
+    :rtype: range
+    """
+    total_entities = paging.get("total", None)
+    if not total_entities or total_entities <= page_size:
+        return range(0)
+    return range(page_size, total_entities, page_size)
+
+
+def query_by_batch(analytics_requests: List[Tuple[np.ndarray, date, date]], category: str, url: str, client: LinkedinClient, initial_params: dict) -> dict:
+    """Perfom a batch get query with multiple filters. The requests form a flat work queue, sent concurrently by the workers of the client.
     A request should not return more than 1,000 entities (campaigns, creatives...).
-    When the API raises a error 400 : Request would return too many entities, consider decreasing the batch size.
+    When the API raises a error 400 : Request would return too many entities, the request is split in half and retried.
 
-    :param list ids: list of entities used to filter the query
+    :param list analytics_requests: (ids, first day, last day) of each request, see plan_analytics_requests
     :param dict initial_params: default params for the query. Only the filter fields are missing.
 
     :returns : API's response
     :rtype: dict
     """
-    count = len(ids)
-    chunks = [*np.array_split(ids, ceil(count/batch_size))]
     response = {"elements": [], "exception": []}
-    for chunk in chunks:
-        params = {**initial_params, **get_analytics_parameters(chunk, category)}
-        query_output = query(url, headers, params)
-        elements = query_output.get("elements", None)
-        if elements:
-            response["elements"].extend(elements)
-        elif "elements" in query_output:
-            logger.warning("Empty output for params: " + str(params))
-        else:
-            response = {**query_output, **{"Hint": "consider decreasing the sample size"}}
-            break
+    for query_output in iter_batches(analytics_requests, category, url, client, initial_params):
+        if "elements" not in query_output:
+            return query_output
+        response["elements"].extend(query_output["elements"])
     return response
 
 
-def query(url: str, headers: dict, parameters: dict) -> dict:
-    """Performs the get query. Response is returned in a json format
+def iter_batches(analytics_requests: List[Tuple[np.ndarray, date, date]], category: str, url: str, client: LinkedinClient, initial_params: dict) -> Iterator[dict]:
+    """Perfom the batch get queries one by one, see query_by_batch.
+    The iteration stops after the first query in error. Its duration and rows are added to the metrics of the client.
+
+    :returns : API's response for each query, in the order of the requests
+    :rtype: generator
+    """
+    start_time = time.perf_counter()
+    rows = 0
+    try:
+        for query_output in iter_concurrently(lambda analytics_request: query_chunk(*analytics_request, category, url, client, initial_params),
+                                              analytics_requests, client.max_workers):
+            batch_error = get_batch_error(query_output)
+            if batch_error:
+                yield batch_error
+                return
+            rows += len(query_output["elements"])
+            yield query_output
+    finally:
+        client.metrics.record_operation("batch queries", category, time.perf_counter() - start_time, rows)
+
+
+def get_batch_error(query_output: dict) -> dict:
+    """Error of a batch query, with a hint to solve it
+
+    :returns: the error to report, or None if the query succeeded
+    :rtype: dict
+    """
+    if "elements" in query_output:
+        return None
+    return {**query_output, **{"Hint": "consider decreasing the sample size"}}
+
+
+def iter_concurrently(function: Callable, items: Iterable, max_workers: int) -> Iterator:
+    """Apply a function to each item with a pool of workers, and yield the results in the order of the items.
+    At most twice max_workers results are pending at once, so that a slow consumer bounds the memory used.
+
+    :rtype: generator
+    """
+    items = iter(items)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque(executor.submit(function, item) for item in islice(items, 2 * max_workers))
+        while pending:
+            result = pending.popleft().result()
+            for item in islice(items, 1):
+                pending.append(executor.submit(function, item))
+            yield result
+
+
+def query_chunk(chunk: list, window_start: date, window_end: date, category: str, url: str, client: LinkedinClient, initial_params: dict) -> dict:
+    """Query the analytics of a chunk of ids over a time window.
+    If the request would return too many entities, the chunk is split in half and each half is queried on its own.
+    A single id is split on its time window instead.
+
+    :param list chunk: ids used to filter the query
+    :param date window_start: first day of the time window
+    :param date window_end: last day of the time window
+
+    :returns : API's response
+    :rtype: dict
+    """
+    params = get_chunk_parameters(chunk, window_start, window_end, category, initial_params)
+    query_output = query(url, client, params)
+    halves = split_chunk(query_output, chunk, window_start, window_end)
+    if halves:
+        return merge_outputs(query_chunk(*half, category, url, client, initial_params) for half in halves)
+    if "elements" in query_output and not query_output["elements"]:
+        logger.debug("Empty output for params: " + str(params))
+    return query_output
+
+
+def get_chunk_parameters(chunk: list, window_start: date, window_end: date, category: str, initial_params: dict) -> dict:
+    """Parameters of the query of the analytics of a chunk of ids over a time window
+
+    :rtype: dict
+    """
+    return {**date_filter({**initial_params}, window_start, window_end), **get_analytics_parameters(chunk, category)}
+
+
+def split_chunk(query_output: dict, chunk: list, window_start: date, window_end: date) -> List[Tuple[list, date, date]]:
+    """Halves of a chunk whose query would return too many entities: halves of the ids, or of the time window for a single id
+
+    :returns: (ids, first day, last day) of each half, none if the output of the query is kept
+    :rtype: list
+    """
+    if not is_too_many_entities(query_output) or (len(chunk) <= 1 and window_start >= window_end):
+        return []
+    if len(chunk) > 1:
+        logger.warning("Too many entities for a batch of {} ids, splitting it in half".format(len(chunk)))
+        return [(half, window_start, window_end) for half in np.array_split(chunk, 2)]
+    logger.warning("Too many entities from {} to {}, splitting the time window in half".format(window_start, window_end))
+    middle = window_start + (window_end - window_start) // 2
+    return [(chunk, window_start, middle), (chunk, middle + timedelta(days=1), window_end)]
+
+
+def merge_outputs(query_outputs: Iterable[dict]) -> dict:
+    """Concatenate the elements of several queries, or return the first error
+
+    :returns : API's response
+    :rtype: dict
+    """
+    merged_output = {"elements": []}
+    for query_output in query_outputs:
+        if "elements" not in query_output:
+            return query_output
+        merged_output["elements"].extend(query_output["elements"])
+    return merged_output
+
+
+def is_too_many_entities(query_output: dict) -> bool:
+    """Check if the API refused the query because it would return more than 1,000 entities
+
+    :rtype: bool
+    """
+    return Constants.TOO_MANY_ENTITIES_MESSAGE in str(query_output.get("message", "")).lower()
+
+
+def query(url: str, client: LinkedinClient, parameters: dict, cache_category: str = None) -> dict:
+    """Performs the get query on the pooled connections of the client. Response is returned in a json format
+    Throttling and retries (transport errors, 429 and 5xx) are handled by the scheduler of the client.
+    With checkpoints, the queries finished by a previous run are not sent again, and the successful ones are saved for the next run.
+
+    :param str cache_category: category of the query, to use the cache of the client (None to bypass it)
+
+    :returns: API's response
+    :rtype: dict
+    """
+    stored_response = get_stored_response(url, client, parameters, cache_category)
+    if stored_response is not None:
+        return stored_response
+    start_time = time.perf_counter()
+    try:
+        response = client.get(url, parameters)
+    except Exception as err:
+        raise get_query_error(url, client, parameters, cache_category, err, time.perf_counter() - start_time)
+    json_response = parse_response(url, client, parameters, cache_category, response, time.perf_counter() - start_time)
+    if response.status_code < 400:
+        store_response(url, client, parameters, cache_category, json_response)
+    return json_response
+
+
+def has_stored_responses(client: LinkedinClient, cache_category: str = None) -> bool:
+    """Check if the responses of a query can be stored, in the cache or the checkpoints of the client
+
+    :rtype: bool
+    """
+    return bool(cache_category and client.cache) or bool(client.checkpoints)
+
+
+def get_stored_response(url: str, client: LinkedinClient, parameters: dict, cache_category: str = None) -> dict:
+    """Response of a query from the cache of the client, or from the checkpoints of a previous run
+
+    :returns: the stored response, or None if the query must be sent
+    :rtype: dict
+    """
+    stored_response = None
+    if cache_category and client.cache:
+        stored_response = client.cache.get(cache_category, url, parameters)
+    if stored_response is None and client.checkpoints:
+        stored_response = client.checkpoints.get(get_query_category(parameters, cache_category), url, parameters)
+    if stored_response is not None:
+        record_query(client, url, parameters, cache_category, cached=True)
+    return stored_response
+
+
+def store_response(url: str, client: LinkedinClient, parameters: dict, cache_category: str, json_response: dict):
+    """Save a successful response in the cache of the client and in the checkpoints of the run"""
+    if cache_category and client.cache:
+        client.cache.set(cache_category, url, parameters, json_response)
+    if client.checkpoints:
+        client.checkpoints.set(get_query_category(parameters, cache_category), url, parameters, json_response)
+
+
+def parse_response(url: str, client: LinkedinClient, parameters: dict, cache_category: str, response, latency_sec: float) -> dict:
+    """Record a query in the metrics of the client, and parse its response
+
+    :returns: API's response
+    :rtype: dict
+    """
+    record_query(client, url, parameters, cache_category, response, latency_sec)
+    return get_json_response(response)
+
+
+def get_query_error(url: str, client: LinkedinClient, parameters: dict, cache_category: str, error: Exception, latency_sec: float) -> LinkedinPluginError:
+    """Record a query which could not be sent in the metrics of the client
+
+    :returns: the error to raise
+    :rtype: LinkedinPluginError
+    """
+    record_query(client, url, parameters, cache_category, latency_sec=latency_sec)
+    return LinkedinPluginError("Error while accessing {}: {}".format(url, error))
+
+
+def record_query(client: LinkedinClient, url: str, parameters: dict, cache_category: str = None, response=None, latency_sec: float = 0, cached: bool = False):
+    """Add a query to the metrics of the client, see RunMetrics.record_request
+
+    :param response: Response of the API, None if it could not be retrieved
+    """
+    client.metrics.record_request(
+        endpoint=url.rstrip("/").rsplit("/", 1)[-1],
+        category=get_query_category(parameters, cache_category),
+        status_code=200 if cached else getattr(response, "status_code", None),
+        latency_sec=latency_sec,
+        bytes_received=len(response.content) if response is not None else 0,
+        attempts=getattr(response, "attempts", 1) if not cached else 0,
+        throttles=getattr(response, "throttles", 0),
+        cached=cached
+    )
+
+
+def get_query_category(parameters: dict, cache_category: str = None) -> str:
+    """Category of a query: the one of the listing, or the analytics of its pivot
+
+    :rtype: str
+    """
+    pivot = parameters.get("pivot")
+    if pivot:
+        return {"CAMPAIGN": Category.CAMPAIGN_ANALYTICS, "CREATIVE": Category.CREATIVE_ANALYTICS}.get(pivot, pivot)
+    return cache_category
+
+
+def get_json_response(response) -> dict:
+    """Parse the response of the API, or describe its error
 
     :returns: API's response
     :rtype: dict
     """
-    successful_get = False
-    attempt_number = 0
-    while not successful_get and attempt_number <= Constants.MAX_RETRIES:
-        try:
-            attempt_number += 1
-            response = requests.get(url=url, headers=headers, params=parameters)
-            successful_get = True
-        except Exception as err:
-            logger.warning("ERROR:{}".format(err))
-            logger.warning("URl={} on attempt #{}".format(url, attempt_number))
-            if attempt_number == Constants.MAX_RETRIES:
-                raise LinkedinPluginError("Error while accessing {} on attempt #{}: {}".format(url, attempt_number, err))
-            time.sleep(Constants.WAIT_TIME_BEFORE_RETRY_SEC)
     if response.status_code < 400:
-        return response.json()
+        return load_json(response.content)
     elif response.status_code == 400:
-        return {"error": "Error 400. Consider decreasing the number of account ids or the batch size."}
+        return {"error": "Error 400. Consider decreasing the number of account ids or the batch size.", "message": get_error_message(response)}
     else:
         return {"error": "Error{}".format(response.status_code)}
 
 
-def set_up_query(category: str, accounts_filter: dict = {}) -> (str, dict):
-    """Retrieve the proper url and initial parameters for a given category
+def get_error_message(response) -> str:
+    """Retrieve the message of an API error, if any
+
+    :rtype: str
+    """
+    try:
+        return response.json().get("message", "")
+    except ValueError:
+        return response.text
+
+
+def set_up_query(category: str, accounts_filter: dict = {}, fields: List[str] = None) -> (str, dict):
+    """Retrieve the proper url and initial parameters for a given category.
+    The analytics queries always project the selected metrics, the listings only project the selected fields when there is a selection.
+
+    :param list fields: fields selected for the category, see api_format.get_field_names (None for all of them)
 
     :returns: URL and initial parameters for the GET query
     :retype: tuple
     """
     url = {
-        "ACCOUNT": "https://api.linkedin.com/v2/adAccountsV2",
-        "GROUP": "https://api.linkedin.com/v2/adCampaignGroupsV2",
-        "CAMPAIGN": "https://api.linkedin.com/v2/adCampaignsV2/",
-        "CAMPAIGN_ANALYTICS": "https://api.linkedin.com/v2/adAnalyticsV2",
-        "CREATIVES": "https://api.linkedin.com/v2/adCreativesV2/",
-        "CREATIVES_ANALYTICS": "https://api.linkedin.com/v2/adAnalyticsV2"
+        "ACCOUNT": Constants.API_URL + "/adAccountsV2",
+        "GROUP": Constants.API_URL + "/adCampaignGroupsV2",
+        "CAMPAIGN": Constants.API_URL + "/adCampaignsV2/",
+        "CAMPAIGN_ANALYTICS": Constants.API_URL + "/adAnalyticsV2",
+        "CREATIVES": Constants.API_URL + "/adCreativesV2/",
+        "CREATIVES_ANALYTICS": Constants.API_URL + "/adAnalyticsV2",
+        "CREATIVES_ANALYTICS_BY_CAMPAIGN": Constants.API_URL + "/adAnalyticsV2"
     }
     if category == Category.ACCOUNT:
-        params = {"q": "search"}
+        params = accounts_filter or {"q": "search"}
     elif category == Category.GROUP or category == Category.CAMPAIGN or category == Category.CREATIVE:
-        params = accounts_filter
+        params = accounts_filter if fields is None else {**accounts_filter, "projection": get_projection(get_field_names(category, fields))}
     elif category == Category.CAMPAIGN_ANALYTICS:
         params = {
             "q": "analytics",
@@ -204,18 +600,18 @@ def set_up_query(category: str, accounts_filter: dict = {}) -> (str, dict):
             "dateRange.start.month": "1",
             "dateRange.start.year": "2006",
             "timeGranularity": "DAILY",
-            "projection": "(*,elements*(dateRange(*),costInUsd,impressions,clicks,externalWebsitePostClickConversions,externalWebsitePostViewConversions,pivotValue~(localizedName)))",
-            "fields": "dateRange,costInUsd,impressions,clicks,externalWebsitePostClickConversions,externalWebsitePostViewConversions,pivotValue"
+            "projection": get_projection(get_field_names(category, fields)),
+            "fields": ",".join(get_field_names(category, fields))
         }
-    elif category == Category.CREATIVE_ANALYTICS:
+    elif category == Category.CREATIVE_ANALYTICS or category == Category.CREATIVE_ANALYTICS_BY_CAMPAIGN:
         params = {"q": "analytics",
                   "pivot": "CREATIVE",
                   "dateRange.start.day": "1",
                   "dateRange.start.month": "1",
                   "dateRange.start.year": "2006",
                   "timeGranularity": "DAILY",
-                  "projection": "(*,elements*(dateRange(*),costInUsd,impressions,clicks,externalWebsitePostClickConversions,externalWebsitePostViewConversions,pivotValue~(localizedName)))",
-                  "fields": "dateRange,costInUsd,impressions,clicks,externalWebsitePostClickConversions,externalWebsitePostViewConversions,pivotValue"
+                  "projection": get_projection(get_field_names(Category.CREATIVE_ANALYTICS, fields)),
+                  "fields": ",".join(get_field_names(Category.CREATIVE_ANALYTICS, fields))
                   }
     else:
         raise ValueError("category value is not valid : should be either ACCOUNT, GROUP, CAMPAIGN, CAMPAIGN_ANALYTICS, CREATIVES or CREATIVES_ANALYTICS")
@@ -223,6 +619,15 @@ def set_up_query(category: str, accounts_filter: dict = {}) -> (str, dict):
     return url, params
 
 
+def get_projection(field_names: List[str]) -> str:
+    """Projection of the query, restricting the elements to the given fields and keeping the other parts of the response (paging)
+
+    :returns: projection, ex - (*,elements*(id,name))
+    :rtype: str
+    """
+    return "(*,elements*({}))".format(",".join(field_names))
+
+
 def set_accounts_filter(account_ids: list) -> dict:
     """Given a list of account ids, returns parameters with corresponding filters.
 
@@ -235,6 +640,18 @@ def set_accounts_filter(account_ids: list) -> dict:
     return accounts_filter
 
 
+def set_account_ids_filter(account_ids: list) -> dict:
+    """Given a list of account ids, returns parameters to search these accounts only.
+
+    :returns: Parameters used to filter the query of the accounts
+    :rtype: dict
+    """
+    account_ids_filter = {"q": "search"}
+    for i, account_id in enumerate(account_ids):
+        account_ids_filter["search.id.values[{}]".format(i)] = str(int(account_id))
+    return account_ids_filter
+
+
 def date_filter(param: dict(), start_date: datetime, end_date: datetime) -> dict:
     """Update the query parameters with the chosen timerange
 
@@ -261,9 +678,10 @@ def get_analytics_parameters(ids: list, category: str) -> dict:
 
     params = {}
     key_prefix = {"GROUP": "", "CAMPAIGN": "search.campaignGroup.values[{}]", "CAMPAIGN_ANALYTICS": "campaigns[{}]",
-                  "CREATIVES": "search.campaign.values[{}]", "CREATIVES_ANALYTICS": "creatives[{}]"}
+                  "CREATIVES": "search.campaign.values[{}]", "CREATIVES_ANALYTICS": "creatives[{}]", "CREATIVES_ANALYTICS_BY_CAMPAIGN": "campaigns[{}]"}
     urn_prefix = {"GROUP": "", "CAMPAIGN": "urn:li:sponsoredCampaignGroup:", "CAMPAIGN_ANALYTICS": "urn:li:sponsoredCampaign:",
-                  "CREATIVES": "urn:li:sponsoredCampaign:", "CREATIVES_ANALYTICS": "urn:li:sponsoredCreative:"}
+                  "CREATIVES": "urn:li:sponsoredCampaign:", "CREATIVES_ANALYTICS": "urn:li:sponsoredCreative:",
+                  "CREATIVES_ANALYTICS_BY_CAMPAIGN": "urn:li:sponsoredCampaign:"}
     for i, id_value in enumerate(ids):
         params[key_prefix[category].format(str(i))] = urn_prefix[category] + str(id_value)
     return params
@@ -0,0 +1,77 @@
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from checkpoint_store import CheckpointStore
+from dku_constants import Constants
+from request_scheduler import RequestScheduler
+from response_cache import ResponseCache
+from run_metrics import RunMetrics
+
+
+class LinkedinClient(object):
+    """HTTP client shared by every query of a recipe run.
+    It owns a pooled requests.Session, so that consecutive queries to the LinkedIn API reuse
+    the same keep-alive connections instead of paying a new TCP+TLS handshake each time.
+    The stages of a run have their own pool of threads, so the queries in flight are bounded by a semaphore shared by all of them.
+
+    :param dict headers: Headers of the GET queries, it contains the access token for the OAuth2 identification
+    :param int max_workers: Max number of queries in flight at once, all stages together
+    :param int pool_size: Max number of connections kept alive per host. At least max_workers
+    :param RequestScheduler scheduler: Throttles and retries the queries of every worker (default scheduler if None)
+    :param ResponseCache cache: Cache of the entity listings (no cache if None)
+    :param str api_url: Root url of the API the queries are sent to, ex - a local stand-in of the LinkedIn API for the benchmarks
+    :param RunMetrics metrics: Collector of the telemetry of the queries (new collector if None)
+    :param CheckpointStore checkpoints: Responses of the queries finished by a previous run, to resume it (no checkpoints if None)
+    """
+
+    def __init__(self, headers: dict, max_workers: int = Constants.DEFAULT_MAX_WORKERS, pool_size: int = Constants.DEFAULT_POOL_SIZE,
+                 scheduler: RequestScheduler = None, cache: ResponseCache = None, api_url: str = Constants.API_URL,
+                 metrics: RunMetrics = None, checkpoints: CheckpointStore = None):
+        self.api_url = api_url
+        self.scheduler = scheduler or RequestScheduler()
+        self.cache = cache
+        self.metrics = metrics or RunMetrics()
+        self.checkpoints = checkpoints
+        self.max_workers = max(1, max_workers)
+        self.pool_size = max(pool_size, self.max_workers)
+        self.semaphore = threading.BoundedSemaphore(self.max_workers)
+        self.session = requests.Session()
+        self.session.headers.update({"Accept-Encoding": "gzip, deflate", "Connection": "keep-alive"})
+        self.session.headers.update(headers)
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def get(self, url: str, parameters: dict) -> requests.Response:
+        """Performs a GET query on one of the pooled connections, once the scheduler allows it and a slot is free
+
+        :returns: raw response of the API
+        :rtype: requests.Response
+        """
+        url = rebase_url(url, self.api_url)
+        return self.scheduler.send(lambda: self.send(url, parameters))
+
+    def send(self, url: str, parameters: dict) -> requests.Response:
+        with self.semaphore:
+            return self.session.get(url=url, params=parameters)
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def rebase_url(url: str, api_url: str) -> str:
+    """Send a query url of the LinkedIn API to another root url
+
+    :rtype: str
+    """
+    if api_url == Constants.API_URL or not url.startswith(Constants.API_URL):
+        return url
+    return api_url.rstrip("/") + url[len(Constants.API_URL):]
@@ -1,21 +1,35 @@
+import json
 import pandas as pd
 import logging
-from typing import List
+import time
+from decimal import Decimal, InvalidOperation
+from typing import Iterable, Iterator, List
 
-from dku_constants import COLUMN_NAMES_DICT
+from dku_constants import COLUMN_STORAGE_TYPES_DICT, FIELD_STORAGE_TYPES_DICT, FIELDS_DICT, FLAT_COLUMNS_DICT, ColumnType
+from run_metrics import RunMetrics
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-def format_to_df(request_query: dict, category: str, raw_response: bool) -> pd.DataFrame:
+
+def format_to_df(request_query: dict, category: str, raw_response: bool, flatten: bool = False, metrics: RunMetrics = None,
+                 fields: List[str] = None) -> pd.DataFrame:
     """Format the elements returned from the query
 
     :param dict request_query:  response from the LinkedIn API
     :param str category: granularity of the data that you want to get -> ACCOUNT, GROUP, CAMPAIGN, CREATIVES, CAMPAIGN_ANALYTICS, CREATIVES_ANALYTICS
-    :param bool raw_response: true if the user wants to retrieve raw response in a separate column
+    :param bool raw_response: true if the user wants to retrieve raw response in a separate column, as compact JSON
+    :param bool flatten: true to replace the nested columns by typed columns, see flatten_df
+    :param RunMetrics metrics: collector of the time spent and rows produced (None to skip)
+    :param list fields: fields selected for the category, see get_field_names (None for all of them)
 
     :returns: a formatted dataframe
     :rtype: pd.Dataframe
     """
-    api_column_names = build_column_names(category, raw_response)
+    start_time = time.perf_counter()
+    api_column_names = build_column_names(category, raw_response, fields)
 
     logger = logging.getLogger()
     logging.basicConfig(level=logging.INFO, format="LinkedIn Marketing plugin %(levelname)s - %(message)s")
@@ -23,8 +37,9 @@ def format_to_df(request_query: dict, category: str, raw_response: bool) -> pd.D
 
     elements = request_query.get("elements", None)
     if elements:
-        elements = add_raw_response(raw_response, elements)
-        df = pd.DataFrame(request_query["elements"], columns=api_column_names)
+        df = pd.DataFrame(elements, columns=api_column_names)
+        if raw_response:
+            df["raw_response"] = get_raw_responses(elements)
     elif "elements" in request_query:
         df = pd.DataFrame(columns=api_column_names)
     else:
@@ -35,30 +50,212 @@ def format_to_df(request_query: dict, category: str, raw_response: bool) -> pd.D
         else:
             output = {"exception": exception_message}
         df = pd.DataFrame(output, columns=api_column_names, index=range(1))
+    if flatten:
+        df = flatten_df(df, category)
+    if metrics:
+        metrics.record_operation("format_to_df", category, time.perf_counter() - start_time, len(df))
     logger.info("Formatting API results: Done.")
     return df
 
 
-def build_column_names(category: str, raw_response: bool) -> List[str]:
+def iter_format_to_df(request_queries: Iterable[dict], category: str, raw_response: bool, flatten: bool = False,
+                      metrics: RunMetrics = None, fields: List[str] = None) -> Iterator[pd.DataFrame]:
+    """Format the elements of each page or batch returned from the API, as they arrive
+
+    :param request_queries: responses from the LinkedIn API
+    :returns: a formatted dataframe for each response
+    :rtype: generator
+    """
+    for request_query in request_queries:
+        yield format_to_df(request_query, category, raw_response, flatten, metrics, fields)
+
+
+def flatten_df(df: pd.DataFrame, category: str) -> pd.DataFrame:
+    """Replace the nested columns (dicts and URNs) by flat typed columns, as declared in FLAT_COLUMNS_DICT.
+    Ex - dateRange -> date (datetime), pivotValue -> id of the campaign or creative (int), costInUsd -> float
+
+    :returns: the flattened dataframe
+    :rtype: pd.Dataframe
+    """
+    flat_columns = get_flat_columns_by_source(category)
+    output = {}
+    for column in df.columns:
+        if column in flat_columns:
+            for column_name, source_path, column_type in flat_columns[column]:
+                output[column_name] = cast_column(get_nested_values(df[column], source_path.split(".")[1:]), column_type)
+        else:
+            output[column] = df[column]
+    return pd.DataFrame(output, index=df.index)
+
+
+def get_flat_columns_by_source(category: str) -> dict:
+    """Flattened columns of FLAT_COLUMNS_DICT replacing each source column
+
+    :returns: list of (output column, path of the source value, type) by source column
+    :rtype: dict
+    """
+    flat_columns = {}
+    for column_name, source_path, column_type in FLAT_COLUMNS_DICT.get(category, []):
+        source_column = source_path.split(".")[0]
+        flat_columns.setdefault(source_column, []).append((column_name, source_path, column_type))
+    return flat_columns
+
+
+def get_output_schema(category: str, raw_response: bool, flatten: bool = False, fields: List[str] = None) -> List[dict]:
+    """Schema of the dataset of a category, declared before the first batch is written.
+    Inferred from the first batch, the types would depend on its values, ex - an exception column or a metric without values read as double
+
+    :param list fields: fields selected for the category (None for all of them)
+    :returns: name and DSS storage type of each column, in the order of the formatted dataframes
+    :rtype: list
+    """
+    flat_columns = get_flat_columns_by_source(category) if flatten else {}
+    schema = []
+    for column in build_column_names(category, raw_response, fields):
+        if column in flat_columns:
+            schema.extend({"name": column_name, "type": COLUMN_STORAGE_TYPES_DICT[column_type]} for column_name, _, column_type in flat_columns[column])
+        else:
+            schema.append({"name": column, "type": FIELD_STORAGE_TYPES_DICT.get(column, "string")})
+    return schema
+
+
+def get_nested_values(values: pd.Series, keys: List[str]) -> pd.Series:
+    """Get the nested value at the given keys of each dict of a column (NaN if missing)"""
+    for key in keys:
+        if values.dtype != object:
+            return pd.Series(None, index=values.index, dtype=object)
+        values = values.str.get(key)
+    return values
+
+
+def cast_column(values: pd.Series, column_type: str) -> pd.Series:
+    """Convert the values of a column to a flat type of ColumnType"""
+    if column_type == ColumnType.DATE:
+        dates = pd.DataFrame({part: get_nested_values(values, [part]) for part in ["year", "month", "day"]})
+        return pd.to_datetime(dates, errors="coerce")
+    elif column_type == ColumnType.TIMESTAMP:
+        return pd.to_datetime(pd.to_numeric(values, errors="coerce"), unit="ms", errors="coerce")
+    elif column_type == ColumnType.URN:
+        return pd.to_numeric(values.astype("string").str.rsplit(":", n=1).str[-1], errors="coerce").astype("Int64")
+    else:
+        return pd.to_numeric(values, errors="coerce").astype(column_type)
+
+
+def roll_up_creative_analytics(request_query: dict, creative_campaigns: pd.Series, batch_campaigns: list = None) -> dict:
+    """Campaign analytics of a response of creative analytics: the metrics of the creatives of each campaign are summed by day.
+    The metrics sent as strings, ex - costInUsd, are summed as decimals and kept in the string format of the API.
+    The creatives missing from creative_campaigns belong to the campaign of the query if it filters a single one, otherwise they are left out,
+    see has_unknown_creatives. The responses in error are returned as they are.
+
+    :param pd.Series creative_campaigns: URN of the campaign of each creative id, see ParentIds.get_campaign_urns
+    :param list batch_campaigns: ids of the campaigns filtering the query (None if unknown)
+    :returns: response with the elements of the campaign analytics
+    :rtype: dict
+    """
+    elements = request_query.get("elements", None)
+    if not elements:
+        return request_query
+    analytics = pd.DataFrame(elements)
+    metric_columns = [column for column in analytics.columns if column not in ["pivotValue", "dateRange"]]
+    text_columns = [column for column in metric_columns if analytics[column].map(lambda value: isinstance(value, str)).any()]
+    start_dates = analytics["dateRange"].str.get("start")
+    campaign_urns = get_urn_ids(analytics["pivotValue"]).map(creative_campaigns)
+    if batch_campaigns is not None and len(batch_campaigns) == 1:
+        campaign_urns = campaign_urns.fillna("urn:li:sponsoredCampaign:{}".format(batch_campaigns[0]))
+    group_keys = [
+        campaign_urns.rename("pivotValue"),
+        start_dates.str.get("year").rename("year"),
+        start_dates.str.get("month").rename("month"),
+        start_dates.str.get("day").rename("day")
+    ]
+    metrics = analytics[metric_columns].apply(pd.to_numeric, errors="coerce")
+    for column in text_columns:
+        metrics[column] = analytics[column].map(to_decimal)
+    metrics["dateRange"] = analytics["dateRange"]
+    campaign_analytics = metrics.groupby(group_keys, sort=False).agg({**{column: "sum" for column in metric_columns}, "dateRange": "first"})
+    for column in text_columns:
+        campaign_analytics[column] = campaign_analytics[column].map(lambda value: format(value, "f"))
+    unknown_creatives = group_keys[0].isna().sum()
+    if unknown_creatives:
+        logger = logging.getLogger()
+        logger.warning("{} analytics rows of creatives missing from the creatives listing are left out of the campaign analytics".format(unknown_creatives))
+    return {**request_query, "elements": campaign_analytics.reset_index()[["pivotValue", "dateRange"] + metric_columns].to_dict("records")}
+
+
+def to_decimal(value) -> Decimal:
+    """Exact value of a metric sent as a string, 0 if missing or invalid"""
+    if pd.isna(value):
+        return Decimal(0)
+    try:
+        return Decimal(str(value))
+    except InvalidOperation:
+        return Decimal(0)
+
+
+def has_unknown_creatives(request_query: dict, creative_campaigns: pd.Series) -> bool:
+    """Check if a response of creative analytics has rows of creatives missing from creative_campaigns, ex - created after the creatives listing
+
+    :param pd.Series creative_campaigns: URN of the campaign of each creative id, see ParentIds.get_campaign_urns
+    :rtype: bool
+    """
+    elements = request_query.get("elements", None)
+    if not elements:
+        return False
+    creative_ids = get_urn_ids(pd.Series([element.get("pivotValue") for element in elements], dtype=object))
+    return not creative_ids.isin(creative_campaigns.index).all()
+
+
+def get_urn_ids(urns: pd.Series) -> pd.Series:
+    """Extract the numeric ids of URNs such as urn:li:sponsoredCampaign:123"""
+    return pd.to_numeric(urns.astype("string").str.rsplit(":", n=1).str[-1], errors="coerce")
+
+
+def has_exception(df: pd.DataFrame) -> bool:
+    """Check if a formatted dataframe reports an API error instead of data"""
+    return "exception" in df.columns and df["exception"].notna().any()
+
+
+def build_column_names(category: str, raw_response: bool, fields: List[str] = None) -> List[str]:
     """Retrieve the column names
 
+    :param list fields: fields selected for the category (None for all of them)
     :returns: column names
     :rtype: list
     """
-    api_column_names = COLUMN_NAMES_DICT[category]
+    api_column_names = get_field_names(category, fields) + ["exception"]
     if raw_response:
         api_column_names.append("raw_response")
     return api_column_names
 
 
-def add_raw_response(raw_response: bool, elements: List[bool]) -> List[bool]:
-    """Add a field with the raw response (json)
-    :param List[bool] elements:  elements retrieved by the GET query
+def get_field_names(category: str, fields: List[str] = None) -> List[str]:
+    """Fields of a category to query and to output: the required ones of FIELDS_DICT and the selected ones, in the order of FIELDS_DICT
 
-    :returns: elements with a raw_response field (when relevant)
-    :rtype: List[bool]
+    :param list fields: fields selected for the category (None for all of them)
+    :returns: field names
+    :rtype: list
     """
-    if raw_response:
-        for i in range(len(elements)):
-            elements[i]["raw_response"] = str(elements[i])
-    return elements
+    return [field for field, required in FIELDS_DICT[category] if required or fields is None or field in fields]
+
+
+def get_raw_responses(elements: List[dict]) -> List[str]:
+    """Compact JSON of each element, without modifying the elements
+
+    :returns: one JSON document per element
+    :rtype: list
+    """
+    return [dump_json(element).decode("utf-8") for element in elements]
+
+
+def dump_json(value) -> bytes:
+    """Serialize to compact JSON, with orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, separators=(",", ":")).encode("utf-8")
+
+
+def load_json(content: bytes):
+    """Parse JSON bytes, with orjson when it is installed"""
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
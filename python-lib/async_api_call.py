@@ -0,0 +1,213 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from datetime import date, datetime
+from itertools import islice
+from typing import AsyncIterator, Awaitable, Callable, Iterable, List, Tuple
+
+import numpy as np
+
+from api_call import (get_batch_error, get_chunk_parameters, get_next_page_starts, get_parent_error, get_query_error, get_stored_response,
+                      has_stored_responses, merge_outputs, parse_response, set_up_analytics_queries, set_up_query, split_chunk, store_response)
+from async_client import AsyncLinkedinClient
+from dku_constants import Constants
+from parent_ids import ParentIds
+
+logger = logging.getLogger()
+
+
+# Async backend: the same queries as api_call, as coroutines run on the event loop of an AsyncLinkedinClient.
+# The pages and batches are all tasks of the loop, the semaphore of the client bounds the queries in flight.
+# The parameters, the splits of the batches and the handling of the responses are the helpers of api_call,
+# only the scheduling of the queries is specific to the loop.
+
+
+async def query_ads(client: AsyncLinkedinClient, category: str, accounts_filter: dict, fields: List[str] = None) -> dict:
+    """Query the LinkedIn ad API. LinkedIn ad handles pagination, see api_call.query_ads
+
+    :returns: Response of the API
+    :rtype: dict
+    """
+    url, params = set_up_query(category, accounts_filter, fields)
+    return await query_with_pagination(url, client, params, cache_category=category)
+
+
+async def query_ad_analytics(client: AsyncLinkedinClient, category: str, parent: ParentIds, batch_size: int = Constants.DEFAULT_BATCH_SIZE,
+                             start_date: datetime = None, end_date: datetime = None,
+                             rows_per_id_per_day: float = Constants.DEFAULT_ROWS_PER_ID_PER_DAY, fields: List[str] = None) -> dict:
+    """Query the ad analytics API by batches of ids and time windows, see api_call.query_ad_analytics
+
+    :returns: Response of the API
+    :rtype: dict
+    """
+    response = {"elements": [], "exception": []}
+    async for query_output in iter_ad_analytics(client, category, parent, batch_size, start_date, end_date, rows_per_id_per_day, fields):
+        if "elements" not in query_output:
+            return query_output
+        response["elements"].extend(query_output["elements"])
+    return response
+
+
+async def iter_ad_analytics(client: AsyncLinkedinClient, category: str, parent: ParentIds, batch_size: int = Constants.DEFAULT_BATCH_SIZE,
+                            start_date: datetime = None, end_date: datetime = None,
+                            rows_per_id_per_day: float = Constants.DEFAULT_ROWS_PER_ID_PER_DAY, fields: List[str] = None) -> AsyncIterator[dict]:
+    """Query the ad analytics API batch by batch, see query_ad_analytics
+
+    :returns: Response of the API for each batch query
+    :rtype: async generator
+    """
+    parent_error = get_parent_error(parent)
+    if parent_error:
+        yield parent_error
+    else:
+        url, initial_params, analytics_requests = set_up_analytics_queries(category, parent, batch_size, start_date, end_date, rows_per_id_per_day, fields)
+        if not analytics_requests:
+            yield {"elements": []}
+        async for query_output in iter_batches(analytics_requests, category, url, client, initial_params):
+            yield query_output
+
+
+async def query_with_pagination(url: str, client: AsyncLinkedinClient, parameters: dict, page_size: int = 100, cache_category: str = None) -> dict:
+    """Handles queries with pagination, see api_call.query_with_pagination
+
+    :returns: Response of the API
+    :rtype: dict
+    """
+    pages = iter_pages(url, client, parameters, page_size, cache_category)
+    response = await pages.__anext__()
+    async for page in pages:
+        if "elements" not in page:
+            await pages.aclose()
+            return page
+        response["elements"].extend(page["elements"])
+    return response
+
+
+async def iter_pages(url: str, client: AsyncLinkedinClient, parameters: dict, page_size: int = 100, cache_category: str = None) -> AsyncIterator[dict]:
+    """Handles queries with pagination page by page. Once the total is known from the first page, the remaining pages are queried concurrently.
+    The iteration stops after the first page in error.
+
+    :returns: Response of the API for each page
+    :rtype: async generator
+    """
+    start_time = time.perf_counter()
+    rows = 0
+    try:
+        first_page_parameters = {**parameters, "count": str(page_size)}
+        response = await query(url, client, first_page_parameters, cache_category)
+        paging = response.get("paging", None)
+        if not paging:
+            response["exception"] = response
+            yield response
+            return
+        rows += len(response.get("elements", []))
+        yield response
+        starts = get_next_page_starts(paging, page_size)
+        async for page in iter_concurrently(lambda start: query(url, client, {**first_page_parameters, "start": str(start)}, cache_category), starts,
+                                            client.max_workers):
+            rows += len(page.get("elements", []))
+            yield page
+            if "elements" not in page:
+                return
+    finally:
+        client.metrics.record_operation("pagination", cache_category, time.perf_counter() - start_time, rows)
+
+
+async def query_by_batch(analytics_requests: List[Tuple[np.ndarray, date, date]], category: str, url: str, client: AsyncLinkedinClient,
+                         initial_params: dict) -> dict:
+    """Perfom a batch get query with multiple filters, see api_call.query_by_batch
+
+    :returns : API's response
+    :rtype: dict
+    """
+    response = {"elements": [], "exception": []}
+    async for query_output in iter_batches(analytics_requests, category, url, client, initial_params):
+        if "elements" not in query_output:
+            return query_output
+        response["elements"].extend(query_output["elements"])
+    return response
+
+
+async def iter_batches(analytics_requests: List[Tuple[np.ndarray, date, date]], category: str, url: str, client: AsyncLinkedinClient,
+                       initial_params: dict) -> AsyncIterator[dict]:
+    """Perfom the batch get queries one by one, see query_by_batch.
+    The iteration stops after the first query in error.
+
+    :returns : API's response for each query, in the order of the requests
+    :rtype: async generator
+    """
+    start_time = time.perf_counter()
+    rows = 0
+    try:
+        async for query_output in iter_concurrently(lambda analytics_request: query_chunk(*analytics_request, category, url, client, initial_params),
+                                                    analytics_requests, client.max_workers):
+            batch_error = get_batch_error(query_output)
+            if batch_error:
+                yield batch_error
+                return
+            rows += len(query_output["elements"])
+            yield query_output
+    finally:
+        client.metrics.record_operation("batch queries", category, time.perf_counter() - start_time, rows)
+
+
+async def iter_concurrently(function: Callable[..., Awaitable], items: Iterable, max_workers: int) -> AsyncIterator:
+    """Run a coroutine function on each item as tasks of the event loop, and yield the results in the order of the items.
+    At most twice max_workers results are pending at once, so that a slow consumer bounds the memory used.
+    The tasks still pending are cancelled if the iteration stops early.
+
+    :rtype: async generator
+    """
+    items = iter(items)
+    pending = deque(asyncio.ensure_future(function(item)) for item in islice(items, 2 * max_workers))
+    try:
+        while pending:
+            result = await pending.popleft()
+            for item in islice(items, 1):
+                pending.append(asyncio.ensure_future(function(item)))
+            yield result
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def query_chunk(chunk: list, window_start: date, window_end: date, category: str, url: str, client: AsyncLinkedinClient, initial_params: dict) -> dict:
+    """Query the analytics of a chunk of ids over a time window, see api_call.query_chunk.
+    Both halves of a chunk which would return too many entities are queried concurrently.
+
+    :returns : API's response
+    :rtype: dict
+    """
+    params = get_chunk_parameters(chunk, window_start, window_end, category, initial_params)
+    query_output = await query(url, client, params)
+    halves = split_chunk(query_output, chunk, window_start, window_end)
+    if halves:
+        return merge_outputs(await asyncio.gather(*[query_chunk(*half, category, url, client, initial_params) for half in halves]))
+    if "elements" in query_output and not query_output["elements"]:
+        logger.debug("Empty output for params: " + str(params))
+    return query_output
+
+
+async def query(url: str, client: AsyncLinkedinClient, parameters: dict, cache_category: str = None) -> dict:
+    """Performs the get query on the session of the client, see api_call.query.
+    The cache files and the checkpoints are read and written by the default executor of the loop, so that their I/O never blocks it
+
+    :returns: API's response
+    :rtype: dict
+    """
+    loop = asyncio.get_running_loop()
+    stored_responses = has_stored_responses(client, cache_category)
+    if stored_responses:
+        stored_response = await loop.run_in_executor(None, get_stored_response, url, client, parameters, cache_category)
+        if stored_response is not None:
+            return stored_response
+    start_time = time.perf_counter()
+    try:
+        response = await client.fetch(url, parameters)
+    except Exception as err:
+        raise get_query_error(url, client, parameters, cache_category, err, time.perf_counter() - start_time)
+    json_response = parse_response(url, client, parameters, cache_category, response, time.perf_counter() - start_time)
+    if stored_responses and response.status_code < 400:
+        await loop.run_in_executor(None, store_response, url, client, parameters, cache_category, json_response)
+    return json_response
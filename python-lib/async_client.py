@@ -0,0 +1,119 @@
+import asyncio
+import json
+import threading
+from typing import AsyncIterator, Awaitable, Iterator
+
+from api_client import rebase_url
+from checkpoint_store import CheckpointStore
+from dku_constants import Constants
+from request_scheduler import RequestScheduler
+from response_cache import ResponseCache
+from run_metrics import RunMetrics
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+class AsyncResponse(object):
+    """Response of the async backend, read in full. It exposes the same attributes as a requests.Response"""
+
+    def __init__(self, status_code: int, headers, content: bytes):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class AsyncLinkedinClient(object):
+    """HTTP client of the async backend. The queries are coroutines run by an event loop in a background thread,
+    on a single aiohttp session, so that many small queries are in flight without a thread for each of them.
+    It can be shared by several threads: run and iterate block until the coroutines they submit are done.
+
+    :param dict headers: Headers of the GET queries, it contains the access token for the OAuth2 identification
+    :param int max_workers: Max number of queries in flight at once, all stages together, bounded by a semaphore
+    :param int pool_size: Max number of connections kept alive. At least max_workers
+    :param RequestScheduler scheduler: Throttles and retries the queries (default scheduler if None)
+    :param ResponseCache cache: Cache of the entity listings (no cache if None)
+    :param str api_url: Root url of the API the queries are sent to, see LinkedinClient
+    :param RunMetrics metrics: Collector of the telemetry of the queries (new collector if None)
+    :param CheckpointStore checkpoints: Responses of the queries finished by a previous run, see LinkedinClient
+    :raises: :class:`ValueError`: aiohttp is not installed
+    """
+
+    def __init__(self, headers: dict, max_workers: int = Constants.DEFAULT_MAX_WORKERS, pool_size: int = Constants.DEFAULT_POOL_SIZE,
+                 scheduler: RequestScheduler = None, cache: ResponseCache = None, api_url: str = Constants.API_URL,
+                 metrics: RunMetrics = None, checkpoints: CheckpointStore = None):
+        if aiohttp is None:
+            raise ValueError("The async backend requires aiohttp, please add it to the code environment of the plugin")
+        self.headers = headers
+        self.api_url = api_url
+        self.scheduler = scheduler or RequestScheduler()
+        self.cache = cache
+        self.metrics = metrics or RunMetrics()
+        self.checkpoints = checkpoints
+        self.max_workers = max(1, max_workers)
+        self.pool_size = max(pool_size, self.max_workers)
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.session, self.semaphore = self.run(self.open())
+
+    async def open(self):
+        connector = aiohttp.TCPConnector(limit=self.pool_size)
+        session = aiohttp.ClientSession(connector=connector, headers={"Accept-Encoding": "gzip, deflate", **self.headers})
+        return session, asyncio.Semaphore(self.max_workers)
+
+    async def fetch(self, url: str, parameters: dict) -> AsyncResponse:
+        """Performs a GET query once the scheduler allows it and a slot is free
+
+        :returns: raw response of the API
+        :rtype: AsyncResponse
+        """
+        return await self.scheduler.send_async(lambda: self.send(url, parameters))
+
+    async def send(self, url: str, parameters: dict) -> AsyncResponse:
+        async with self.semaphore:
+            async with self.session.get(rebase_url(url, self.api_url), params={key: str(value) for key, value in parameters.items()}) as response:
+                return AsyncResponse(response.status, response.headers, await response.read())
+
+    def get(self, url: str, parameters: dict) -> AsyncResponse:
+        """Blocking GET query, so that the functions of api_call also accept this client"""
+        return self.run(self.fetch(url, parameters))
+
+    def run(self, coroutine: Awaitable):
+        """Run a coroutine on the event loop of the client and wait for its result"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def iterate(self, async_iterator: AsyncIterator) -> Iterator:
+        """Consume an async iterator from a regular thread, item by item
+
+        :rtype: generator
+        """
+        try:
+            while True:
+                try:
+                    yield self.run(async_iterator.__anext__())
+                except StopAsyncIteration:
+                    return
+        finally:
+            self.run(async_iterator.aclose())
+
+    def close(self):
+        self.run(self.session.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
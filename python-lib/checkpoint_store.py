@@ -0,0 +1,94 @@
+import hashlib
+import json
+import logging
+import threading
+from datetime import datetime
+from typing import List
+
+from dataset_writer import DatasetStreamWriter
+from dku_constants import Constants
+
+logger = logging.getLogger()
+
+
+class CheckpointStore(object):
+    """Responses of the finished queries of a run (pages of the listings, chunks of analytics), kept in a managed folder
+    until the run succeeds, so that a run failing partway can be resumed: its rerun skips the queries already done.
+    The checkpoints of each category are stored under a fingerprint of the settings of the run, so that a rerun
+    with other accounts, another time range or another batch size starts from scratch.
+
+    :param dataiku.Folder folder: Folder storing the checkpoints
+    :param list account_ids: IDs of the sponsored ad accounts of the run
+    :param datetime start_date: First day of the time range (None for all time)
+    :param datetime end_date: Last day of the time range (None for today). An open end is fingerprinted as such, so that a failed run
+        can be resumed on the next days: the analytics queries already carry the concrete dates
+    :param int batch_size: Number of ids by batch query
+    """
+
+    def __init__(self, folder, account_ids: list, start_date: datetime = None, end_date: datetime = None, batch_size: int = Constants.DEFAULT_BATCH_SIZE):
+        self.folder = folder
+        self.run_settings = [sorted(str(account_id).strip() for account_id in account_ids), format_date(start_date),
+                             format_date(end_date) or "open", batch_size]
+        self.lock = threading.Lock()
+        self.resumed_queries = 0
+        self.paths = {path.lstrip("/") for path in folder.list_paths_in_partition() if path.lstrip("/").startswith(Constants.CHECKPOINT_DIRECTORY)}
+        if self.paths:
+            logger.info("{} checkpoints found, the queries of a previous run with the same settings will be skipped".format(len(self.paths)))
+
+    def get(self, category: str, url: str, parameters: dict) -> dict:
+        """Retrieve the response of a query finished by a previous run
+
+        :returns: the response, or None if the query has to be sent
+        :rtype: dict
+        """
+        path = self.get_path(category, url, parameters)
+        if path not in self.paths:
+            return None
+        try:
+            response = self.folder.read_json(path)
+        except Exception as err:
+            logger.warning("Could not read the checkpoint of {}: {}".format(url, err))
+            return None
+        with self.lock:
+            self.resumed_queries += 1
+        return response
+
+    def set(self, category: str, url: str, parameters: dict, response: dict):
+        path = self.get_path(category, url, parameters)
+        try:
+            self.folder.write_json(path, response)
+        except Exception as err:
+            logger.warning("Could not save the checkpoint of {}: {}".format(url, err))
+            return
+        with self.lock:
+            self.paths.add(path)
+
+    def finish(self, writers: List[DatasetStreamWriter]):
+        """Remove the checkpoints if the run succeeded, i.e. no output reported an error. Otherwise they are kept for the rerun
+
+        :param list writers: closed writer of each output of the run
+        """
+        if any(writer.has_exception for writer in writers):
+            logger.info("The run reported errors, {} checkpoints are kept to resume it".format(len(self.paths)))
+        else:
+            self.clear()
+
+    def clear(self):
+        """Remove all the checkpoints, once the run succeeded"""
+        if self.resumed_queries:
+            logger.info("{} queries were resumed from the checkpoints of a previous run".format(self.resumed_queries))
+        self.folder.delete_path(Constants.CHECKPOINT_DIRECTORY)
+        self.paths = set()
+
+    def get_fingerprint(self, category: str) -> str:
+        """Hash of the accounts, time range and batch size of the run, and of the category"""
+        return hashlib.sha256(json.dumps(self.run_settings + [category]).encode("utf-8")).hexdigest()[:16]
+
+    def get_path(self, category: str, url: str, parameters: dict) -> str:
+        normalized_parameters = sorted((str(key), str(value)) for key, value in parameters.items())
+        key = hashlib.sha256(json.dumps([url.rstrip("/"), normalized_parameters]).encode("utf-8")).hexdigest()
+        return "{}/{}/{}.json".format(Constants.CHECKPOINT_DIRECTORY, self.get_fingerprint(category), key)
+
+
+def format_date(value: datetime) -> str:
+    return value.strftime("%Y-%m-%d") if value else None
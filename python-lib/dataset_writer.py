@@ -0,0 +1,160 @@
+import logging
+import os
+from contextlib import ExitStack
+from typing import Dict, Iterable, Iterator, List
+
+import pandas as pd
+
+from api_format import has_exception
+from dku_constants import Constants
+
+logger = logging.getLogger()
+
+
+class DatasetStreamWriter(object):
+    """Writes an output dataset chunk by chunk, as the pages or batches of the API arrive,
+    so that only the current chunk is kept in memory. The schema is set when the first chunk is written.
+
+    :param dataiku.Dataset dataset: output dataset
+    :param list schema: name and storage type of each column, see api_format.get_output_schema.
+        The chunks are written with its columns, in its order (None to infer the schema from the first chunk)
+    """
+
+    def __init__(self, dataset, schema: List[dict] = None):
+        self.dataset = dataset
+        self.schema = schema
+        self.writer = None
+        self.rows = 0
+        self.has_exception = False
+
+    def write(self, df: pd.DataFrame):
+        if self.schema is not None:
+            df = df.reindex(columns=[column["name"] for column in self.schema])
+        if self.writer is None:
+            if self.schema is not None:
+                self.dataset.write_schema(self.schema)
+            else:
+                self.dataset.write_schema_from_dataframe(df)
+            self.writer = self.dataset.get_writer()
+        self.writer.write_dataframe(df)
+        self.rows += len(df)
+        self.has_exception = self.has_exception or has_exception(df)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            logger.info("{} rows written".format(self.rows))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class RecipeOutputs(object):
+    """Output datasets of the recipe, by role
+
+    :param dict datasets: dataiku.Dataset of each output role
+    :param dict previous_datasets: the same datasets opened with ignore_flow=True, to read the rows of the previous runs
+    """
+
+    def __init__(self, datasets: dict, previous_datasets: dict = None):
+        self.datasets = datasets
+        self.previous_datasets = previous_datasets or {}
+
+    def has(self, role: str) -> bool:
+        return role in self.datasets
+
+    def write(self, role: str, dataframes: Iterable[pd.DataFrame], schema: List[dict] = None) -> DatasetStreamWriter:
+        """Write the dataframes one by one in the dataset of a role
+
+        :param list schema: schema of the dataset, see DatasetStreamWriter (None to infer it from the first dataframe)
+        :returns: the closed writer, with the number of rows written and whether an error was reported
+        :rtype: DatasetStreamWriter
+        """
+        with DatasetStreamWriter(self.datasets[role], schema) as writer:
+            for df in dataframes:
+                writer.write(df)
+        return writer
+
+    def write_together(self, roles: List[str], dataframes: Iterable[Dict[str, pd.DataFrame]],
+                       schemas: Dict[str, List[dict]] = None) -> Dict[str, DatasetStreamWriter]:
+        """Write the datasets of several roles at once, from the dataframes of each role computed together,
+        ex - the creative analytics and the campaign analytics rolled up from them
+
+        :param dict schemas: schema of the dataset of each role (None to infer them from the first dataframes)
+        :returns: the closed writer of each role
+        :rtype: dict
+        """
+        schemas = schemas or {}
+        with ExitStack() as stack:
+            writers = {role: stack.enter_context(DatasetStreamWriter(self.datasets[role], schemas.get(role))) for role in roles}
+            for role_dataframes in dataframes:
+                for role, df in role_dataframes.items():
+                    writers[role].write(df)
+        return writers
+
+    def read_previous(self, role: str, spill_directory: str) -> "SpillDataset":
+        """Read the rows written by the previous runs in the dataset of a role chunk by chunk, and spill them to local files,
+        so that they are kept once this run starts overwriting the dataset. The errors of the read are raised, so that the history is not lost.
+
+        :param str spill_directory: local folder receiving the previous rows, see SpillDataset
+        :returns: previous rows, or None if the dataset has no data yet
+        :rtype: SpillDataset
+        """
+        if role not in self.previous_datasets:
+            return None
+        dataset = self.previous_datasets[role]
+        if not dataset.read_schema(raise_if_empty=False) or not dataset.list_partitions(raise_if_empty=False):
+            logger.info("No previous output found, it will be created")
+            return None
+        previous_rows = SpillDataset(spill_directory)
+        writer = previous_rows.get_writer()
+        for df in dataset.iter_dataframes(chunksize=Constants.PREVIOUS_ROWS_CHUNK_SIZE):
+            writer.write_dataframe(df)
+        return previous_rows
+
+
+class SpillDataset(object):
+    """Stand-in for a dataiku.Dataset which spills each written dataframe to a pickle file of a local folder,
+    ex - in a worker process whose outputs are merged by the recipe at the end, one file at a time.
+    It only holds the paths of the files, so it can be sent back to the recipe process.
+
+    :param str directory: folder of the files, created with the writer
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.paths = []
+
+    def write_schema(self, schema: List[dict]):
+        self.clear()
+
+    def write_schema_from_dataframe(self, df: pd.DataFrame):
+        self.clear()
+
+    def get_writer(self):
+        os.makedirs(self.directory, exist_ok=True)
+        return self
+
+    def write_dataframe(self, df: pd.DataFrame):
+        path = os.path.join(self.directory, "part-{:05d}.pkl".format(len(self.paths)))
+        df.to_pickle(path)
+        self.paths.append(path)
+
+    def close(self):
+        pass
+
+    def iter_dataframes(self) -> Iterator[pd.DataFrame]:
+        """Read the written dataframes back, one at a time
+
+        :rtype: generator
+        """
+        for path in self.paths:
+            yield pd.read_pickle(path)
+
+    def clear(self):
+        for path in self.paths:
+            os.remove(path)
+        self.paths = []
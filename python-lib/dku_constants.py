@@ -1,3 +1,4 @@
+from datetime import datetime
 from enum import Enum
 
 
@@ -6,15 +7,52 @@ class AuthenticationType(Enum):
     OAUTH = "oauth"
 
 
+class Backend(Enum):
+    SYNC = "sync"
+    ASYNC = "async"
+
+
 class Constants(object):
+    API_URL = "https://api.linkedin.com/v2"
     CAMPAIGN_GROUP_DATASET = "campaign_group_dataset"
     CAMPAIGN_DATASET = "campaign_dataset"
     CAMPAIGN_ANALYTICS_DATASET = "campaign_analytics_dataset"
     CREATIVE_DATASET = "creative_dataset"
     CREATIVE_ANALYTICS_DATASET = "creatives_analytics_dataset"
+    OUTPUT_DATASET_ROLES = [CAMPAIGN_GROUP_DATASET, CAMPAIGN_DATASET, CREATIVE_DATASET, CAMPAIGN_ANALYTICS_DATASET, CREATIVE_ANALYTICS_DATASET]
+    ANALYTICS_DATASET_ROLES = [CAMPAIGN_ANALYTICS_DATASET, CREATIVE_ANALYTICS_DATASET]
+    SYNC_STATE_FOLDER = "sync_state_folder"
+    SYNC_STATE_FILE = "sync_state.json"
+    METRICS_FOLDER = "metrics_folder"
+    REQUEST_LOG_DATASET = "request_log_dataset"
+    TRACE_FILE_NAME = "run_trace_{}.json"
+    RAW_RESPONSE_FOLDER = "raw_response_folder"
+    RAW_RESPONSE_FILE_NAME = "{}.jsonl"
+    ANALYTICS_PARQUET_FOLDER = "analytics_parquet_folder"
+    PARQUET_FILE_NAME = "{}/date={}/account={}/part-{:05d}.parquet"
+    PARQUET_ERRORS_FILE_NAME = "{}/_errors.jsonl"
+    PARQUET_STAGING_DIRECTORY = "_staging/{}"
+    PARQUET_ROWS_PER_FILE = 500000
+    HIVE_DEFAULT_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+    CHECKPOINT_FOLDER = "checkpoint_folder"
+    CHECKPOINT_DIRECTORY = "checkpoints"
+    DEFAULT_LOOKBACK_DAYS = 7
+    PREVIOUS_ROWS_CHUNK_SIZE = 100000
+    CACHE_DIRECTORY_NAME = "dss-plugin-linkedin-marketing-cache"
+    CACHE_MAX_SIZE_BYTES = 100 * 1024 * 1024
+    DEFAULT_CACHE_TTL_MIN = 60
     DEFAULT_BATCH_SIZE = 80
+    DEFAULT_ROWS_PER_ID_PER_DAY = 0
+    MAX_ENTITIES_PER_QUERY = 1000
+    ANALYTICS_START_DATE = datetime(2006, 1, 1)
     MAX_RETRIES = 5
-    WAIT_TIME_BEFORE_RETRY_SEC = 5
+    BACKOFF_BASE_SEC = 1
+    BACKOFF_MAX_SEC = 60
+    DEFAULT_REQUESTS_PER_SECOND = 10
+    DEFAULT_POOL_SIZE = 10
+    DEFAULT_MAX_WORKERS = 4
+    MAX_ACCOUNT_SHARDS = 16
+    TOO_MANY_ENTITIES_MESSAGE = "too many entities"
 
 
 class Category(object):
@@ -24,63 +62,170 @@ class Category(object):
     CREATIVE = "CREATIVES"
     CAMPAIGN_ANALYTICS = "CAMPAIGN_ANALYTICS"
     CREATIVE_ANALYTICS = "CREATIVES_ANALYTICS"
+    CREATIVE_ANALYTICS_BY_CAMPAIGN = "CREATIVES_ANALYTICS_BY_CAMPAIGN"  # creative pivot, filtered by campaign
+
+
+OUTPUT_CATEGORY_DICT = {
+    Constants.CAMPAIGN_GROUP_DATASET: Category.GROUP,
+    Constants.CAMPAIGN_DATASET: Category.CAMPAIGN,
+    Constants.CREATIVE_DATASET: Category.CREATIVE,
+    Constants.CAMPAIGN_ANALYTICS_DATASET: Category.CAMPAIGN_ANALYTICS,
+    Constants.CREATIVE_ANALYTICS_DATASET: Category.CREATIVE_ANALYTICS
+}
+
+# Time to live of the cached responses, in seconds. Analytics are never cached
+CACHE_TTL_SEC_DICT = {
+    Category.ACCOUNT: 24 * 3600,
+    Category.GROUP: Constants.DEFAULT_CACHE_TTL_MIN * 60,
+    Category.CAMPAIGN: Constants.DEFAULT_CACHE_TTL_MIN * 60,
+    Category.CREATIVE: Constants.DEFAULT_CACHE_TTL_MIN * 60
+}
+
+# Fields of each category, in the order of the output columns: (field, required).
+# The required fields are always queried, as the recipe relies on them: ids, parents, creation time of the entities, pivot and day of the analytics.
+# The other ones can be left out by the field selection of the recipe, see api_format.get_field_names
+FIELDS_DICT = {
+    Category.ACCOUNT: [("test", False),
+                       ("notifiedOnCreativeRejection", False),
+                       ("notifiedOnEndOfCampaign", False),
+                       ("servingStatuses", False),
+                       ("notifiedOnCampaignOptimization", False),
+                       ("type", False),
+                       ("version", False),
+                       ("reference", False),
+                       ("notifiedOnCreativeApproval", False),
+                       ("changeAuditStamps", False),
+                       ("name", False),
+                       ("currency", False),
+                       ("id", True),
+                       ("status", False)],
+    Category.GROUP: [("runSchedule", False),
+                     ("test", False),
+                     ("changeAuditStamps", False),
+                     ("name", False),
+                     ("servingStatuses", False),
+                     ("backfilled", False),
+                     ("id", True),
+                     ("account", True),
+                     ("status", False)],
+    Category.CAMPAIGN: [("test", False),
+                        ("format", False),
+                        ("targetingCriteria", False),
+                        ("servingStatuses", False),
+                        ("locale", False),
+                        ("type", False),
+                        ("version", False),
+                        ("objectiveType", False),
+                        ("associatedEntity", False),
+                        ("runSchedule", False),
+                        ("targeting", False),
+                        ("optimizationTargetType", False),
+                        ("campaignGroup", True),
+                        ("changeAuditStamps", True),
+                        ("dailyBudget", False),
+                        ("unitCost", False),
+                        ("creativeSelection", False),
+                        ("costType", False),
+                        ("name", False),
+                        ("offsiteDeliveryEnabled", False),
+                        ("id", True),
+                        ("audienceExpansionEnabled", False),
+                        ("account", True),
+                        ("status", False)],
+    Category.CREATIVE: [("reference", False),
+                        ("variables", False),
+                        ("test", False),
+                        ("changeAuditStamps", True),
+                        ("review", False),
+                        ("servingStatuses", False),
+                        ("campaign", True),
+                        ("id", True),
+                        ("type", False),
+                        ("version", False),
+                        ("status", False)],
+    Category.CAMPAIGN_ANALYTICS: [("pivotValue", True),
+                                  ("costInUsd", False),
+                                  ("impressions", False),
+                                  ("clicks", False),
+                                  ("dateRange", True),
+                                  ("externalWebsitePostClickConversions", False),
+                                  ("externalWebsitePostViewConversions", False)],
+    Category.CREATIVE_ANALYTICS: [("pivotValue", True),
+                                  ("costInUsd", False),
+                                  ("impressions", False),
+                                  ("clicks", False),
+                                  ("dateRange", True),
+                                  ("externalWebsitePostClickConversions", False),
+                                  ("externalWebsitePostViewConversions", False)]
+}
+
+# DSS storage type of the fields which are not strings, whatever the values of the first batch written.
+# The nested values (dicts, lists and URNs) are written as strings
+FIELD_STORAGE_TYPES_DICT = {
+    "id": "bigint",
+    "test": "boolean",
+    "backfilled": "boolean",
+    "notifiedOnCreativeRejection": "boolean",
+    "notifiedOnEndOfCampaign": "boolean",
+    "notifiedOnCampaignOptimization": "boolean",
+    "notifiedOnCreativeApproval": "boolean",
+    "offsiteDeliveryEnabled": "boolean",
+    "audienceExpansionEnabled": "boolean",
+    "costInUsd": "double",
+    "impressions": "bigint",
+    "clicks": "bigint",
+    "externalWebsitePostClickConversions": "bigint",
+    "externalWebsitePostViewConversions": "bigint"
+}
+
+COLUMN_NAMES_DICT = {category: [field for field, _ in fields] + ["exception"] for category, fields in FIELDS_DICT.items()}
+
+
+class ColumnType(object):
+    DATE = "date"  # {"year": 2020, "month": 1, "day": 31}
+    TIMESTAMP = "timestamp"  # milliseconds since epoch
+    URN = "urn"  # urn:li:sponsoredCampaign:123 -> 123
+    INT = "Int64"
+    FLOAT = "float64"
+
+
+# DSS storage type of the flattened columns of each type
+COLUMN_STORAGE_TYPES_DICT = {
+    ColumnType.DATE: "date",
+    ColumnType.TIMESTAMP: "date",
+    ColumnType.URN: "bigint",
+    ColumnType.INT: "bigint",
+    ColumnType.FLOAT: "double"
+}
 
 
-COLUMN_NAMES_DICT = {
-    Category.ACCOUNT:  ["test", "notifiedOnCreativeRejection", "notifiedOnEndOfCampaign", "servingStatuses", "notifiedOnCampaignOptimization",
-                        "type", "version", "reference", "notifiedOnCreativeApproval", "changeAuditStamps", "name", "currency", "id", "status", "exception"],
-    Category.GROUP: ["runSchedule", "test", "changeAuditStamps", "name", "servingStatuses", "backfilled", "id", "account", "status", "exception"],
-    Category.CAMPAIGN: ["test",
-                        "format",
-                        "targetingCriteria",
-                        "servingStatuses",
-                        "locale",
-                        "type",
-                        "version",
-                        "objectiveType",
-                        "associatedEntity",
-                        "runSchedule",
-                        "targeting",
-                        "optimizationTargetType",
-                        "campaignGroup",
-                        "changeAuditStamps",
-                        "dailyBudget",
-                        "unitCost",
-                        "creativeSelection",
-                        "costType",
-                        "name",
-                        "offsiteDeliveryEnabled",
-                        "id",
-                        "audienceExpansionEnabled",
-                        "account",
-                        "status",
-                        "exception"],
-    Category.CREATIVE: ["reference",
-                        "variables",
-                        "test",
-                        "changeAuditStamps",
-                        "review",
-                        "servingStatuses",
-                        "campaign",
-                        "id",
-                        "type",
-                        "version",
-                        "status",
-                        "exception"],
-    Category.CAMPAIGN_ANALYTICS: ["pivotValue",
-                                  "costInUsd",
-                                  "impressions",
-                                  "clicks",
-                                  "dateRange",
-                                  "externalWebsitePostClickConversions",
-                                  "externalWebsitePostViewConversions",
-                                  "exception"],
-    Category.CREATIVE_ANALYTICS: ["pivotValue",
-                                  "costInUsd",
-                                  "impressions",
-                                  "clicks",
-                                  "dateRange",
-                                  "externalWebsitePostClickConversions",
-                                  "externalWebsitePostViewConversions",
-                                  "exception"]
+# Flattened output of each category: (output column, path of the source value, type).
+# The source columns are replaced by their flattened columns
+FLAT_COLUMNS_DICT = {
+    Category.ACCOUNT: [("created", "changeAuditStamps.created.time", ColumnType.TIMESTAMP),
+                       ("lastModified", "changeAuditStamps.lastModified.time", ColumnType.TIMESTAMP)],
+    Category.GROUP: [("created", "changeAuditStamps.created.time", ColumnType.TIMESTAMP),
+                     ("lastModified", "changeAuditStamps.lastModified.time", ColumnType.TIMESTAMP),
+                     ("account", "account", ColumnType.URN)],
+    Category.CAMPAIGN: [("created", "changeAuditStamps.created.time", ColumnType.TIMESTAMP),
+                        ("lastModified", "changeAuditStamps.lastModified.time", ColumnType.TIMESTAMP),
+                        ("campaignGroup", "campaignGroup", ColumnType.URN),
+                        ("account", "account", ColumnType.URN)],
+    Category.CREATIVE: [("created", "changeAuditStamps.created.time", ColumnType.TIMESTAMP),
+                        ("lastModified", "changeAuditStamps.lastModified.time", ColumnType.TIMESTAMP),
+                        ("campaign", "campaign", ColumnType.URN)],
+    Category.CAMPAIGN_ANALYTICS: [("pivotValue", "pivotValue", ColumnType.URN),
+                                  ("costInUsd", "costInUsd", ColumnType.FLOAT),
+                                  ("impressions", "impressions", ColumnType.INT),
+                                  ("clicks", "clicks", ColumnType.INT),
+                                  ("date", "dateRange.start", ColumnType.DATE),
+                                  ("externalWebsitePostClickConversions", "externalWebsitePostClickConversions", ColumnType.INT),
+                                  ("externalWebsitePostViewConversions", "externalWebsitePostViewConversions", ColumnType.INT)],
+    Category.CREATIVE_ANALYTICS: [("pivotValue", "pivotValue", ColumnType.URN),
+                                  ("costInUsd", "costInUsd", ColumnType.FLOAT),
+                                  ("impressions", "impressions", ColumnType.INT),
+                                  ("clicks", "clicks", ColumnType.INT),
+                                  ("date", "dateRange.start", ColumnType.DATE),
+                                  ("externalWebsitePostClickConversions", "externalWebsitePostClickConversions", ColumnType.INT),
+                                  ("externalWebsitePostViewConversions", "externalWebsitePostViewConversions", ColumnType.INT)]
 }
@@ -0,0 +1,120 @@
+from datetime import datetime
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+from api_format import get_urn_ids, has_exception
+from dku_constants import Constants
+
+MISSING_ID = -1
+
+
+class ParentIds(object):
+    """Ids of the campaigns or creatives whose analytics are retrieved, and the few attributes the analytics stages need.
+    The stages exchange them instead of the entity dataframes, whose nested columns (targeting, variables...)
+    can then be freed as soon as the entity datasets are written.
+
+    :param np.ndarray ids: int64 ids of the entities
+    :param np.ndarray created: datetime64 creation time of each entity, NaT if unknown (None if not retrieved)
+    :param np.ndarray accounts: int64 account id of each entity, -1 if unknown (None for the creatives, which only reference their campaign)
+    :param np.ndarray campaigns: int64 campaign id of each creative, -1 if unknown (None for the campaigns)
+    :param np.ndarray weights: number of pivot entities behind each id, see api_call.plan_analytics_requests (None for one per id)
+    :param dict error: error of the listing, reported instead of the analytics (None if the listing is valid)
+    """
+
+    def __init__(self, ids: np.ndarray, created: np.ndarray = None, accounts: np.ndarray = None, campaigns: np.ndarray = None,
+                 weights: np.ndarray = None, error: dict = None):
+        self.ids = ids
+        self.created = created
+        self.accounts = accounts
+        self.campaigns = campaigns
+        self.weights = weights
+        self.error = error
+
+    @classmethod
+    def from_entities(cls, entities: pd.DataFrame) -> "ParentIds":
+        """Extract the ids of a formatted listing of campaigns or creatives, nested or flattened
+
+        :rtype: ParentIds
+        """
+        if has_exception(entities):
+            return cls(np.empty(0, dtype=np.int64), error={"exception": "The parent dataframe is invalid, so this dataset cannot be retrieved"})
+        if entities.empty:
+            return cls(np.empty(0, dtype=np.int64))
+        valid_entities = entities[entities["id"].notna()]
+        return cls(
+            valid_entities["id"].to_numpy(dtype=np.int64),
+            created=get_creation_times(valid_entities),
+            accounts=get_id_array(valid_entities["account"]) if "account" in valid_entities.columns else None,
+            campaigns=get_id_array(valid_entities["campaign"]) if "campaign" in valid_entities.columns else None
+        )
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def first_activity_date(self) -> datetime:
+        """Creation date of the oldest entity, before which it has no analytics (1st January 2006 if unknown)"""
+        if self.created is not None:
+            first_creation = pd.Series(self.created).min()
+            if pd.notna(first_creation):
+                return max(Constants.ANALYTICS_START_DATE, first_creation.to_pydatetime())
+        return Constants.ANALYTICS_START_DATE
+
+    def select(self, pivot_ids: List[int]) -> "ParentIds":
+        """Entities whose id is in a list, ex - the pivots of a start date of an incremental plan
+
+        :rtype: ParentIds
+        """
+        mask = np.isin(self.ids, np.asarray(pivot_ids, dtype=np.int64))
+        return ParentIds(*[None if values is None else values[mask] for values in [self.ids, self.created, self.accounts, self.campaigns, self.weights]],
+                         error=self.error)
+
+    def with_creative_counts(self, creatives: "ParentIds") -> "ParentIds":
+        """The same campaigns, weighted by their number of creatives
+
+        :rtype: ParentIds
+        """
+        campaign_ids, counts = np.unique(creatives.campaigns, return_counts=True)
+        positions = np.searchsorted(campaign_ids, self.ids).clip(max=max(len(campaign_ids) - 1, 0))
+        weights = np.where(campaign_ids[positions] == self.ids, counts[positions], 0) if len(campaign_ids) else np.zeros(len(self.ids), dtype=np.int64)
+        return ParentIds(self.ids, self.created, self.accounts, self.campaigns, weights, self.error)
+
+    def get_campaign_urns(self) -> pd.Series:
+        """URN of the campaign of each creative, indexed by creative id (creatives without campaign left out)
+
+        :rtype: pd.Series
+        """
+        known = self.campaigns != MISSING_ID
+        return pd.Series(self.campaigns[known], index=self.ids[known]).astype(str).radd("urn:li:sponsoredCampaign:")
+
+    def get_accounts(self) -> Dict[int, int]:
+        """Account id of each entity with a known account
+
+        :rtype: dict
+        """
+        if self.accounts is None:
+            return {}
+        known = self.accounts != MISSING_ID
+        return dict(zip(self.ids[known].tolist(), self.accounts[known].tolist()))
+
+
+def get_id_array(urns: pd.Series) -> np.ndarray:
+    """int64 ids of a column of URNs, or of ids once flattened (-1 if missing)"""
+    return get_urn_ids(urns).fillna(MISSING_ID).to_numpy(dtype=np.int64)
+
+
+def get_creation_times(entities: pd.DataFrame) -> np.ndarray:
+    """Creation time of each entity, from the flattened created column or from the nested changeAuditStamps
+
+    :returns: datetime64 values, NaT if unknown (None without either column)
+    :rtype: np.ndarray
+    """
+    if "created" in entities.columns:
+        return pd.to_datetime(entities["created"], errors="coerce").to_numpy(dtype="datetime64[ms]")
+    elif "changeAuditStamps" in entities.columns:
+        creation_times = [stamps.get("created", {}).get("time") if isinstance(stamps, dict) else None for stamps in entities["changeAuditStamps"]]
+        creation_times = pd.to_numeric(pd.Series(creation_times, dtype=object), errors="coerce").where(lambda times: times > 0)
+        return pd.to_datetime(creation_times, unit="ms").to_numpy(dtype="datetime64[ms]")
+    return None
@@ -0,0 +1,248 @@
+import logging
+import time
+from datetime import date, timedelta
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+import numpy as np
+
+from api_format import dump_json, get_field_names
+from dku_constants import FLAT_COLUMNS_DICT, ColumnType, Constants
+from run_metrics import RunMetrics
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+logger = logging.getLogger()
+
+EPOCH = date(1970, 1, 1)
+
+
+class ParquetExport(object):
+    """Analytics exported as Parquet files in a managed folder instead of a dataset.
+    The Arrow record batches are built from the elements of each API response, without pandas,
+    and the files are partitioned by day and by account, so that the recipes downstream only read the partitions they need:
+    <category>/date=2021-03-01/account=123/part-00000.parquet
+
+    :param dataiku.Folder folder: Folder receiving the files. The previous export of a category is replaced once the new one is complete
+    :param int rows_per_file: Rows kept in memory before they are written, at most one file per partition for each of them
+    :raises: :class:`ValueError`: pyarrow is not installed
+    """
+
+    def __init__(self, folder, rows_per_file: int = Constants.PARQUET_ROWS_PER_FILE):
+        if pa is None:
+            raise ValueError("The Parquet export requires pyarrow, please add it to the code environment of the plugin")
+        self.folder = folder
+        self.rows_per_file = rows_per_file
+
+    def write(self, category: str, responses: Iterable[dict], pivot_accounts: Dict[int, str], metrics: RunMetrics = None,
+              fields: List[str] = None) -> "ParquetPartitionWriter":
+        """Export the analytics of each response as they arrive
+
+        :param dict pivot_accounts: account id of each campaign or creative id, see sync_state.get_pivot_accounts
+        :param list fields: metrics selected for the category (None for all of them)
+        :returns: the closed writer, with the number of rows written and whether an error was reported
+        :rtype: ParquetPartitionWriter
+        """
+        with ParquetPartitionWriter(self.folder, category, pivot_accounts, self.rows_per_file, metrics, fields) as writer:
+            for response in responses:
+                writer.write(response)
+        return writer
+
+
+class ParquetPartitionWriter(object):
+    """Buffers the record batches of a category and writes them to one Parquet file per day and account.
+    The files are written to a staging folder, _staging/<category>, and moved to <category> when the writer is closed
+    after every response was exported, so that a run which fails or stops on an API error keeps the previous export.
+    The responses in error are written to <category>/_errors.jsonl, which Spark and Hive ignore.
+    """
+
+    def __init__(self, folder, category: str, pivot_accounts: Dict[int, str], rows_per_file: int, metrics: RunMetrics = None, fields: List[str] = None):
+        self.folder = folder
+        self.category = category
+        self.pivot_accounts = {pivot_id: get_account_id(account) for pivot_id, account in pivot_accounts.items()}
+        self.rows_per_file = rows_per_file
+        self.metrics = metrics
+        self.fields = fields
+        self.schema = get_arrow_schema(category, fields)
+        self.batches = []
+        self.pending_rows = 0
+        self.flushes = 0
+        self.paths = []
+        self.rows = 0
+        self.errors = []
+        self.has_exception = False
+        self.staging_directory = Constants.PARQUET_STAGING_DIRECTORY.format(category)
+        self.folder.delete_path(self.staging_directory)
+
+    @property
+    def files(self) -> int:
+        return len(self.paths)
+
+    def write(self, response: dict):
+        elements = response.get("elements")
+        if elements is None:
+            logger.warning(str(response))
+            self.errors.append(response)
+            self.has_exception = True
+            return
+        if elements:
+            start_time = time.perf_counter()
+            self.batches.append(build_record_batch(elements, self.category, self.pivot_accounts, self.schema, self.fields))
+            self.pending_rows += len(elements)
+            self.rows += len(elements)
+            if self.metrics:
+                self.metrics.record_operation("record_batch", self.category, time.perf_counter() - start_time, len(elements))
+        if self.pending_rows >= self.rows_per_file:
+            self.flush()
+
+    def flush(self):
+        if not self.batches:
+            return
+        start_time = time.perf_counter()
+        table = pa.Table.from_batches(self.batches, self.schema).unify_dictionaries().combine_chunks()
+        data_columns = [name for name in table.column_names if name not in ["date", "account"]]
+        for (day, account), partition in split_partitions(table):
+            sink = pa.BufferOutputStream()
+            pq.write_table(partition.select(data_columns), sink)
+            path = Constants.PARQUET_FILE_NAME.format(self.category, day, account, self.flushes)
+            with self.folder.get_writer("{}/{}".format(self.staging_directory, path)) as writer:
+                writer.write(sink.getvalue().to_pybytes())
+            self.paths.append(path)
+        if self.metrics:
+            self.metrics.record_operation("parquet_write", self.category, time.perf_counter() - start_time, self.pending_rows)
+        self.batches = []
+        self.pending_rows = 0
+        self.flushes += 1
+
+    def close(self):
+        """Move the staged files in place of the previous export, or keep the previous export and report the errors next to it"""
+        self.flush()
+        if self.errors:
+            logger.warning("The export of {} stopped on an API error, the previous export is kept".format(self.category))
+            self.discard()
+            with self.folder.get_writer(Constants.PARQUET_ERRORS_FILE_NAME.format(self.category)) as writer:
+                writer.write(b"".join(dump_json(error) + b"\n" for error in self.errors))
+            return
+        self.folder.delete_path(self.category)
+        for path in self.paths:
+            with self.folder.get_download_stream("{}/{}".format(self.staging_directory, path)) as stream:
+                self.folder.upload_stream(path, stream)
+        self.folder.delete_path(self.staging_directory)
+        logger.info("{} rows written to {} Parquet files".format(self.rows, self.files))
+
+    def discard(self):
+        """Delete the staged files, leaving the previous export as it is"""
+        self.folder.delete_path(self.staging_directory)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+def get_arrow_schema(category: str, fields: List[str] = None) -> "pa.Schema":
+    """Columns of the flattened analytics (see FLAT_COLUMNS_DICT), URNs being dictionary-encoded, and the account id to partition by
+
+    :param list fields: metrics selected for the category (None for all of them)
+
+    :rtype: pa.Schema
+    """
+    arrow_types = {
+        ColumnType.DATE: pa.date32(),
+        ColumnType.TIMESTAMP: pa.timestamp("ms"),
+        ColumnType.URN: pa.dictionary(pa.int32(), pa.string()),
+        ColumnType.INT: pa.int64(),
+        ColumnType.FLOAT: pa.float64()
+    }
+    arrow_fields = [pa.field(column_name, arrow_types[column_type]) for column_name, _, column_type in get_flat_columns(category, fields)]
+    return pa.schema(arrow_fields + [pa.field("account", pa.int64())])
+
+
+def build_record_batch(elements: List[dict], category: str, pivot_accounts: Dict[int, int], schema: "pa.Schema",
+                       fields: List[str] = None) -> "pa.RecordBatch":
+    """Arrow columns of the analytics elements of a response
+
+    :param dict pivot_accounts: account id of each campaign or creative id
+    :rtype: pa.RecordBatch
+    """
+    arrays = []
+    for column_name, source_path, column_type in get_flat_columns(category, fields):
+        keys = source_path.split(".")
+        values = [get_path_value(element, keys) for element in elements]
+        arrays.append(build_array(values, column_type))
+    accounts = [pivot_accounts.get(get_urn_id(element.get("pivotValue"))) for element in elements]
+    arrays.append(pa.array(accounts, type=pa.int64()))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def get_flat_columns(category: str, fields: List[str] = None) -> List[Tuple[str, str, str]]:
+    """Flattened columns of FLAT_COLUMNS_DICT whose source field is selected"""
+    field_names = get_field_names(category, fields)
+    return [flat_column for flat_column in FLAT_COLUMNS_DICT[category] if flat_column[1].split(".")[0] in field_names]
+
+
+def build_array(values: list, column_type: str) -> "pa.Array":
+    """Convert the values of a column to the Arrow type of a ColumnType"""
+    if column_type == ColumnType.DATE:
+        days = [date(value["year"], value["month"], value["day"]) if isinstance(value, dict) else None for value in values]
+        return pa.array(days, type=pa.date32())
+    elif column_type == ColumnType.TIMESTAMP:
+        return pa.array(values, type=pa.int64()).cast(pa.timestamp("ms"))
+    elif column_type == ColumnType.URN:
+        return pa.array(values, type=pa.string()).dictionary_encode()
+    elif column_type == ColumnType.FLOAT:
+        return pa.array([None if value is None else float(value) for value in values], type=pa.float64())
+    else:
+        return pa.array(values, type=pa.int64())
+
+
+def split_partitions(table: "pa.Table") -> Iterator[Tuple[Tuple[str, str], "pa.Table"]]:
+    """Split the rows of a table by day and account
+
+    :returns: the partition values (Hive default partition for missing values) and the rows of each partition
+    :rtype: generator
+    """
+    days = table["date"].cast(pa.int32()).fill_null(np.iinfo(np.int32).min).to_numpy()
+    accounts = table["account"].fill_null(-1).to_numpy()
+    keys, partition_indices = np.unique(np.stack([days, accounts], axis=1), axis=0, return_inverse=True)
+    order = np.argsort(partition_indices.ravel(), kind="stable")
+    counts = np.bincount(partition_indices.ravel(), minlength=len(keys))
+    starts = np.cumsum(counts) - counts
+    partitions = table.take(pa.array(order))
+    for (day, account), start, count in zip(keys, starts, counts):
+        day = Constants.HIVE_DEFAULT_PARTITION if day == np.iinfo(np.int32).min else (EPOCH + timedelta(days=int(day))).isoformat()
+        account = Constants.HIVE_DEFAULT_PARTITION if account == -1 else str(account)
+        yield (day, account), partitions.slice(start, count)
+
+
+def get_path_value(element: dict, keys: List[str]):
+    """Nested value at the given keys of an element (None if missing)"""
+    value = element
+    for key in keys:
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+
+def get_urn_id(urn: str) -> int:
+    """Numeric id of a URN such as urn:li:sponsoredCampaign:123 (None if it has none)"""
+    try:
+        return int(str(urn).rsplit(":", 1)[-1])
+    except ValueError:
+        return None
+
+
+def get_account_id(account: str) -> int:
+    try:
+        return int(account)
+    except (TypeError, ValueError):
+        return None
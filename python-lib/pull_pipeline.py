@@ -0,0 +1,278 @@
+import logging
+import tempfile
+from datetime import date, datetime
+from itertools import chain
+from typing import Iterator
+
+import pandas as pd
+
+import async_api_call
+from api_call import (check_accounts, get_parent_error, iter_ad_analytics, iter_batches, query_ads, query_chunk, set_accounts_filter,
+                      set_up_analytics_queries, set_up_query)
+from api_client import LinkedinClient
+from async_client import AsyncLinkedinClient
+from checkpoint_store import CheckpointStore
+from api_format import format_to_df, get_output_schema, has_unknown_creatives, iter_format_to_df, roll_up_creative_analytics
+from dataset_writer import RecipeOutputs
+from dku_constants import OUTPUT_CATEGORY_DICT, Backend, Category, Constants
+from parent_ids import ParentIds
+from parquet_export import ParquetExport
+from raw_response_store import RawResponseStore
+from request_scheduler import RequestScheduler
+from response_cache import ResponseCache
+from run_metrics import RunMetrics
+from sync_state import SyncState, drop_refreshed_rows, get_pivot_accounts, iter_incremental_analytics
+from task_graph import TaskGraph
+
+logger = logging.getLogger()
+
+
+class PullSettings(object):
+    """Settings of a pull, shared by all its stages
+
+    :param list account_ids:  list of IDs of the sponsored ad accounts
+    :param int batch_size: number of ids by batch query (ex - 100)
+    :param datetime start_date:  First day of the chosen time range (None for all time)
+    :param datetime end_date:  Last day of the time range (None for today)
+    :param bool raw_response: true to retrieve the raw response in a separate column
+    :param bool flatten: true to replace the nested columns by typed columns
+    :param float rows_per_id_per_day: estimated number of analytics rows per id and per day
+    :param SyncState sync_state: high-water marks of the incremental sync (None for a full sync)
+    :param int lookback_days: number of settled days downloaded again by the incremental sync
+    :param RawResponseStore raw_response_store: sidecar files receiving the raw elements (None to skip)
+    :param ParquetExport parquet_export: folder receiving the analytics as Parquet files, instead of the datasets (None to write the datasets)
+    :param dict fields: fields selected for each category, see api_format.get_field_names (all the fields of the categories left out)
+    :param bool coalesce_analytics: true to roll up the campaign analytics from the creative analytics, instead of querying them.
+        Only with a full sync, when both analytics datasets are written
+    :param bool accounts_checked: true if the accounts were checked before the pull, ex - by the recipe before dispatching the account shards
+    """
+
+    def __init__(self, account_ids: list, batch_size: int, start_date: datetime = None, end_date: datetime = None, raw_response: bool = False,
+                 flatten: bool = False, rows_per_id_per_day: float = Constants.DEFAULT_ROWS_PER_ID_PER_DAY,
+                 sync_state: SyncState = None, lookback_days: int = Constants.DEFAULT_LOOKBACK_DAYS, raw_response_store: RawResponseStore = None,
+                 parquet_export: ParquetExport = None, fields: dict = None, coalesce_analytics: bool = False, accounts_checked: bool = False):
+        self.account_ids = account_ids
+        self.batch_size = batch_size
+        self.start_date = start_date
+        self.end_date = end_date
+        self.raw_response = raw_response
+        self.flatten = flatten
+        self.rows_per_id_per_day = rows_per_id_per_day
+        self.sync_state = sync_state
+        self.lookback_days = lookback_days
+        self.raw_response_store = raw_response_store
+        self.parquet_export = parquet_export
+        self.fields = fields or {}
+        self.coalesce_analytics = coalesce_analytics
+        self.accounts_checked = accounts_checked
+
+    @property
+    def incremental(self) -> bool:
+        return self.sync_state is not None
+
+    def get_output_schema(self, category: str) -> list:
+        """Schema of the dataset of a category, see api_format.get_output_schema
+
+        :rtype: list
+        """
+        return get_output_schema(category, self.raw_response, self.flatten, self.fields.get(category))
+
+
+def create_client(headers: dict, backend: Backend = Backend.SYNC, max_workers: int = Constants.DEFAULT_MAX_WORKERS, pool_size: int = Constants.DEFAULT_POOL_SIZE,
+                  scheduler: RequestScheduler = None, cache: ResponseCache = None, api_url: str = Constants.API_URL, metrics: RunMetrics = None,
+                  checkpoints: CheckpointStore = None):
+    """HTTP client of the chosen backend: a pool of threads on a requests.Session, or an event loop on an aiohttp session
+
+    :rtype: LinkedinClient or AsyncLinkedinClient
+    """
+    if backend == Backend.ASYNC:
+        return AsyncLinkedinClient(headers, max_workers=max_workers, pool_size=pool_size, scheduler=scheduler, cache=cache, api_url=api_url, metrics=metrics,
+                                   checkpoints=checkpoints)
+    return LinkedinClient(headers, max_workers=max_workers, pool_size=pool_size, scheduler=scheduler, cache=cache, api_url=api_url, metrics=metrics,
+                          checkpoints=checkpoints)
+
+
+def build_pull_graph(client: LinkedinClient, settings: PullSettings, outputs: RecipeOutputs) -> TaskGraph:
+    """Declare the stages of a pull and their dependencies:
+    - the campaign groups, campaigns and creatives are independent
+    - the ids of the campaigns and creatives are extracted from their listings, see ParentIds
+    - the campaign analytics need the campaign ids, the creative analytics need the creative ids
+      (and the campaign ids to find their accounts, in incremental mode or with the Parquet export)
+    - each dataset is written by its own task, as soon as its stage is done and the accounts are checked
+    - when the analytics are coalesced, a single stage needs the campaign and creative ids, and writes both analytics datasets
+    Once the entity datasets are written and the ids extracted, the listings are released by the graph, see TaskGraph.run
+
+    :returns: the graph, whose targets are the output roles
+    :rtype: TaskGraph
+    """
+    accounts_filter = set_accounts_filter(settings.account_ids)
+    graph = TaskGraph()
+    graph.add("check_accounts", lambda: None if settings.accounts_checked else check_accounts(client, settings.account_ids))
+    for category in [Category.GROUP, Category.CAMPAIGN, Category.CREATIVE]:
+        graph.add(category, lambda category=category: pull_entities(client, category, accounts_filter, settings))
+    for role in [Constants.CAMPAIGN_GROUP_DATASET, Constants.CAMPAIGN_DATASET, Constants.CREATIVE_DATASET]:
+        graph.add(role, lambda entities, _, role=role: outputs.write(role, [entities], settings.get_output_schema(OUTPUT_CATEGORY_DICT[role])),
+                  [OUTPUT_CATEGORY_DICT[role], "check_accounts"])
+    campaign_ids, creative_ids = get_ids_task(Category.CAMPAIGN), get_ids_task(Category.CREATIVE)
+    for category in [Category.CAMPAIGN, Category.CREATIVE]:
+        graph.add(get_ids_task(category), ParentIds.from_entities, [category])
+    if settings.coalesce_analytics:
+        graph.add("coalesced_analytics", lambda campaigns, creatives, _: pull_coalesced_analytics(client, campaigns, creatives, settings, outputs),
+                  [campaign_ids, creative_ids, "check_accounts"])
+        for role in Constants.ANALYTICS_DATASET_ROLES:
+            graph.add(role, lambda writers, role=role: writers[role], ["coalesced_analytics"])
+        return graph
+    graph.add(Constants.CAMPAIGN_ANALYTICS_DATASET,
+              lambda campaigns, _: pull_analytics(client, Category.CAMPAIGN_ANALYTICS, Constants.CAMPAIGN_ANALYTICS_DATASET, campaigns, None, settings, outputs),
+              [campaign_ids, "check_accounts"])
+    needs_campaigns = settings.incremental or settings.parquet_export is not None
+    creative_analytics_dependencies = [creative_ids, "check_accounts"] + ([campaign_ids] if needs_campaigns else [])
+    graph.add(Constants.CREATIVE_ANALYTICS_DATASET,
+              lambda creatives, _, campaigns=None: pull_analytics(client, Category.CREATIVE_ANALYTICS, Constants.CREATIVE_ANALYTICS_DATASET, creatives, campaigns,
+                                                                  settings, outputs),
+              creative_analytics_dependencies)
+    return graph
+
+
+def pull_entities(client: LinkedinClient, category: str, accounts_filter: dict, settings: PullSettings) -> pd.DataFrame:
+    """Retrieve and format the campaign groups, campaigns or creatives of the accounts
+
+    :rtype: pd.DataFrame
+    """
+    if isinstance(client, AsyncLinkedinClient):
+        response = client.run(async_api_call.query_ads(client, category, accounts_filter, settings.fields.get(category)))
+    else:
+        response = query_ads(client, category, accounts_filter, settings.fields.get(category))
+    if settings.raw_response_store:
+        response, = settings.raw_response_store.capture(category, [response])
+    return format_to_df(response, category, settings.raw_response, settings.flatten, client.metrics, settings.fields.get(category))
+
+
+def get_ids_task(category: str) -> str:
+    """Name of the task extracting the ids of a listing"""
+    return "{} ids".format(category)
+
+
+def pull_analytics(client: LinkedinClient, category: str, role: str, parent: ParentIds, campaigns: ParentIds, settings: PullSettings, outputs: RecipeOutputs):
+    """Retrieve the analytics of the parent entities and write them batch by batch, as they arrive.
+    In incremental mode, the rows of the previous runs outside of the refreshed windows are written first,
+    and the high-water marks are moved once everything is written without errors.
+
+    :param ParentIds parent: ids of the campaigns or creatives whose analytics are retrieved
+    :param ParentIds campaigns: ids of the campaigns of the creatives, to find their accounts in incremental mode or with the Parquet export
+    """
+    fields = settings.fields.get(category)
+    if settings.incremental:
+        pivot_accounts = get_pivot_accounts(parent, campaigns)
+        plan = settings.sync_state.plan(category, pivot_accounts, settings.lookback_days, settings.start_date, settings.end_date)
+        responses = iter_incremental_analytics(client, category, parent, plan, settings.batch_size, settings.end_date,
+                                               rows_per_id_per_day=settings.rows_per_id_per_day, iter_analytics=iter_analytics, fields=fields)
+    else:
+        responses = iter_analytics(client, category, parent, batch_size=settings.batch_size, start_date=settings.start_date, end_date=settings.end_date,
+                                   rows_per_id_per_day=settings.rows_per_id_per_day, fields=fields)
+    if settings.raw_response_store:
+        responses = settings.raw_response_store.capture(category, responses)
+    if settings.parquet_export:
+        writer = settings.parquet_export.write(category, responses, get_pivot_accounts(parent, campaigns), client.metrics, fields)
+    elif settings.incremental:
+        with tempfile.TemporaryDirectory() as spill_directory:
+            previous_rows = outputs.read_previous(role, spill_directory)
+            previous_rows = [] if previous_rows is None else (drop_refreshed_rows(df, plan) for df in previous_rows.iter_dataframes())
+            writer = outputs.write(role, chain(previous_rows, iter_format_to_df(responses, category, settings.raw_response, settings.flatten,
+                                                                                client.metrics, fields)),
+                                   settings.get_output_schema(category))
+        if not writer.has_exception:
+            settings.sync_state.commit(category, pivot_accounts, settings.end_date)
+    else:
+        writer = outputs.write(role, iter_format_to_df(responses, category, settings.raw_response, settings.flatten, client.metrics, fields),
+                               settings.get_output_schema(category))
+    return writer
+
+
+def pull_coalesced_analytics(client: LinkedinClient, campaigns: ParentIds, creatives: ParentIds, settings: PullSettings,
+                             outputs: RecipeOutputs) -> dict:
+    """Retrieve the creative analytics filtered by campaign, and roll them up into the campaign analytics, instead of querying both pivots.
+    The batches of campaigns are sized by their number of creatives, so that the queries are as many as for the creative analytics alone.
+    Each response gives a batch of both datasets, written as they arrive: all the creatives of a campaign and a day are in the same response.
+    The creatives missing from the listing are attributed to the campaign of their batch if it holds a single one,
+    otherwise the campaign analytics of the batch are queried with the CAMPAIGN pivot.
+    The raw_response column of the rolled-up campaign rows is left empty, since they do not come from an API response.
+    Without a valid creatives listing, both analytics are queried on their own.
+
+    :returns: the closed writer of each analytics role
+    :rtype: dict
+    """
+    if get_parent_error(campaigns) or get_parent_error(creatives):
+        logger.warning("The creatives are not available, the campaign analytics are not rolled up from the creative analytics")
+        return {
+            Constants.CAMPAIGN_ANALYTICS_DATASET: pull_analytics(client, Category.CAMPAIGN_ANALYTICS, Constants.CAMPAIGN_ANALYTICS_DATASET, campaigns, None,
+                                                                 settings, outputs),
+            Constants.CREATIVE_ANALYTICS_DATASET: pull_analytics(client, Category.CREATIVE_ANALYTICS, Constants.CREATIVE_ANALYTICS_DATASET, creatives, campaigns,
+                                                                 settings, outputs)
+        }
+    fields = settings.fields.get(Category.CREATIVE_ANALYTICS)
+    creative_campaigns = creatives.get_campaign_urns()
+    category = Category.CREATIVE_ANALYTICS_BY_CAMPAIGN
+    url, initial_params, analytics_requests = set_up_analytics_queries(category, campaigns.with_creative_counts(creatives), settings.batch_size,
+                                                                       settings.start_date, settings.end_date, settings.rows_per_id_per_day, fields)
+    responses = iter_analytics_batches(client, analytics_requests, category, url, initial_params) if analytics_requests else iter([{"elements": []}])
+    if settings.raw_response_store:
+        responses = settings.raw_response_store.capture(Category.CREATIVE_ANALYTICS, responses)
+
+    def format_campaign_analytics(response: dict, analytics_request: tuple) -> pd.DataFrame:
+        if analytics_request is None or "elements" not in response:
+            return format_to_df(response, Category.CAMPAIGN_ANALYTICS, settings.raw_response, settings.flatten, client.metrics, fields)
+        chunk, window_start, window_end = analytics_request
+        if len(chunk) > 1 and has_unknown_creatives(response, creative_campaigns):
+            logger.warning("Creatives missing from the listing, querying the campaign analytics of {} campaigns from {} to {}".format(
+                len(chunk), window_start, window_end))
+            return format_to_df(query_campaign_analytics(client, chunk, window_start, window_end, fields), Category.CAMPAIGN_ANALYTICS,
+                                settings.raw_response, settings.flatten, client.metrics, fields)
+        df = format_to_df(roll_up_creative_analytics(response, creative_campaigns, batch_campaigns=chunk), Category.CAMPAIGN_ANALYTICS,
+                          settings.raw_response, settings.flatten, client.metrics, fields)
+        if settings.raw_response:
+            df["raw_response"] = None
+        return df
+
+    def iter_dataframes():
+        for response, analytics_request in zip(responses, analytics_requests or [None]):
+            yield {
+                Constants.CREATIVE_ANALYTICS_DATASET: format_to_df(response, Category.CREATIVE_ANALYTICS, settings.raw_response, settings.flatten,
+                                                                   client.metrics, fields),
+                Constants.CAMPAIGN_ANALYTICS_DATASET: format_campaign_analytics(response, analytics_request)
+            }
+
+    schemas = {role: settings.get_output_schema(OUTPUT_CATEGORY_DICT[role]) for role in Constants.ANALYTICS_DATASET_ROLES}
+    return outputs.write_together(Constants.ANALYTICS_DATASET_ROLES, iter_dataframes(), schemas)
+
+
+def iter_analytics_batches(client, analytics_requests: list, category: str, url: str, initial_params: dict) -> Iterator[dict]:
+    """Perform planned analytics requests with the backend of the client, see api_call.iter_batches
+
+    :rtype: generator
+    """
+    if isinstance(client, AsyncLinkedinClient):
+        return client.iterate(async_api_call.iter_batches(analytics_requests, category, url, client, initial_params))
+    return iter_batches(analytics_requests, category, url, client, initial_params)
+
+
+def query_campaign_analytics(client, chunk: list, window_start: date, window_end: date, fields: list = None) -> dict:
+    """Query the campaign analytics of a batch of campaigns over a time window with the backend of the client, see api_call.query_chunk
+
+    :returns: API's response
+    :rtype: dict
+    """
+    url, initial_params = set_up_query(Category.CAMPAIGN_ANALYTICS, fields=fields)
+    if isinstance(client, AsyncLinkedinClient):
+        return client.run(async_api_call.query_chunk(chunk, window_start, window_end, Category.CAMPAIGN_ANALYTICS, url, client, initial_params))
+    return query_chunk(chunk, window_start, window_end, Category.CAMPAIGN_ANALYTICS, url, client, initial_params)
+
+
+def iter_analytics(client, category: str, parent: ParentIds, **kwargs) -> Iterator[dict]:
+    """Query the analytics batch by batch with the backend of the client, see api_call.iter_ad_analytics
+
+    :rtype: generator
+    """
+    if isinstance(client, AsyncLinkedinClient):
+        return client.iterate(async_api_call.iter_ad_analytics(client, category, parent, **kwargs))
+    return iter_ad_analytics(client, category, parent, **kwargs)
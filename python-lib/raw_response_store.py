@@ -0,0 +1,35 @@
+import logging
+from typing import Iterable, Iterator
+
+from api_format import dump_json
+from dku_constants import Constants
+
+logger = logging.getLogger()
+
+
+class RawResponseStore(object):
+    """Sidecar JSON Lines files with the elements returned by the API, one file per category in a managed folder.
+    Each page or batch is written as it arrives, one compact JSON document per element, so the raw responses
+    neither add a column to the outputs nor stay in memory.
+
+    :param dataiku.Folder folder: Folder receiving the files
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+
+    def capture(self, category: str, responses: Iterable[dict]) -> Iterator[dict]:
+        """Write the elements of each response to the file of the category, and pass the responses through
+
+        :rtype: generator
+        """
+        path = Constants.RAW_RESPONSE_FILE_NAME.format(category)
+        elements_written = 0
+        with self.folder.get_writer(path) as writer:
+            for response in responses:
+                elements = response.get("elements") or []
+                if elements:
+                    writer.write(b"\n".join(dump_json(element) for element in elements) + b"\n")
+                    elements_written += len(elements)
+                yield response
+        logger.info("{} raw elements written to {}".format(elements_written, path))
@@ -0,0 +1,217 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable
+
+import requests
+
+from dku_constants import Constants
+
+logger = logging.getLogger()
+
+
+class QuotaExhaustedError(Exception):
+    pass
+
+
+class TokenBucket(object):
+    """Thread-safe token bucket: holds up to `capacity` tokens, refilled continuously at `rate` tokens per second
+
+    :param float rate: Tokens added per second
+    :param float capacity: Max number of tokens, i.e. the largest burst allowed
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Take one token, sleeping until one is available"""
+        wait_time = self.reserve()
+        while wait_time:
+            time.sleep(wait_time)
+            wait_time = self.reserve()
+
+    async def acquire_async(self):
+        """Take one token without blocking the event loop, see acquire"""
+        wait_time = self.reserve()
+        while wait_time:
+            await asyncio.sleep(wait_time)
+            wait_time = self.reserve()
+
+    def reserve(self) -> float:
+        """Take one token if one is available
+
+        :returns: 0 if a token was taken, else the number of seconds before the next one
+        :rtype: float
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+            self.last_refill = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+
+class RequestScheduler(object):
+    """Throttles and retries the queries sent to the LinkedIn API. A single scheduler is shared by all the workers of a run.
+    - the number of requests is limited per second by a token bucket. The daily quota of the LinkedIn application is not tracked across runs:
+      once it is used up, the API answers 429 with a Retry-After header
+    - transport errors, 429 and 5xx responses are retried with an exponential backoff with jitter
+    - a Retry-After header sent by the API takes precedence over the backoff, and pauses every worker.
+      A Retry-After longer than backoff_max_sec fails the request instead, ex - daily quota used up
+
+    :param float requests_per_second: Max number of requests per second
+    :param int max_retries: Max number of attempts for a single request
+    """
+
+    def __init__(self, requests_per_second: float = Constants.DEFAULT_REQUESTS_PER_SECOND, max_retries: int = Constants.MAX_RETRIES,
+                 backoff_base_sec: float = Constants.BACKOFF_BASE_SEC, backoff_max_sec: float = Constants.BACKOFF_MAX_SEC):
+        self.second_bucket = TokenBucket(requests_per_second, max(1, requests_per_second))
+        self.max_retries = max_retries
+        self.backoff_base_sec = backoff_base_sec
+        self.backoff_max_sec = backoff_max_sec
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    def send(self, send_request: Callable[[], requests.Response]) -> requests.Response:
+        """Send a request once the rate limits allow it, and retry it when it fails or is throttled
+
+        :param function send_request: Sends the request and returns the response of the API
+        :returns: Last response of the API. It can still be a 429 or 5xx response once the retries are exhausted.
+            Its attempts and throttles attributes count the attempts sent and throttled by the API
+        :rtype: requests.Response
+        :raises: Last transport error once the retries are exhausted
+        """
+        attempt_number = 0
+        throttles = 0
+        while True:
+            attempt_number += 1
+            self.wait_for_slot()
+            try:
+                response = send_request()
+            except Exception as err:
+                if not self.can_retry(err, attempt_number):
+                    raise
+                time.sleep(self.get_backoff_delay(attempt_number))
+                continue
+            throttles += response.status_code == 429
+            delay = self.get_retry_delay(response, attempt_number)
+            if delay is None:
+                return set_attempts(response, attempt_number, throttles)
+            time.sleep(delay)
+
+    async def send_async(self, send_request: Callable[[], Awaitable]):
+        """Same as send, for a coroutine function sending the request: the waits do not block the event loop
+
+        :param function send_request: Returns a coroutine which sends the request and returns the response of the API
+        """
+        attempt_number = 0
+        throttles = 0
+        while True:
+            attempt_number += 1
+            await self.wait_for_slot_async()
+            try:
+                response = await send_request()
+            except Exception as err:
+                if not self.can_retry(err, attempt_number):
+                    raise
+                await asyncio.sleep(self.get_backoff_delay(attempt_number))
+                continue
+            throttles += response.status_code == 429
+            delay = self.get_retry_delay(response, attempt_number)
+            if delay is None:
+                return set_attempts(response, attempt_number, throttles)
+            await asyncio.sleep(delay)
+
+    def wait_for_slot(self):
+        """Block until the API is not paused anymore and the token bucket grants a request"""
+        pause = self.get_pause()
+        if pause > 0:
+            time.sleep(pause)
+        self.second_bucket.acquire()
+
+    async def wait_for_slot_async(self):
+        pause = self.get_pause()
+        if pause > 0:
+            await asyncio.sleep(pause)
+        await self.second_bucket.acquire_async()
+
+    def can_retry(self, err: Exception, attempt_number: int) -> bool:
+        logger.warning("ERROR:{} on attempt #{}".format(err, attempt_number))
+        return attempt_number < self.max_retries
+
+    def get_retry_delay(self, response: requests.Response, attempt_number: int) -> float:
+        """Delay before retrying a response, from its Retry-After header or from the backoff.
+        A throttled response pauses every worker for that delay.
+
+        :returns: delay in seconds, or None if the response is final
+        :rtype: float
+        :raises: :class:`QuotaExhaustedError`: The Retry-After header is longer than backoff_max_sec
+        """
+        if not is_retryable(response) or attempt_number >= self.max_retries:
+            return None
+        retry_after = get_retry_after(response)
+        if retry_after is not None and retry_after > self.backoff_max_sec:
+            raise QuotaExhaustedError("Error {}: the API asks to wait {:.0f} seconds before the next query, the quota of the LinkedIn application "
+                                      "may be used up".format(response.status_code, retry_after))
+        delay = retry_after if retry_after is not None else self.get_backoff_delay(attempt_number)
+        logger.warning("Error {} on attempt #{}, retrying in {:.1f} seconds".format(response.status_code, attempt_number, delay))
+        if response.status_code == 429:
+            self.pause(delay)
+        return delay
+
+    def get_pause(self) -> float:
+        with self.lock:
+            return self.paused_until - time.monotonic()
+
+    def pause(self, delay: float):
+        """Hold every worker back for `delay` seconds, after the API throttled a request"""
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + delay)
+
+    def get_backoff_delay(self, attempt_number: int) -> float:
+        """Exponential backoff with full jitter
+
+        :returns: delay in seconds before the next attempt
+        :rtype: float
+        """
+        return random.uniform(0, min(self.backoff_max_sec, self.backoff_base_sec * 2 ** (attempt_number - 1)))
+
+
+def set_attempts(response, attempts: int, throttles: int):
+    response.attempts = attempts
+    response.throttles = throttles
+    return response
+
+
+def is_retryable(response: requests.Response) -> bool:
+    return response.status_code == 429 or response.status_code >= 500
+
+
+def get_retry_after(response: requests.Response) -> float:
+    """Parse the Retry-After header, given either in seconds or as an HTTP date
+
+    :returns: delay in seconds, or None if the header is missing or invalid
+    :rtype: float
+    """
+    retry_after = response.headers.get("Retry-After")
+    if not retry_after:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
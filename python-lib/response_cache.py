@@ -0,0 +1,143 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import stat
+import threading
+import time
+from collections import OrderedDict
+
+from dku_constants import CACHE_TTL_SEC_DICT, Constants
+
+logger = logging.getLogger()
+
+
+class ResponseCache(object):
+    """On-disk cache of the API responses that rarely change within a day (accounts, campaign groups, campaigns, creatives).
+    Each response is stored in its own JSON file, keyed on the url and the normalized parameters of the query.
+    The responses hold the entities of the ad accounts, so the folder is only accessible to the user running the recipe,
+    and the cache is disabled if another user owns it.
+    The oldest files are evicted once the cache grows over max_size_bytes. The size of the files is tracked in memory,
+    from a single listing of the folder when the cache is created.
+
+    :param str directory: Folder of the cache files (None for a folder of the user in the temporary folder of the host)
+    :param dict ttls: Time to live in seconds of the responses of each category. Categories without a TTL are not cached
+    :param int max_size_bytes: Max total size of the cache files
+    :param str namespace: Kept apart from other namespaces, ex - a hash of the access token so that users never share responses
+    :param bool enabled: False to bypass the cache, neither reading nor writing it
+    """
+
+    def __init__(self, directory: str = None, ttls: dict = None, max_size_bytes: int = Constants.CACHE_MAX_SIZE_BYTES, namespace: str = "", enabled: bool = True):
+        self.directory = directory or get_user_directory()
+        self.ttls = CACHE_TTL_SEC_DICT if ttls is None else ttls
+        self.max_size_bytes = max_size_bytes
+        self.namespace = namespace
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.file_sizes = OrderedDict()
+        self.total_size = 0
+        if self.enabled:
+            self.enabled = self.set_up_directory()
+        if self.enabled:
+            self.load_file_sizes()
+
+    def set_up_directory(self) -> bool:
+        """Create the folder of the cache, readable and writable by its owner only
+
+        :returns: False if the folder cannot be used safely, so that the cache is disabled
+        :rtype: bool
+        """
+        try:
+            os.makedirs(self.directory, mode=0o700, exist_ok=True)
+            directory_stat = os.lstat(self.directory)
+            if not stat.S_ISDIR(directory_stat.st_mode) or directory_stat.st_uid != os.getuid():
+                logger.warning("The cache folder {} belongs to another user, the cache is disabled".format(self.directory))
+                return False
+            if stat.S_IMODE(directory_stat.st_mode) != 0o700:
+                os.chmod(self.directory, 0o700)
+        except OSError as err:
+            logger.warning("The cache folder {} cannot be used, the cache is disabled: {}".format(self.directory, err))
+            return False
+        return True
+
+    def load_file_sizes(self):
+        """List the files of the previous runs, from the least to the most recently written"""
+        cache_files = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.name.endswith(".json"):
+                    continue
+                try:
+                    file_stat = entry.stat()
+                except OSError:
+                    continue
+                cache_files.append((file_stat.st_mtime, entry.path, file_stat.st_size))
+        for _, path, size in sorted(cache_files):
+            self.file_sizes[path] = size
+            self.total_size += size
+
+    def get(self, category: str, url: str, parameters: dict) -> dict:
+        """Retrieve a cached response that is still fresh
+
+        :returns: the cached response, or None
+        :rtype: dict
+        """
+        if not self.is_cached(category):
+            return None
+        path = self.get_path(url, parameters)
+        try:
+            age = time.time() - os.path.getmtime(path)
+            if age > self.ttls[category]:
+                return None
+            with open(path, "r") as cache_file:
+                response = json.load(cache_file)
+        except (OSError, ValueError):
+            return None
+        logger.info("Using the cached response of {} ({:.0f} seconds old)".format(url, age))
+        return response
+
+    def set(self, category: str, url: str, parameters: dict, response: dict):
+        if not self.is_cached(category):
+            return
+        path = self.get_path(url, parameters)
+        temporary_path = "{}.{}.{}.tmp".format(path, os.getpid(), threading.get_ident())
+        try:
+            with os.fdopen(os.open(temporary_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as cache_file:
+                json.dump(response, cache_file)
+            os.replace(temporary_path, path)
+            size = os.path.getsize(path)
+        except (OSError, TypeError, ValueError) as err:
+            logger.warning("Could not cache the response of {}: {}".format(url, err))
+            return
+        self.evict(path, size)
+
+    def evict(self, path: str, size: int):
+        """Record the size of a file just written, and remove the least recently written files until the cache fits in max_size_bytes
+
+        :param str path: file written
+        :param int size: its size in bytes
+        """
+        with self.lock:
+            self.total_size += size - self.file_sizes.pop(path, 0)
+            self.file_sizes[path] = size
+            while self.total_size > self.max_size_bytes and self.file_sizes:
+                oldest_path, oldest_size = self.file_sizes.popitem(last=False)
+                self.total_size -= oldest_size
+                try:
+                    os.remove(oldest_path)
+                except OSError:
+                    pass
+
+    def is_cached(self, category: str) -> bool:
+        return self.enabled and bool(category) and self.ttls.get(category, 0) > 0
+
+    def get_path(self, url: str, parameters: dict) -> str:
+        normalized_parameters = sorted((str(key), str(value)) for key, value in parameters.items())
+        key = json.dumps([self.namespace, url.rstrip("/"), normalized_parameters])
+        return os.path.join(self.directory, hashlib.sha256(key.encode("utf-8")).hexdigest() + ".json")
+
+
+def get_user_directory() -> str:
+    """Cache folder of the user running the recipe, in the temporary folder of the host"""
+    return os.path.join(tempfile.gettempdir(), "{}-{}".format(Constants.CACHE_DIRECTORY_NAME, os.getuid()))
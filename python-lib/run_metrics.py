@@ -0,0 +1,131 @@
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger()
+
+
+class RunMetrics(object):
+    """Thread-safe collector of the telemetry of a run:
+    - one record per query sent to the API (or answered by the cache): latency, bytes received, attempts and throttles
+    - the duration and rows of the operations of the run (pagination, batch queries, formatting with pandas)
+    """
+
+    def __init__(self):
+        self.started_at = datetime.now(timezone.utc)
+        self.start_time = time.perf_counter()
+        self.requests = []
+        self.operations = {}
+        self.lock = threading.Lock()
+
+    def record_request(self, endpoint: str, category: str, status_code: int, latency_sec: float, bytes_received: int = 0,
+                       attempts: int = 1, throttles: int = 0, cached: bool = False):
+        """Record a query to the API
+
+        :param str endpoint: Last part of the url, ex - adAnalyticsV2
+        :param int attempts: Number of times the query was sent, retries included
+        :param int throttles: Number of attempts throttled by the API (429)
+        :param bool cached: True if the response came from the cache, without query
+        """
+        request = {
+            "time": datetime.now(timezone.utc).isoformat(),
+            "endpoint": endpoint,
+            "category": category,
+            "status_code": status_code,
+            "latency_sec": latency_sec,
+            "bytes_received": bytes_received,
+            "attempts": attempts,
+            "throttles": throttles,
+            "cached": cached
+        }
+        with self.lock:
+            self.requests.append(request)
+
+    def record_operation(self, name: str, category: str, duration_sec: float, rows: int = 0):
+        """Add the duration and rows of an operation, ex - formatting a batch of analytics"""
+        with self.lock:
+            operation = self.operations.setdefault((name, category), {"calls": 0, "duration_sec": 0.0, "rows": 0})
+            operation["calls"] += 1
+            operation["duration_sec"] += duration_sec
+            operation["rows"] += rows
+
+    def merge(self, other: "RunMetrics"):
+        """Add the records of another collector, ex - the one of a shard of the accounts"""
+        with self.lock:
+            self.requests.extend(other.requests)
+            for key, other_operation in other.operations.items():
+                operation = self.operations.setdefault(key, {"calls": 0, "duration_sec": 0.0, "rows": 0})
+                for field in operation:
+                    operation[field] += other_operation[field]
+
+    def get_summary(self) -> dict:
+        """Totals by endpoint and category of the queries, and by operation
+
+        :rtype: dict
+        """
+        with self.lock:
+            requests = pd.DataFrame(self.requests, columns=["endpoint", "category", "status_code", "latency_sec", "bytes_received", "attempts",
+                                                            "throttles", "cached"])
+            operations = {"{} {}".format(name, category or "").strip(): {**operation} for (name, category), operation in self.operations.items()}
+        summary = {"started_at": self.started_at.isoformat(), "duration_sec": time.perf_counter() - self.start_time, "requests": {}, "operations": operations}
+        for (endpoint, category), endpoint_requests in requests.groupby(["endpoint", requests["category"].fillna("")], sort=True):
+            sent_requests = endpoint_requests[~endpoint_requests["cached"].astype(bool)]
+            latencies = sent_requests["latency_sec"].to_numpy(dtype=float)
+            status_codes = pd.to_numeric(sent_requests["status_code"], errors="coerce")
+            summary["requests"]["{} {}".format(endpoint, category).strip()] = {
+                "requests": len(sent_requests),
+                "cached": len(endpoint_requests) - len(sent_requests),
+                "errors": int((status_codes.isna() | (status_codes >= 400)).sum()),
+                "latency_mean_sec": float(latencies.mean()) if latencies.size else None,
+                "latency_p95_sec": float(np.percentile(latencies, 95)) if latencies.size else None,
+                "latency_max_sec": float(latencies.max()) if latencies.size else None,
+                "bytes_received": int(sent_requests["bytes_received"].sum()),
+                "retries": int((sent_requests["attempts"] - 1).sum()),
+                "throttles": int(sent_requests["throttles"].sum())
+            }
+        return summary
+
+    def log_summary(self):
+        summary = self.get_summary()
+        logger.info("Run done in {:.1f} seconds".format(summary["duration_sec"]))
+        for name, requests in summary["requests"].items():
+            logger.info("{}: {} queries ({} cached, {} errors), latency mean {} / p95 {}, {:.1f} MB received, {} retries, {} throttled".format(
+                name, requests["requests"], requests["cached"], requests["errors"], format_seconds(requests["latency_mean_sec"]),
+                format_seconds(requests["latency_p95_sec"]), requests["bytes_received"] / 1e6, requests["retries"], requests["throttles"]))
+        for name, operation in summary["operations"].items():
+            logger.info("{}: {} calls, {:.2f} seconds, {} rows".format(name, operation["calls"], operation["duration_sec"], operation["rows"]))
+
+    def get_trace(self) -> dict:
+        """Summary and log of every query, to be saved as JSON
+
+        :rtype: dict
+        """
+        with self.lock:
+            requests = list(self.requests)
+        return {"summary": self.get_summary(), "requests": requests}
+
+    def get_request_log(self) -> pd.DataFrame:
+        """One row per query of the run
+
+        :rtype: pd.DataFrame
+        """
+        with self.lock:
+            return pd.DataFrame(self.requests, columns=["time", "endpoint", "category", "status_code", "latency_sec", "bytes_received", "attempts",
+                                                        "throttles", "cached"])
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+
+def format_seconds(seconds: float) -> str:
+    return "-" if seconds is None else "{:.3f}s".format(seconds)
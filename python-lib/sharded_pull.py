@@ -0,0 +1,199 @@
+import copy
+import logging
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
+from typing import Dict, List
+
+from api_call import check_accounts
+from api_format import format_to_df
+from dataset_writer import RecipeOutputs, SpillDataset
+from dku_constants import OUTPUT_CATEGORY_DICT, Backend, Constants
+from pull_pipeline import PullSettings, build_pull_graph, create_client
+from request_scheduler import RequestScheduler
+from response_cache import ResponseCache
+from run_metrics import RunMetrics
+from sync_state import SyncState, drop_refreshed_rows
+
+logger = logging.getLogger()
+
+
+class PullShard(object):
+    """Everything a worker process needs to pull a subset of the accounts.
+    Sessions, locks and datasets cannot be sent to another process, so only their settings are kept here.
+
+    :param list account_ids: IDs of the sponsored ad accounts of the shard
+    :param dict headers: Authentication headers of the API
+    :param PullSettings settings: Settings of the pull, without sync state
+    :param dict marks: High-water marks of the incremental sync (None for a full sync)
+    :param list roles: Output roles to compute
+    :param dict client_settings: Keyword arguments of create_client (backend, max_workers, pool_size)
+    :param dict scheduler_settings: Keyword arguments of the RequestScheduler (requests_per_second)
+    :param dict cache_settings: Keyword arguments of the ResponseCache
+    :param str spill_directory: Local folder receiving the rows of the shard, see SpillDataset
+    """
+
+    def __init__(self, account_ids: list, headers: dict, settings: PullSettings, marks: dict, roles: List[str],
+                 client_settings: dict, scheduler_settings: dict, cache_settings: dict, spill_directory: str):
+        self.account_ids = account_ids
+        self.headers = headers
+        self.settings = settings
+        self.marks = marks
+        self.roles = roles
+        self.client_settings = client_settings
+        self.scheduler_settings = scheduler_settings
+        self.cache_settings = cache_settings
+        self.spill_directory = spill_directory
+
+
+class ShardResult(object):
+    """Output of a shard, sent back to the recipe
+
+    :param list account_ids: IDs of the sponsored ad accounts of the shard
+    :param dict datasets: files of the rows of each output role, see SpillDataset (None if nothing was written)
+    :param SyncState sync_state: marks moved and plans followed by the shard (None for a full sync)
+    :param str error: why the shard failed, None if it succeeded
+    :param RunMetrics metrics: telemetry of the queries of the shard
+    """
+
+    def __init__(self, account_ids: list, datasets: Dict[str, SpillDataset] = None, sync_state: SyncState = None, error: str = None,
+                 metrics: RunMetrics = None):
+        self.account_ids = account_ids
+        self.datasets = datasets or {}
+        self.sync_state = sync_state
+        self.error = error
+        self.metrics = metrics
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self.sync_state is not None:
+            state["sync_state"] = (self.sync_state.marks, self.sync_state.plans)
+        return state
+
+    def __setstate__(self, state):
+        if state["sync_state"] is not None:
+            marks, plans = state["sync_state"]
+            state["sync_state"] = SyncState(marks)
+            state["sync_state"].plans = plans
+        self.__dict__.update(state)
+
+
+def split_accounts(account_ids: list, shard_count: int) -> List[list]:
+    """Deal the accounts between at most shard_count shards of similar sizes
+
+    :rtype: list
+    """
+    shard_count = max(1, min(shard_count, len(account_ids)))
+    return [account_ids[index::shard_count] for index in range(shard_count)]
+
+
+def check_shard_accounts(account_ids: list, headers: dict, requests_per_second: float, cache_settings: dict, metrics: RunMetrics = None):
+    """Check all the accounts at once before dispatching the shards, so that an invalid account fails the run instead of its shard
+
+    :param RunMetrics metrics: collector of the recipe (None to skip)
+    :raises: :class:`ValueError`: Wrong account id or access token
+    """
+    scheduler = RequestScheduler(requests_per_second=requests_per_second)
+    with create_client(headers, scheduler=scheduler, cache=ResponseCache(**cache_settings), metrics=metrics) as client:
+        check_accounts(client, account_ids)
+
+
+def build_shards(account_ids: list, shard_count: int, headers: dict, settings: PullSettings, roles: List[str],
+                 max_workers: int, requests_per_second: float, cache_settings: dict, spill_directory: str,
+                 backend: Backend = Backend.SYNC) -> List[PullShard]:
+    """Split a pull by accounts. The request rate is shared between the shards, since they use the same token.
+    The accounts are expected to be checked already, see check_shard_accounts
+
+    :param str spill_directory: Local folder receiving the rows of the shards, a subfolder each
+    :rtype: list
+    """
+    shard_accounts = split_accounts(account_ids, shard_count)
+    scheduler_settings = {"requests_per_second": requests_per_second / len(shard_accounts)}
+    client_settings = {"backend": backend, "max_workers": max_workers, "pool_size": max_workers}
+    marks = settings.sync_state.marks if settings.incremental else None
+    shard_settings = PullSettings(None, settings.batch_size, start_date=settings.start_date, end_date=settings.end_date,
+                                  raw_response=settings.raw_response, flatten=settings.flatten, rows_per_id_per_day=settings.rows_per_id_per_day,
+                                  lookback_days=settings.lookback_days, fields=settings.fields, coalesce_analytics=settings.coalesce_analytics,
+                                  accounts_checked=True)
+    return [PullShard(accounts, headers, shard_settings, marks, roles, client_settings, scheduler_settings, cache_settings,
+                      os.path.join(spill_directory, "shard-{}".format(index)))
+            for index, accounts in enumerate(shard_accounts)]
+
+
+def run_shard(shard: PullShard) -> ShardResult:
+    """Pull the accounts of a shard, in a worker process. The rows are spilled to the folder of the shard, and their files sent back to the recipe.
+
+    :returns: the files of the rows of each output role, or the error which made the shard fail
+    :rtype: ShardResult
+    """
+    metrics = RunMetrics()
+    try:
+        settings = copy.copy(shard.settings)
+        settings.account_ids = shard.account_ids
+        settings.sync_state = SyncState(shard.marks) if shard.marks is not None else None
+        datasets = {role: SpillDataset(os.path.join(shard.spill_directory, role)) for role in shard.roles}
+        scheduler = RequestScheduler(**shard.scheduler_settings)
+        cache = ResponseCache(**shard.cache_settings)
+        with create_client(shard.headers, scheduler=scheduler, cache=cache, metrics=metrics, **shard.client_settings) as client:
+            build_pull_graph(client, settings, RecipeOutputs(datasets)).run(targets=shard.roles)
+    except Exception as err:
+        logger.error("The shard of accounts {} failed: {}".format(shard.account_ids, err))
+        return ShardResult(shard.account_ids, error=str(err), metrics=metrics)
+    return ShardResult(shard.account_ids, datasets, settings.sync_state, metrics=metrics)
+
+
+def run_shards(shards: List[PullShard]) -> List[ShardResult]:
+    """Run each shard in its own worker process
+
+    :returns: result of each shard, in their order
+    :rtype: list
+    """
+    if len(shards) == 1:
+        return [run_shard(shards[0])]
+    logger.info("Pulling {} shards of accounts in parallel".format(len(shards)))
+    # fork, since the worker processes cannot import the recipe script again
+    with ProcessPoolExecutor(max_workers=len(shards), mp_context=multiprocessing.get_context("fork")) as executor:
+        futures = [executor.submit(run_shard, shard) for shard in shards]
+        results = []
+        for shard, future in zip(shards, futures):
+            try:
+                results.append(future.result())
+            except Exception as err:
+                # ex - the worker process was killed
+                logger.error("The worker process of the accounts {} failed: {}".format(shard.account_ids, err))
+                results.append(ShardResult(shard.account_ids, error=str(err)))
+        return results
+
+
+def write_shard_results(results: List[ShardResult], outputs: RecipeOutputs, roles: List[str], settings: PullSettings, metrics: RunMetrics = None):
+    """Merge the rows of the shards into the outputs, streaming their spilled files one at a time. Each failed shard adds its own exception row
+    to every output, the rows of the other shards are written as usual.
+    In incremental mode, the marks of the successful shards are merged into the sync state of the recipe.
+
+    :param RunMetrics metrics: collector of the recipe, the metrics of every shard are merged into it (None to skip)
+    :raises: :class:`ValueError`: all the shards failed
+    """
+    if metrics:
+        for result in results:
+            if result.metrics:
+                metrics.merge(result.metrics)
+    failed_results = [result for result in results if result.error is not None]
+    if len(failed_results) == len(results):
+        raise ValueError("All the shards failed: {}".format("; ".join(result.error for result in failed_results)))
+    succeeded_results = [result for result in results if result.error is None]
+    if settings.incremental:
+        for result in succeeded_results:
+            settings.sync_state.merge(result.sync_state)
+    for role in roles:
+        category = OUTPUT_CATEGORY_DICT[role]
+        dataframes = chain.from_iterable(result.datasets[role].iter_dataframes() for result in succeeded_results if role in result.datasets)
+        error_rows = [format_to_df({"error": "Shard failed", "message": result.error, "accounts": result.account_ids}, category,
+                                   settings.raw_response, settings.flatten, fields=settings.fields.get(category))
+                      for result in failed_results]
+        with tempfile.TemporaryDirectory() as spill_directory:
+            previous_rows = outputs.read_previous(role, spill_directory) if settings.incremental and role in Constants.ANALYTICS_DATASET_ROLES else None
+            plan = settings.sync_state.plans.get(category, {}) if previous_rows is not None else None
+            previous_rows = [] if previous_rows is None else (drop_refreshed_rows(df, plan) for df in previous_rows.iter_dataframes())
+            outputs.write(role, chain(previous_rows, dataframes, error_rows), settings.get_output_schema(category))
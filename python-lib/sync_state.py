@@ -0,0 +1,202 @@
+import ast
+import json
+import logging
+import threading
+from datetime import date, datetime, timedelta, timezone
+from typing import Callable, Dict, Iterator, List
+
+import pandas as pd
+
+from api_call import iter_ad_analytics
+from api_client import LinkedinClient
+from api_format import get_urn_ids
+from dku_constants import Constants
+from parent_ids import MISSING_ID, ParentIds
+
+logger = logging.getLogger()
+
+
+class SyncState(object):
+    """High-water marks of an incremental sync: last fully settled day of analytics
+    already downloaded, per category, account and pivot id (campaign or creative)
+
+    :param dict marks: {category: {account_id: {pivot_id: "YYYY-MM-DD"}}}
+    """
+
+    def __init__(self, marks: dict = None):
+        self.marks = marks or {}
+        self.plans = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def load(cls, folder) -> "SyncState":
+        """Read the state from a managed folder. An empty state is returned on the first run
+
+        :param dataiku.Folder folder: Folder where the state is persisted
+        """
+        try:
+            marks = folder.read_json(Constants.SYNC_STATE_FILE)
+        except Exception as err:
+            logger.info("No previous sync state found ({}), all the analytics will be retrieved".format(err))
+            marks = {}
+        return cls(marks)
+
+    def save(self, folder):
+        folder.write_json(Constants.SYNC_STATE_FILE, self.marks)
+
+    def get_mark(self, category: str, account_id: str, pivot_id: int) -> date:
+        mark = self.marks.get(category, {}).get(str(account_id), {}).get(str(pivot_id))
+        return datetime.strptime(mark, "%Y-%m-%d").date() if mark else None
+
+    def set_mark(self, category: str, account_id: str, pivot_id: int, settled_date: date):
+        previous_mark = self.get_mark(category, account_id, pivot_id)
+        if previous_mark is None or settled_date > previous_mark:
+            account_marks = self.marks.setdefault(category, {}).setdefault(str(account_id), {})
+            account_marks[str(pivot_id)] = settled_date.strftime("%Y-%m-%d")
+
+    def plan(self, category: str, pivot_accounts: Dict[int, str], lookback_days: int, start_date: datetime, end_date: datetime) -> Dict[date, List[int]]:
+        """Group the pivot ids by the first day that still has to be retrieved.
+        Pivots already synced restart `lookback_days` before their mark, to catch late attributions.
+
+        :param dict pivot_accounts: account id of each pivot id
+        :param int lookback_days: number of settled days downloaded again
+        :param datetime start_date:  First day of the chosen time range (None for all time)
+        :param datetime end_date:  Last day of the time range (None for today)
+
+        :returns: pivot ids to query, by start date (None for all time). Pivots already up to date are left out.
+            The last plan of each category is also kept in self.plans
+        :rtype: dict
+        """
+        first_day = start_date.date() if start_date else None
+        last_day = end_date.date() if end_date else None
+        plan = {}
+        for pivot_id, account_id in pivot_accounts.items():
+            mark = self.get_mark(category, account_id, pivot_id)
+            pivot_start = first_day
+            if mark:
+                resume_day = mark + timedelta(days=1 - lookback_days)
+                pivot_start = max(resume_day, first_day) if first_day else resume_day
+            if last_day and pivot_start and pivot_start > last_day:
+                continue
+            plan.setdefault(pivot_start, []).append(pivot_id)
+        self.plans[category] = plan
+        return plan
+
+    def commit(self, category: str, pivot_accounts: Dict[int, str], end_date: datetime):
+        """Move the mark of the queried pivots to the last settled day: yesterday (UTC), or the end of the time range"""
+        settled_date = get_settled_date(end_date)
+        with self.lock:
+            for pivot_id, account_id in pivot_accounts.items():
+                self.set_mark(category, account_id, pivot_id, settled_date)
+
+    def merge(self, other: "SyncState"):
+        """Merge the marks and plans of another state, ex - the one of a shard of the accounts"""
+        with self.lock:
+            for category, account_marks in other.marks.items():
+                for account_id, pivot_marks in account_marks.items():
+                    for pivot_id, mark in pivot_marks.items():
+                        self.set_mark(category, account_id, pivot_id, datetime.strptime(mark, "%Y-%m-%d").date())
+            for category, plan in other.plans.items():
+                for start, pivot_ids in plan.items():
+                    self.plans.setdefault(category, {}).setdefault(start, []).extend(pivot_ids)
+
+
+def iter_incremental_analytics(client: LinkedinClient, category: str, parent: ParentIds, plan: Dict[date, List[int]],
+                               batch_size: int, end_date: datetime, rows_per_id_per_day: float = Constants.DEFAULT_ROWS_PER_ID_PER_DAY,
+                               iter_analytics: Callable[..., Iterator[dict]] = iter_ad_analytics, fields: List[str] = None) -> Iterator[dict]:
+    """Query the analytics of each group of pivots of an incremental plan, from its own start date
+
+    :param ParentIds parent: ids used to filter the query
+    :param dict plan: pivot ids to query, by start date (None for all time)
+    :param function iter_analytics: iter_ad_analytics of the backend of the client
+    :param list fields: metrics to retrieve (None for all of them)
+
+    :returns: Response of the API for each batch query. The iteration stops after the first query in error
+    :rtype: generator
+    """
+    if parent.error:
+        yield parent.error
+        return
+    if not plan:
+        yield {"elements": []}
+    for start, pivot_ids in plan.items():
+        start_date = datetime.combine(start, datetime.min.time()) if start else None
+        logger.info("Retrieving {} analytics of {} ids from {}".format(category, len(pivot_ids), start or "the beginning"))
+        pivots = parent.select(pivot_ids)
+        for query_output in iter_analytics(client, category, pivots, batch_size=batch_size, start_date=start_date, end_date=end_date,
+                                           rows_per_id_per_day=rows_per_id_per_day, fields=fields):
+            yield query_output
+            if "elements" not in query_output:
+                return
+
+
+def get_settled_date(end_date: datetime) -> date:
+    """Last day whose analytics will not change anymore, except for late attributions
+
+    :rtype: date
+    """
+    yesterday = datetime.now(timezone.utc).date() - timedelta(days=1)
+    return min(end_date.date(), yesterday) if end_date else yesterday
+
+
+def get_pivot_accounts(parent: ParentIds, campaigns: ParentIds = None) -> Dict[int, str]:
+    """Map the parent ids (campaigns or creatives) to their account id.
+    Creatives only reference their campaign, so their account is found through the campaign ids.
+
+    :returns: account id of each pivot id (None if unknown)
+    :rtype: dict
+    """
+    if parent.accounts is not None:
+        accounts = parent.accounts.tolist()
+    elif parent.campaigns is not None and campaigns is not None:
+        campaign_accounts = campaigns.get_accounts()
+        accounts = [campaign_accounts.get(campaign_id, MISSING_ID) for campaign_id in parent.campaigns.tolist()]
+    else:
+        accounts = [MISSING_ID] * len(parent)
+    return {pivot_id: None if account_id == MISSING_ID else str(account_id) for pivot_id, account_id in zip(parent.ids.tolist(), accounts)}
+
+
+def get_row_dates(analytics: pd.DataFrame) -> pd.Series:
+    """Day of each analytics row, from the flattened date column or from the nested dateRange"""
+    if "date" in analytics.columns:
+        return pd.to_datetime(analytics["date"], errors="coerce")
+    return get_start_dates(analytics["dateRange"])
+
+
+def get_start_dates(date_ranges: pd.Series) -> pd.Series:
+    """Extract the first day of analytics dateRange values, which are dicts or their string representation once written"""
+    return pd.to_datetime(date_ranges.map(parse_date_range_start), errors="coerce")
+
+
+def parse_date_range_start(date_range) -> date:
+    if isinstance(date_range, str):
+        try:
+            date_range = json.loads(date_range)
+        except ValueError:
+            try:
+                date_range = ast.literal_eval(date_range)
+            except (ValueError, SyntaxError):
+                return None
+    if not isinstance(date_range, dict) or "start" not in date_range:
+        return None
+    start = date_range["start"]
+    return date(int(start["year"]), int(start["month"]), int(start["day"]))
+
+
+def drop_refreshed_rows(existing: pd.DataFrame, plan: Dict[date, List[int]]) -> pd.DataFrame:
+    """Keep the rows of the previous runs that are not retrieved again by an incremental plan.
+    Previous rows inside a refreshed window (same pivot, same day or later) are replaced by the new ones.
+
+    :param pd.DataFrame existing: analytics written by the previous runs
+    :param dict plan: pivot ids queried by this run, by start date (None for all time)
+
+    :returns: previous rows to write again before the new ones
+    :rtype: pd.DataFrame
+    """
+    previous_rows = existing[existing["exception"].isna()] if "exception" in existing.columns else existing
+    window_starts = {pivot_id: pd.Timestamp(start) if start else pd.Timestamp.min for start, pivot_ids in plan.items() for pivot_id in pivot_ids}
+    if window_starts:
+        row_window_starts = get_urn_ids(previous_rows["pivotValue"]).map(window_starts)
+        stale = row_window_starts.notna() & (get_row_dates(previous_rows) >= row_window_starts)
+        previous_rows = previous_rows[~stale]
+    return previous_rows
@@ -0,0 +1,82 @@
+import logging
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List
+
+logger = logging.getLogger()
+
+
+class TaskGraph(object):
+    """Small dependency-aware scheduler. Each task starts as soon as all its dependencies are done,
+    so independent tasks run concurrently and the total duration is the one of the critical path.
+    """
+
+    def __init__(self):
+        self.tasks = {}
+
+    def add(self, name: str, function: Callable, dependencies: List[str] = None):
+        """Declare a task
+
+        :param str name: Unique name of the task
+        :param function function: Called with the results of the dependencies, in their order
+        :param list dependencies: Names of the tasks that must be done first
+        """
+        self.tasks[name] = (function, dependencies or [])
+
+    def get_required_tasks(self, targets: List[str]) -> List[str]:
+        """Targets and all the tasks they depend on, transitively
+
+        :raises: :class:`ValueError`: Unknown task
+        """
+        required_tasks = []
+        to_visit = list(targets)
+        while to_visit:
+            name = to_visit.pop()
+            if name in required_tasks:
+                continue
+            if name not in self.tasks:
+                raise ValueError("Unknown task: {}".format(name))
+            required_tasks.append(name)
+            to_visit.extend(self.tasks[name][1])
+        return required_tasks
+
+    def run(self, targets: List[str] = None, max_workers: int = None) -> Dict[str, object]:
+        """Run the targets (all the tasks if None) and their dependencies.
+        The result of a task which is not a target is released as soon as all the tasks depending on it are started,
+        so that a large intermediate result, ex - a listing of entities, can be freed before the end of the run.
+
+        :param int max_workers: Max number of tasks running at once (one per task if None)
+        :returns: result of each target
+        :rtype: dict
+        :raises: The first error raised by a task. The tasks not started yet are cancelled
+        """
+        targets = targets if targets is not None else list(self.tasks)
+        remaining_tasks = self.get_required_tasks(targets)
+        pending_dependents = {name: sum(name in self.tasks[other][1] for other in remaining_tasks) for name in remaining_tasks}
+        done_tasks = set()
+        results = {}
+        running = {}
+        with ThreadPoolExecutor(max_workers=max_workers or max(1, len(remaining_tasks))) as executor:
+            while remaining_tasks or running:
+                for name in [name for name in remaining_tasks if all(dependency in done_tasks for dependency in self.tasks[name][1])]:
+                    function, dependencies = self.tasks[name]
+                    logger.info("Starting {}".format(name))
+                    running[executor.submit(function, *[results[dependency] for dependency in dependencies])] = name
+                    remaining_tasks.remove(name)
+                    for dependency in dependencies:
+                        pending_dependents[dependency] -= 1
+                        if not pending_dependents[dependency] and dependency not in targets:
+                            del results[dependency]
+                if not running:
+                    raise ValueError("Circular dependencies between the tasks: {}".format(remaining_tasks))
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    error = future.exception()
+                    if error:
+                        for pending_future in running:
+                            pending_future.cancel()
+                        raise error
+                    logger.info("{} done".format(name))
+                    results[name] = future.result()
+                    done_tasks.add(name)
+        return results
@@ -0,0 +1,25 @@
+import pytest
+
+from linkedin_stub import LinkedinStubServer
+
+
+@pytest.fixture(scope="session")
+def stub_server():
+    server = LinkedinStubServer().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def start_stub_server():
+    """Start stub servers with their own data, latency and throttling. They are stopped at the end of the test"""
+    servers = []
+
+    def start(**kwargs) -> LinkedinStubServer:
+        server = LinkedinStubServer(**kwargs).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.stop()
@@ -0,0 +1,35 @@
+from typing import List
+
+import pandas as pd
+
+
+class MemoryDataset(object):
+    """Stand-in for a dataiku.Dataset which keeps the written dataframes in memory, ex - to run the stages in the tests without DSS"""
+
+    def __init__(self):
+        self.dataframes = []
+        self.schema = None
+
+    def write_schema(self, schema: List[dict]):
+        self.dataframes = []
+        self.schema = schema
+
+    def write_schema_from_dataframe(self, df: pd.DataFrame):
+        self.dataframes = []
+        self.schema = None
+
+    def get_writer(self):
+        return self
+
+    def write_dataframe(self, df: pd.DataFrame):
+        self.dataframes.append(df)
+
+    def close(self):
+        pass
+
+    def get_dataframe(self) -> pd.DataFrame:
+        """
+        :returns: all the rows written, or None if nothing was written
+        :rtype: pd.DataFrame
+        """
+        return pd.concat(self.dataframes, ignore_index=True) if self.dataframes else None
@@ -0,0 +1,210 @@
+import json
+import threading
+import time
+import zlib
+from datetime import date, datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+MAX_ENTITIES_PER_QUERY = 1000
+TOO_MANY_ENTITIES_MESSAGE = "Request would return too many entities."
+CREATION_TIME_MS = int(datetime(2020, 1, 1, tzinfo=timezone.utc).timestamp() * 1000)
+
+
+class SyntheticLinkedinData(object):
+    """Synthetic ad accounts, campaign groups, campaigns and creatives, at a configurable scale.
+    Every campaign and creative has one analytics row per day.
+
+    :param int accounts: Number of ad accounts
+    :param int groups_per_account: Number of campaign groups of each account
+    :param int campaigns_per_group: Number of campaigns of each campaign group
+    :param int creatives_per_campaign: Number of creatives of each campaign
+    """
+
+    def __init__(self, accounts: int = 1, groups_per_account: int = 1, campaigns_per_group: int = 1, creatives_per_campaign: int = 1):
+        self.accounts = [{"id": 500000000 + index, "name": "Account {}".format(index), "status": "ACTIVE", "type": "BUSINESS", "currency": "USD"}
+                         for index in range(accounts)]
+        self.account_ids = {}
+        self.groups = [self.build_entity(10000000 + index, account["id"])
+                       for index, account in enumerate(account for account in self.accounts for _ in range(groups_per_account))]
+        self.campaigns = [self.build_entity(20000000 + index, self.account_ids[group["id"]], group=group["id"])
+                          for index, group in enumerate(group for group in self.groups for _ in range(campaigns_per_group))]
+        self.creatives = [self.build_entity(30000000 + index, self.account_ids[campaign["id"]], campaign=campaign["id"])
+                          for index, campaign in enumerate(campaign for campaign in self.campaigns for _ in range(creatives_per_campaign))]
+        self.listings = {}
+        self.lock = threading.Lock()
+
+    def build_entity(self, entity_id: int, account_id: int, group: int = None, campaign: int = None) -> dict:
+        self.account_ids[entity_id] = account_id
+        entity = {
+            "id": entity_id,
+            "name": "Entity {}".format(entity_id),
+            "status": "ACTIVE",
+            "changeAuditStamps": {"created": {"time": CREATION_TIME_MS}, "lastModified": {"time": CREATION_TIME_MS}}
+        }
+        if campaign is None:
+            entity["account"] = "urn:li:sponsoredAccount:{}".format(account_id)
+        else:
+            entity["campaign"] = "urn:li:sponsoredCampaign:{}".format(campaign)
+        if group is not None:
+            entity["campaignGroup"] = "urn:li:sponsoredCampaignGroup:{}".format(group)
+        return entity
+
+    def get_listing(self, path: str, account_ids: set) -> list:
+        """Entities of a listing endpoint which belong to the accounts, computed once for all the pages"""
+        key = (path, frozenset(account_ids))
+        with self.lock:
+            if key not in self.listings:
+                entities = {"/adCampaignGroupsV2": self.groups, "/adCampaignsV2": self.campaigns, "/adCreativesV2": self.creatives}
+                listing = next((listing for suffix, listing in entities.items() if path.endswith(suffix)), [])
+                self.listings[key] = [entity for entity in listing if self.account_ids[entity["id"]] in account_ids]
+            return self.listings[key]
+
+    @classmethod
+    def with_creatives(cls, creatives: int) -> "SyntheticLinkedinData":
+        """Data with about `creatives` creatives, 10 creatives per campaign and 10 campaigns per group"""
+        campaigns = max(1, creatives // 10)
+        groups = max(1, campaigns // 10)
+        return cls(1, groups, max(1, campaigns // groups), max(1, creatives // campaigns))
+
+    def get_pivot_urns(self, parameters: dict) -> list:
+        """URNs of the analytics rows of a query: the filtered entities, or the creatives of the filtered campaigns with the CREATIVE pivot"""
+        filter_urns = [value for key, value in parameters.items() if key.startswith(("campaigns[", "creatives["))]
+        if parameters.get("pivot") != "CREATIVE" or any(key.startswith("creatives[") for key in parameters):
+            return filter_urns
+        campaign_urns = set(filter_urns)
+        return ["urn:li:sponsoredCreative:{}".format(creative["id"]) for creative in self.creatives if creative["campaign"] in campaign_urns]
+
+    def get_analytics(self, pivot_urns: list, first_day: date, last_day: date) -> list:
+        rows = []
+        day = first_day
+        while day <= last_day:
+            date_range = {"start": {"year": day.year, "month": day.month, "day": day.day}, "end": {"year": day.year, "month": day.month, "day": day.day}}
+            for pivot_urn in pivot_urns:
+                seed = zlib.crc32("{}:{}".format(pivot_urn, day.toordinal()).encode("utf-8"))
+                rows.append({
+                    "pivotValue": pivot_urn,
+                    "dateRange": date_range,
+                    "costInUsd": "{:.2f}".format(seed % 10000 / 100),
+                    "impressions": seed % 5000,
+                    "clicks": seed % 50,
+                    "externalWebsitePostClickConversions": seed % 5,
+                    "externalWebsitePostViewConversions": seed % 3
+                })
+            day += timedelta(days=1)
+        return rows
+
+
+class LinkedinStubHandler(BaseHTTPRequestHandler):
+    """Answers the GET queries like the LinkedIn ad APIs, over HTTP/1.1 so that keep-alive is honoured"""
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        stub = self.server.stub
+        url = urlparse(self.path)
+        parameters = dict(parse_qsl(url.query))
+        if stub.latency_sec:
+            time.sleep(stub.latency_sec)
+        if stub.is_throttled():
+            self.send_json(429, {"message": "Resource level throttle limit reached"}, {"Retry-After": "0"})
+            return
+        path = url.path.rstrip("/")
+        if path.endswith("/adAnalyticsV2"):
+            self.send_analytics(stub.data, parameters)
+        elif path.endswith("/adAccountsV2"):
+            account_ids = {int(value) for key, value in parameters.items() if key.startswith("search.id.values")}
+            self.send_page([account for account in stub.data.accounts if account["id"] in account_ids], parameters)
+        else:
+            account_ids = {int(value.rsplit(":", 1)[-1]) for key, value in parameters.items() if key.startswith("search.account.values")}
+            self.send_page(stub.data.get_listing(path, account_ids), parameters)
+
+    def send_page(self, entities: list, parameters: dict):
+        start = int(parameters.get("start", 0))
+        count = int(parameters.get("count", 100))
+        elements = project(entities[start:start + count], parameters)
+        self.send_json(200, {"elements": elements, "paging": {"count": count, "start": start, "total": len(entities)}})
+
+    def send_analytics(self, data: SyntheticLinkedinData, parameters: dict):
+        pivot_urns = data.get_pivot_urns(parameters)
+        first_day = get_date(parameters, "start") or date(2006, 1, 1)
+        last_day = get_date(parameters, "end") or datetime.now(timezone.utc).date()
+        if len(pivot_urns) * ((last_day - first_day).days + 1) > MAX_ENTITIES_PER_QUERY:
+            self.send_json(400, {"message": TOO_MANY_ENTITIES_MESSAGE, "status": 400})
+            return
+        elements = project(data.get_analytics(pivot_urns, first_day, last_day), parameters)
+        self.send_json(200, {"elements": elements, "paging": {"count": 10, "start": 0, "links": []}})
+
+    def send_json(self, status: int, response: dict, headers: dict = None):
+        body = json.dumps(response).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def project(elements: list, parameters: dict) -> list:
+    """Keep the fields of the elements listed by the projection of the query, ex - (*,elements*(id,name))"""
+    projection = parameters.get("projection", "")
+    if "elements*(" not in projection:
+        return elements
+    fields = {field.split("(")[0].rstrip("~") for field in projection.split("elements*(", 1)[1].rstrip(")").split(",")}
+    return [{key: value for key, value in element.items() if key in fields} for element in elements]
+
+
+def get_date(parameters: dict, bound: str) -> date:
+    try:
+        return date(*[int(parameters["dateRange.{}.{}".format(bound, part)]) for part in ["year", "month", "day"]])
+    except KeyError:
+        return None
+
+
+class LinkedinStubServer(object):
+    """Local stand-in for the LinkedIn API, served from a background thread
+
+    :param SyntheticLinkedinData data: Entities served by the stub (none if None)
+    :param float latency_sec: Delay added to every response
+    :param int throttle_every: Answer every n-th query with a 429 (never if 0)
+    """
+
+    def __init__(self, data: SyntheticLinkedinData = None, latency_sec: float = 0, throttle_every: int = 0):
+        self.data = data or SyntheticLinkedinData(0)
+        self.latency_sec = latency_sec
+        self.throttle_every = throttle_every
+        self.requests = 0
+        self.throttled_requests = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), LinkedinStubHandler)
+        self.server.daemon_threads = True
+        self.server.stub = self
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address
+        return "http://{}:{}".format(host, port)
+
+    @property
+    def api_url(self) -> str:
+        return self.url + "/v2"
+
+    def is_throttled(self) -> bool:
+        with self.lock:
+            self.requests += 1
+            throttled = bool(self.throttle_every) and self.requests % self.throttle_every == 0
+            self.throttled_requests += throttled
+            return throttled
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,30 @@
+import requests
+
+from api_client import LinkedinClient
+from request_scheduler import RequestScheduler
+
+REQUESTS_PER_ROUND = 50
+
+
+def test_bare_requests_get(benchmark, stub_server):
+    url = stub_server.url + "/v2/adCampaignsV2"
+
+    def run():
+        for start in range(REQUESTS_PER_ROUND):
+            requests.get(url=url, headers={"authorization": "Bearer token"}, params={"start": start}).json()
+
+    benchmark.extra_info["requests_per_round"] = REQUESTS_PER_ROUND
+    benchmark(run)
+
+
+def test_pooled_client_get(benchmark, stub_server):
+    url = stub_server.url + "/v2/adCampaignsV2"
+    client = LinkedinClient({"authorization": "Bearer token"}, scheduler=RequestScheduler(requests_per_second=10000))
+
+    def run():
+        for start in range(REQUESTS_PER_ROUND):
+            client.get(url, {"start": start}).json()
+
+    benchmark.extra_info["requests_per_round"] = REQUESTS_PER_ROUND
+    benchmark(run)
+    client.close()
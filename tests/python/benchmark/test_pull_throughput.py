@@ -0,0 +1,126 @@
+from datetime import datetime, timedelta
+
+import pandas as pd
+import pytest
+
+from api_call import plan_analytics_requests, query_by_batch, set_up_query
+from api_format import format_to_df, roll_up_creative_analytics
+from dataset_stubs import MemoryDataset
+from dataset_writer import RecipeOutputs
+from dku_constants import Backend, Category, Constants
+from linkedin_stub import SyntheticLinkedinData
+from parent_ids import ParentIds
+from parquet_export import build_record_batch, get_arrow_schema
+from pull_pipeline import PullSettings, build_pull_graph, create_client
+from request_scheduler import RequestScheduler
+
+SCALES = [10, 1000, 100000]
+ROUNDS = {10: 10, 1000: 5, 100000: 1}
+FIRST_DAY = datetime(2021, 3, 1)
+DAYS = 10
+HEADERS = {"authorization": "Bearer token"}
+
+
+def create_stub_client(server, backend: Backend = Backend.SYNC):
+    scheduler = RequestScheduler(requests_per_second=100000, backoff_base_sec=0.01)
+    return create_client(HEADERS, backend, scheduler=scheduler, api_url=server.api_url)
+
+
+def get_campaign_urns(entities: int) -> list:
+    """URNs of campaigns that have `entities` analytics rows in total over DAYS days"""
+    return ["urn:li:sponsoredCampaign:{}".format(20000000 + index) for index in range(max(1, entities // DAYS))]
+
+
+@pytest.mark.parametrize("backend", [Backend.SYNC, Backend.ASYNC], ids=["sync", "async"])
+@pytest.mark.parametrize("entities", SCALES)
+def test_end_to_end_pull(benchmark, start_stub_server, entities, backend):
+    data = SyntheticLinkedinData.with_creatives(entities)
+    server = start_stub_server(data=data)
+    settings = PullSettings([str(account["id"]) for account in data.accounts], Constants.DEFAULT_BATCH_SIZE, start_date=FIRST_DAY, end_date=FIRST_DAY,
+                            flatten=True, rows_per_id_per_day=1)
+
+    def run():
+        datasets = {role: MemoryDataset() for role in Constants.OUTPUT_DATASET_ROLES}
+        with create_stub_client(server, backend) as client:
+            build_pull_graph(client, settings, RecipeOutputs(datasets)).run()
+        return datasets
+
+    datasets = benchmark.pedantic(run, rounds=ROUNDS[entities], iterations=1)
+    benchmark.extra_info["creatives"] = len(data.creatives)
+    benchmark.extra_info["requests"] = server.requests
+    assert len(datasets[Constants.CREATIVE_DATASET].get_dataframe()) == len(data.creatives)
+    assert len(datasets[Constants.CREATIVE_ANALYTICS_DATASET].get_dataframe()) == len(data.creatives)
+
+
+@pytest.mark.parametrize("entities", SCALES)
+def test_query_by_batch(benchmark, start_stub_server, entities):
+    server = start_stub_server()
+    ids = [urn.rsplit(":", 1)[-1] for urn in get_campaign_urns(entities)]
+    analytics_requests = plan_analytics_requests(ids, Constants.DEFAULT_BATCH_SIZE, FIRST_DAY, FIRST_DAY + timedelta(days=DAYS - 1), rows_per_id_per_day=1)
+    url, initial_params = set_up_query(Category.CAMPAIGN_ANALYTICS)
+    client = create_stub_client(server)
+
+    response = benchmark.pedantic(lambda: query_by_batch(analytics_requests, Category.CAMPAIGN_ANALYTICS, url, client, initial_params),
+                                  rounds=ROUNDS[entities], iterations=1)
+    client.close()
+    benchmark.extra_info["requests_per_round"] = len(analytics_requests)
+    assert len(response["elements"]) == len(ids) * DAYS
+
+
+def test_query_by_batch_with_latency_and_throttling(benchmark, start_stub_server):
+    server = start_stub_server(latency_sec=0.005, throttle_every=10)
+    ids = [urn.rsplit(":", 1)[-1] for urn in get_campaign_urns(1000)]
+    analytics_requests = plan_analytics_requests(ids, 10, FIRST_DAY, FIRST_DAY + timedelta(days=DAYS - 1), rows_per_id_per_day=1)
+    url, initial_params = set_up_query(Category.CAMPAIGN_ANALYTICS)
+    client = create_stub_client(server)
+
+    response = benchmark.pedantic(lambda: query_by_batch(analytics_requests, Category.CAMPAIGN_ANALYTICS, url, client, initial_params), rounds=3, iterations=1)
+    client.close()
+    benchmark.extra_info["throttled_requests"] = server.throttled_requests
+    assert len(response["elements"]) == len(ids) * DAYS
+
+
+@pytest.mark.parametrize("flatten", [False, True], ids=["nested", "flat"])
+@pytest.mark.parametrize("entities", SCALES)
+def test_format_to_df(benchmark, entities, flatten):
+    urns = get_campaign_urns(entities)
+    elements = SyntheticLinkedinData(0).get_analytics(urns, FIRST_DAY.date(), FIRST_DAY.date() + timedelta(days=DAYS - 1))
+    response = {"elements": elements}
+
+    df = benchmark(format_to_df, response, Category.CAMPAIGN_ANALYTICS, False, flatten)
+    assert len(df) == len(elements)
+
+
+@pytest.mark.parametrize("entities", SCALES)
+def test_format_to_df_with_raw_response(benchmark, entities):
+    urns = get_campaign_urns(entities)
+    elements = SyntheticLinkedinData(0).get_analytics(urns, FIRST_DAY.date(), FIRST_DAY.date() + timedelta(days=DAYS - 1))
+    response = {"elements": elements}
+
+    df = benchmark(format_to_df, response, Category.CAMPAIGN_ANALYTICS, True)
+    assert len(df) == len(elements)
+    assert "raw_response" not in elements[0]
+
+
+@pytest.mark.parametrize("entities", SCALES)
+def test_build_record_batch(benchmark, entities):
+    pytest.importorskip("pyarrow")
+    urns = get_campaign_urns(entities)
+    elements = SyntheticLinkedinData(0).get_analytics(urns, FIRST_DAY.date(), FIRST_DAY.date() + timedelta(days=DAYS - 1))
+    pivot_accounts = {20000000 + index: 500000000 for index in range(len(urns))}
+    schema = get_arrow_schema(Category.CAMPAIGN_ANALYTICS)
+
+    batch = benchmark(build_record_batch, elements, Category.CAMPAIGN_ANALYTICS, pivot_accounts, schema)
+    assert batch.num_rows == len(elements)
+
+
+@pytest.mark.parametrize("entities", SCALES)
+def test_roll_up_creative_analytics(benchmark, entities):
+    data = SyntheticLinkedinData.with_creatives(max(1, entities // DAYS))
+    urns = ["urn:li:sponsoredCreative:{}".format(creative["id"]) for creative in data.creatives]
+    elements = data.get_analytics(urns, FIRST_DAY.date(), FIRST_DAY.date() + timedelta(days=DAYS - 1))
+    creative_campaigns = ParentIds.from_entities(pd.DataFrame(data.creatives)).get_campaign_urns()
+
+    response = benchmark(roll_up_creative_analytics, {"elements": elements}, creative_campaigns)
+    assert len(response["elements"]) == len(data.campaigns) * DAYS
+    assert sum(element["clicks"] for element in response["elements"]) == sum(element["clicks"] for element in elements)
@@ -0,0 +1,50 @@
+from typing import Iterator, List
+
+import pandas as pd
+
+
+class MemoryDataset(object):
+    """Stand-in for a dataiku.Dataset which keeps the written dataframes in memory, ex - to run the stages in the tests without DSS"""
+
+    def __init__(self):
+        self.dataframes = []
+        self.schema = None
+
+    def write_schema(self, schema: List[dict]):
+        self.dataframes = []
+        self.schema = schema
+
+    def write_schema_from_dataframe(self, df: pd.DataFrame):
+        self.dataframes = []
+        self.schema = None
+
+    def get_writer(self):
+        return self
+
+    def write_dataframe(self, df: pd.DataFrame):
+        self.dataframes.append(df)
+
+    def close(self):
+        pass
+
+    def read_schema(self, raise_if_empty: bool = True) -> List[dict]:
+        if self.schema is None and self.dataframes:
+            return [{"name": column} for column in self.dataframes[0].columns]
+        return self.schema or []
+
+    def list_partitions(self, raise_if_empty: bool = True) -> List[str]:
+        return ["NP"] if self.dataframes else []
+
+    def iter_dataframes(self, chunksize: int = 10000) -> Iterator[pd.DataFrame]:
+        """Read the rows back, one written dataframe at a time
+
+        :rtype: generator
+        """
+        yield from self.dataframes
+
+    def get_dataframe(self) -> pd.DataFrame:
+        """
+        :returns: all the rows written, or None if nothing was written
+        :rtype: pd.DataFrame
+        """
+        return pd.concat(self.dataframes, ignore_index=True) if self.dataframes else None
@@ -0,0 +1,61 @@
+from datetime import date, datetime
+
+import numpy as np
+
+from api_call import iter_ad_analytics, plan_analytics_requests, split_by_weight, split_time_range
+from dku_constants import Category, Constants
+from parent_ids import ParentIds
+from run_metrics import RunMetrics
+
+
+class FakeClient(object):
+    """Client failing the test if a query is sent"""
+    max_workers = 1
+
+    def __init__(self):
+        self.metrics = RunMetrics()
+
+    def get(self, *args, **kwargs):
+        raise AssertionError("No query expected")
+
+
+def test_default_plan_queries_each_batch_over_the_whole_time_range():
+    analytics_requests = plan_analytics_requests(list(range(400)), 80, datetime(2019, 1, 1), datetime(2023, 12, 31))
+
+    assert len(analytics_requests) == 5
+    assert {(window_start, window_end) for _, window_start, window_end in analytics_requests} == {(date(2019, 1, 1), date(2023, 12, 31))}
+
+
+def test_plan_with_estimated_activity_splits_the_time_range():
+    analytics_requests = plan_analytics_requests(list(range(30)), 80, datetime(2021, 1, 15), datetime(2021, 3, 10), rows_per_id_per_day=1)
+
+    assert [(window_start, window_end) for _, window_start, window_end in analytics_requests] == [
+        (date(2021, 1, 15), date(2021, 1, 31)), (date(2021, 2, 1), date(2021, 2, 28)), (date(2021, 3, 1), date(2021, 3, 10))
+    ]
+
+
+def test_time_range_ending_before_it_starts_has_no_window():
+    assert split_time_range(date(2021, 3, 2), date(2021, 3, 1)) == []
+    assert split_time_range(date(2021, 3, 2), date(2021, 3, 1), 7) == []
+    assert plan_analytics_requests(list(range(10)), 80, datetime(2021, 3, 2), datetime(2021, 3, 1)) == []
+
+
+def test_analytics_ending_before_the_first_creation_are_empty():
+    parent = ParentIds(np.array([100], dtype=np.int64), created=np.array(["2021-06-01"], dtype="datetime64[ms]"))
+
+    responses = list(iter_ad_analytics(FakeClient(), Category.CAMPAIGN_ANALYTICS, parent, end_date=datetime(2021, 3, 1)))
+
+    assert responses == [{"elements": []}]
+
+
+def test_split_by_weight():
+    chunks = split_by_weight(np.array([1, 2, 3, 4, 5]), np.array([30, 50, 10, 120, 0]), 80)
+
+    assert [chunk.tolist() for chunk in chunks] == [[1, 2], [3], [4], [5]]
+
+
+def test_weighted_plan_sizes_the_batches_by_weight():
+    analytics_requests = plan_analytics_requests(list(range(6)), Constants.DEFAULT_BATCH_SIZE, datetime(2021, 3, 1), datetime(2021, 3, 1),
+                                                 id_weights=np.array([40, 40, 40, 40, 1, 1]))
+
+    assert [chunk.tolist() for chunk, _, _ in analytics_requests] == [[0, 1], [2, 3], [4, 5]]
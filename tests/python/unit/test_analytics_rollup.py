@@ -0,0 +1,111 @@
+import json
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from api_format import has_unknown_creatives, roll_up_creative_analytics
+from dataset_stubs import MemoryDataset
+from dataset_writer import RecipeOutputs
+from dku_constants import Constants
+from parent_ids import ParentIds
+from pull_pipeline import PullSettings, pull_coalesced_analytics
+from run_metrics import RunMetrics
+
+CREATIVE_CAMPAIGNS = pd.Series({10: "urn:li:sponsoredCampaign:1", 20: "urn:li:sponsoredCampaign:2"})
+CAMPAIGN_CREATIVES = {1: [10], 2: [20, 30]}  # creative 30 is missing from the creatives listing
+
+
+def get_element(pivot_value: str, clicks: int) -> dict:
+    return {"pivotValue": pivot_value, "clicks": clicks, "dateRange": {"start": {"year": 2021, "month": 3, "day": 1},
+                                                                       "end": {"year": 2021, "month": 3, "day": 1}}}
+
+
+def get_creative_analytics(creative_ids: list) -> dict:
+    return {"elements": [get_element("urn:li:sponsoredCreative:{}".format(creative_id), creative_id) for creative_id in creative_ids]}
+
+
+class FakeResponse(object):
+    status_code = 200
+    headers = {}
+
+    def __init__(self, body: dict):
+        self.content = json.dumps(body).encode("utf-8")
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class FakeClient(object):
+    """Client of the sync backend, answering the analytics queries of both pivots"""
+    max_workers = 2
+    cache = None
+    checkpoints = None
+
+    def __init__(self):
+        self.metrics = RunMetrics()
+        self.pivots = []
+
+    def get(self, url: str, parameters: dict) -> FakeResponse:
+        campaign_ids = [int(value.rsplit(":", 1)[-1]) for key, value in parameters.items() if key.startswith("campaigns[")]
+        self.pivots.append(parameters["pivot"])
+        if parameters["pivot"] == "CAMPAIGN":
+            return FakeResponse({"elements": [get_element("urn:li:sponsoredCampaign:{}".format(campaign_id), 100 * campaign_id)
+                                              for campaign_id in campaign_ids]})
+        return FakeResponse(get_creative_analytics([creative_id for campaign_id in campaign_ids for creative_id in CAMPAIGN_CREATIVES[campaign_id]]))
+
+
+def get_clicks(request_query: dict) -> dict:
+    return {element["pivotValue"]: element["clicks"] for element in request_query["elements"]}
+
+
+def test_unknown_creatives_are_detected():
+    assert not has_unknown_creatives(get_creative_analytics([10, 20]), CREATIVE_CAMPAIGNS)
+    assert has_unknown_creatives(get_creative_analytics([10, 30]), CREATIVE_CAMPAIGNS)
+    assert not has_unknown_creatives({"elements": []}, CREATIVE_CAMPAIGNS)
+
+
+def test_unknown_creatives_belong_to_the_single_campaign_of_the_batch():
+    response = get_creative_analytics([20, 30])
+
+    assert get_clicks(roll_up_creative_analytics(response, CREATIVE_CAMPAIGNS, batch_campaigns=np.array([2]))) == {"urn:li:sponsoredCampaign:2": 50}
+    assert get_clicks(roll_up_creative_analytics(response, CREATIVE_CAMPAIGNS)) == {"urn:li:sponsoredCampaign:2": 20}
+
+
+def test_costs_are_summed_exactly_in_the_format_of_the_api():
+    response = {"elements": [{**get_element("urn:li:sponsoredCreative:20", 1), "costInUsd": "0.1"},
+                             {**get_element("urn:li:sponsoredCreative:20", 1), "costInUsd": "0.2"},
+                             {**get_element("urn:li:sponsoredCreative:20", 1), "costInUsd": "12345678.123456789012"}]}
+
+    element = roll_up_creative_analytics(response, CREATIVE_CAMPAIGNS)["elements"][0]
+
+    assert element["costInUsd"] == "12345678.423456789012"
+    assert element["clicks"] == 3
+
+
+def pull(campaign_ids: list, raw_response: bool = False) -> (FakeClient, dict):
+    campaigns = ParentIds(np.array(campaign_ids))
+    creatives = ParentIds(np.array([10, 20]), campaigns=np.array([1, 2]))
+    settings = PullSettings(["9"], 10, start_date=datetime(2021, 3, 1), end_date=datetime(2021, 3, 1), rows_per_id_per_day=0,
+                            raw_response=raw_response)
+    datasets = {role: MemoryDataset() for role in Constants.ANALYTICS_DATASET_ROLES}
+    client = FakeClient()
+    pull_coalesced_analytics(client, campaigns, creatives, settings, RecipeOutputs(datasets))
+    return client, {role: dataset.get_dataframe() for role, dataset in datasets.items()}
+
+
+def test_rolled_up_rows_have_no_raw_response():
+    client, outputs = pull([1], raw_response=True)
+
+    assert client.pivots == ["CREATIVE"]
+    assert outputs[Constants.CREATIVE_ANALYTICS_DATASET]["raw_response"].notna().all()
+    assert outputs[Constants.CAMPAIGN_ANALYTICS_DATASET]["raw_response"].isna().all()
+    assert outputs[Constants.CAMPAIGN_ANALYTICS_DATASET]["clicks"].astype(int).tolist() == [10]
+
+
+def test_batches_with_unknown_creatives_query_the_campaign_analytics():
+    client, outputs = pull([1, 2])
+
+    assert client.pivots == ["CREATIVE", "CAMPAIGN"]
+    assert len(outputs[Constants.CREATIVE_ANALYTICS_DATASET]) == 3
+    assert sorted(outputs[Constants.CAMPAIGN_ANALYTICS_DATASET]["clicks"].astype(int).tolist()) == [100, 200]
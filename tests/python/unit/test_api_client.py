@@ -0,0 +1,50 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from api_client import LinkedinClient, rebase_url
+from dku_constants import Constants
+from request_scheduler import RequestScheduler
+
+
+class FakeResponse(object):
+    status_code = 200
+    headers = {}
+
+
+class FakeSession(object):
+    """Stand-in for the requests.Session of the client, recording the number of queries in flight"""
+
+    def __init__(self):
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def get(self, url: str, params: dict) -> FakeResponse:
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(0.01)
+        with self.lock:
+            self.in_flight -= 1
+        return FakeResponse()
+
+
+def test_queries_in_flight_are_bounded_across_the_stages():
+    client = LinkedinClient({}, max_workers=3, scheduler=RequestScheduler(requests_per_second=10000))
+    client.session = FakeSession()
+
+    def run_stage(stage: int):
+        with ThreadPoolExecutor(max_workers=client.max_workers) as executor:
+            list(executor.map(lambda page: client.get(Constants.API_URL + "/adCampaignsV2", {"start": page}), range(10)))
+
+    with ThreadPoolExecutor(max_workers=3) as stages:
+        list(stages.map(run_stage, range(3)))
+
+    assert client.session.max_in_flight == 3
+
+
+def test_rebase_url():
+    assert rebase_url(Constants.API_URL + "/adAnalyticsV2", "http://localhost:8000/v2/") == "http://localhost:8000/v2/adAnalyticsV2"
+    assert rebase_url(Constants.API_URL + "/adAnalyticsV2", Constants.API_URL) == Constants.API_URL + "/adAnalyticsV2"
+    assert rebase_url("https://example.com/next", "http://localhost:8000/v2") == "https://example.com/next"
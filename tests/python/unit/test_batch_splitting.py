@@ -0,0 +1,100 @@
+import json
+import threading
+from datetime import date
+
+import numpy as np
+
+from api_call import is_too_many_entities, query_by_batch, set_up_query
+from dku_constants import Category
+from run_metrics import RunMetrics
+
+CATEGORY = Category.CAMPAIGN_ANALYTICS
+URL, INITIAL_PARAMS = set_up_query(CATEGORY)
+TOO_MANY_ENTITIES = {"message": "Request would return too many entities.", "status": 400}
+
+
+class FakeResponse(object):
+    headers = {}
+
+    def __init__(self, status_code: int, body: dict):
+        self.status_code = status_code
+        self.content = json.dumps(body).encode("utf-8")
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class FakeClient(object):
+    """Client answering one analytics row per campaign and per day, refusing the queries of more than max_rows rows"""
+    cache = None
+    checkpoints = None
+    max_workers = 3
+
+    def __init__(self, max_rows: int, failing_campaigns: list = ()):
+        self.max_rows = max_rows
+        self.failing_campaigns = failing_campaigns
+        self.metrics = RunMetrics()
+        self.queries = []
+        self.lock = threading.Lock()
+
+    def get(self, url: str, parameters: dict) -> FakeResponse:
+        campaign_ids = [int(value.rsplit(":", 1)[-1]) for key, value in parameters.items() if key.startswith("campaigns[")]
+        first_day = date(parameters["dateRange.start.year"], parameters["dateRange.start.month"], parameters["dateRange.start.day"])
+        last_day = date(parameters["dateRange.end.year"], parameters["dateRange.end.month"], parameters["dateRange.end.day"])
+        days = [first_day.replace(day=day) for day in range(first_day.day, last_day.day + 1)]
+        with self.lock:
+            self.queries.append((campaign_ids, first_day, last_day))
+        if len(campaign_ids) * len(days) > self.max_rows:
+            return FakeResponse(400, TOO_MANY_ENTITIES)
+        if set(campaign_ids) & set(self.failing_campaigns):
+            return FakeResponse(500, {"message": "Internal error", "status": 500})
+        return FakeResponse(200, {"elements": [{"pivotValue": "urn:li:sponsoredCampaign:{}".format(campaign_id), "day": day.isoformat()}
+                                               for campaign_id in campaign_ids for day in days]})
+
+
+def get_rows(response: dict) -> list:
+    return [(int(element["pivotValue"].rsplit(":", 1)[-1]), element["day"]) for element in response["elements"]]
+
+
+def test_too_many_entities_message():
+    assert is_too_many_entities(TOO_MANY_ENTITIES)
+    assert is_too_many_entities({"message": "Request would return TOO MANY ENTITIES"})
+    assert not is_too_many_entities({"message": "Internal error"})
+    assert not is_too_many_entities({"elements": []})
+
+
+def test_oversized_batches_are_split_until_they_fit():
+    client = FakeClient(max_rows=4)
+    analytics_requests = [(np.array([1, 2, 3, 4, 5]), date(2021, 3, 1), date(2021, 3, 2)), (np.array([6]), date(2021, 3, 1), date(2021, 3, 2))]
+
+    response = query_by_batch(analytics_requests, CATEGORY, URL, client, INITIAL_PARAMS)
+
+    days = ["2021-03-01", "2021-03-02"]
+    assert get_rows(response) == [(campaign_id, day) for campaign_id in range(1, 7) for day in days]
+    assert sorted(campaign_ids for campaign_ids, _, _ in client.queries) == [[1, 2], [1, 2, 3], [1, 2, 3, 4, 5], [3], [4, 5], [6]]
+
+
+def test_single_id_is_split_on_its_time_window():
+    client = FakeClient(max_rows=2)
+
+    response = query_by_batch([(np.array([1]), date(2021, 3, 1), date(2021, 3, 8))], CATEGORY, URL, client, INITIAL_PARAMS)
+
+    assert [day for _, day in get_rows(response)] == ["2021-03-0{}".format(day) for day in range(1, 9)]
+    assert [(first_day.day, last_day.day) for _, first_day, last_day in client.queries] == [(1, 8), (1, 4), (1, 2), (3, 4), (5, 8), (5, 6), (7, 8)]
+
+
+def test_single_day_that_is_still_too_large_is_reported():
+    response = query_by_batch([(np.array([1]), date(2021, 3, 1), date(2021, 3, 1))], CATEGORY, URL, FakeClient(max_rows=0), INITIAL_PARAMS)
+
+    assert is_too_many_entities(response)
+    assert response["Hint"] == "consider decreasing the sample size"
+
+
+def test_error_of_a_half_fails_the_batch():
+    client = FakeClient(max_rows=4, failing_campaigns=[5])
+
+    response = query_by_batch([(np.array([1, 2, 3, 4, 5]), date(2021, 3, 1), date(2021, 3, 2))], CATEGORY, URL, client, INITIAL_PARAMS)
+
+    assert response["error"] == "Error500"
+    assert ([4, 5], date(2021, 3, 1), date(2021, 3, 2)) in client.queries
+    assert response["Hint"] == "consider decreasing the sample size"
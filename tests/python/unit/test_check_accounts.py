@@ -0,0 +1,77 @@
+import json
+
+import pytest
+
+from api_call import check_accounts, set_account_ids_filter
+from dataset_stubs import MemoryDataset
+from dataset_writer import RecipeOutputs
+from dku_constants import Constants
+from pull_pipeline import PullSettings, build_pull_graph
+from run_metrics import RunMetrics
+
+
+class FakeResponse(object):
+    headers = {}
+
+    def __init__(self, status_code: int, body: dict):
+        self.status_code = status_code
+        self.content = json.dumps(body).encode("utf-8")
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class FakeClient(object):
+    """Client answering the search of the accounts with the ones the token can access, and a listing of one entity otherwise"""
+    cache = None
+    checkpoints = None
+    max_workers = 2
+
+    def __init__(self, accessible_ids: list, status_code: int = 200):
+        self.accessible_ids = accessible_ids
+        self.status_code = status_code
+        self.metrics = RunMetrics()
+        self.queried_ids = []
+
+    def get(self, url: str, parameters: dict) -> FakeResponse:
+        searched_ids = [int(value) for key, value in parameters.items() if key.startswith("search.id.values[")]
+        if not searched_ids:
+            return FakeResponse(200, {"elements": [{"id": 1}], "paging": {"start": 0, "count": 100, "total": 1}})
+        self.queried_ids.append(searched_ids)
+        if self.status_code != 200:
+            return FakeResponse(self.status_code, {"message": "Invalid access token", "status": self.status_code})
+        elements = [{"id": account_id} for account_id in searched_ids if account_id in self.accessible_ids]
+        return FakeResponse(200, {"elements": elements, "paging": {"start": 0, "count": 100, "total": len(elements)}})
+
+
+def test_only_the_configured_accounts_are_queried():
+    assert set_account_ids_filter(["9", " 11"]) == {"q": "search", "search.id.values[0]": "9", "search.id.values[1]": "11"}
+
+    client = FakeClient([9, 11, 12])
+    check_accounts(client, ["9", "11"])
+
+    assert client.queried_ids == [[9, 11]]
+
+
+def test_inaccessible_account_is_reported():
+    with pytest.raises(ValueError, match="13"):
+        check_accounts(FakeClient([9, 11]), ["9", "13"])
+
+
+def test_missing_account_is_reported():
+    with pytest.raises(ValueError, match="permission to access the account 9"):
+        check_accounts(FakeClient([]), ["9"])
+
+
+def test_invalid_token_is_reported():
+    with pytest.raises(ValueError):
+        check_accounts(FakeClient([9], status_code=401), ["9"])
+
+
+def test_invalid_account_fails_the_pull_before_anything_is_written():
+    dataset = MemoryDataset()
+    graph = build_pull_graph(FakeClient([9]), PullSettings(["9", "13"], 10), RecipeOutputs({Constants.CAMPAIGN_GROUP_DATASET: dataset}))
+
+    with pytest.raises(ValueError, match="13"):
+        graph.run(targets=[Constants.CAMPAIGN_GROUP_DATASET])
+    assert dataset.get_dataframe() is None
@@ -0,0 +1,131 @@
+import json
+import os
+import shutil
+from datetime import datetime
+
+import pytest
+
+from api_call import query, set_up_query
+from api_format import iter_format_to_df
+from checkpoint_store import CheckpointStore
+from dataset_stubs import MemoryDataset
+from dataset_writer import RecipeOutputs
+from dku_constants import Category, Constants
+from run_metrics import RunMetrics
+
+CATEGORY = Category.CAMPAIGN
+URL, INITIAL_PARAMS = set_up_query(CATEGORY)
+ROLE = Constants.CAMPAIGN_DATASET
+
+
+class LocalFolder(object):
+    """Stand-in for a dataiku.Folder on a local directory"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def list_paths_in_partition(self) -> list:
+        return ["/" + os.path.relpath(os.path.join(root, file_name), self.directory) for root, _, file_names in os.walk(self.directory)
+                for file_name in file_names]
+
+    def read_json(self, path: str) -> dict:
+        with open(os.path.join(self.directory, path)) as file:
+            return json.load(file)
+
+    def write_json(self, path: str, data: dict):
+        full_path = os.path.join(self.directory, path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, "w") as file:
+            json.dump(data, file)
+
+    def delete_path(self, path: str):
+        shutil.rmtree(os.path.join(self.directory, path), ignore_errors=True)
+
+
+class FakeResponse(object):
+    headers = {}
+
+    def __init__(self, status_code: int, body: dict):
+        self.status_code = status_code
+        self.content = json.dumps(body).encode("utf-8")
+
+
+class FakeClient(object):
+    """Client answering the pages of the campaigns listing, failing on the pages given"""
+    cache = None
+
+    def __init__(self, checkpoints: CheckpointStore, failing_starts: list = ()):
+        self.checkpoints = checkpoints
+        self.failing_starts = failing_starts
+        self.metrics = RunMetrics()
+        self.sent_starts = []
+
+    def get(self, url: str, parameters: dict) -> FakeResponse:
+        self.sent_starts.append(parameters["start"])
+        if parameters["start"] in self.failing_starts:
+            return FakeResponse(500, {"message": "Internal error", "status": 500})
+        return FakeResponse(200, {"elements": [{"id": parameters["start"]}]})
+
+
+@pytest.fixture
+def folder(tmp_path):
+    return LocalFolder(str(tmp_path))
+
+
+def create_store(folder: LocalFolder, **kwargs) -> CheckpointStore:
+    settings = {"account_ids": ["9", "11"], "start_date": datetime(2021, 3, 1), "end_date": datetime(2021, 3, 31), "batch_size": 80}
+    return CheckpointStore(folder, **{**settings, **kwargs})
+
+
+def run_pull(checkpoints: CheckpointStore, failing_starts: list = ()) -> FakeClient:
+    """Query three pages, write them to a dataset, and drop the checkpoints if the run succeeded"""
+    client = FakeClient(checkpoints, failing_starts)
+    responses = (query(URL, client, {**INITIAL_PARAMS, "start": start}) for start in [0, 100, 200])
+    writer = RecipeOutputs({ROLE: MemoryDataset()}).write(ROLE, iter_format_to_df(responses, CATEGORY, False))
+    checkpoints.finish([writer])
+    return client
+
+
+def test_checkpoints_round_trip(folder):
+    checkpoints = create_store(folder)
+
+    checkpoints.set(CATEGORY, URL, {"start": 0}, {"elements": [{"id": 1}]})
+
+    assert checkpoints.get(CATEGORY, URL + "/", {"start": "0"}) == {"elements": [{"id": 1}]}
+    assert checkpoints.get(CATEGORY, URL, {"start": 100}) is None
+    assert create_store(folder).get(CATEGORY, URL, {"start": 0}) == {"elements": [{"id": 1}]}
+    checkpoints.clear()
+    assert checkpoints.get(CATEGORY, URL, {"start": 0}) is None
+    assert folder.list_paths_in_partition() == []
+
+
+def test_fingerprint_changes_with_the_settings_of_the_run(folder):
+    fingerprint = create_store(folder).get_fingerprint(CATEGORY)
+
+    assert create_store(folder, account_ids=["11", " 9"]).get_fingerprint(CATEGORY) == fingerprint
+    assert create_store(folder, account_ids=["9"]).get_fingerprint(CATEGORY) != fingerprint
+    assert create_store(folder, start_date=datetime(2021, 2, 1)).get_fingerprint(CATEGORY) != fingerprint
+    assert create_store(folder, end_date=datetime(2021, 4, 30)).get_fingerprint(CATEGORY) != fingerprint
+    assert create_store(folder, batch_size=40).get_fingerprint(CATEGORY) != fingerprint
+    assert create_store(folder).get_fingerprint(Category.CREATIVE) != fingerprint
+
+
+def test_open_end_date_is_stable_from_one_day_to_the_next(folder):
+    fingerprint = create_store(folder, end_date=None).get_fingerprint(CATEGORY)
+
+    assert create_store(folder, end_date=None).get_fingerprint(CATEGORY) == fingerprint
+    assert create_store(folder, end_date=datetime.now()).get_fingerprint(CATEGORY) != fingerprint
+
+
+def test_checkpoints_survive_a_failed_run_and_are_cleared_after_a_successful_one(folder):
+    failed_run = run_pull(create_store(folder), failing_starts=[200])
+
+    assert failed_run.sent_starts == [0, 100, 200]
+    assert len(folder.list_paths_in_partition()) == 2
+
+    checkpoints = create_store(folder)
+    resumed_run = run_pull(checkpoints)
+
+    assert resumed_run.sent_starts == [200]
+    assert checkpoints.resumed_queries == 2
+    assert folder.list_paths_in_partition() == []
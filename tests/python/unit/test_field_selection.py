@@ -0,0 +1,51 @@
+from api_call import get_projection, set_accounts_filter, set_up_query
+from api_format import build_column_names, format_to_df, get_field_names
+from dku_constants import FIELDS_DICT, Category
+
+
+def test_projection_keeps_the_other_parts_of_the_response():
+    assert get_projection(["id", "name"]) == "(*,elements*(id,name))"
+
+
+def test_required_fields_are_always_selected():
+    assert get_field_names(Category.CAMPAIGN_ANALYTICS, ["clicks"]) == ["pivotValue", "clicks", "dateRange"]
+    assert get_field_names(Category.CREATIVE, []) == ["changeAuditStamps", "campaign", "id"]
+    assert get_field_names(Category.GROUP, ["name", "unknown"]) == ["name", "id", "account"]
+
+
+def test_all_fields_without_selection():
+    assert get_field_names(Category.CAMPAIGN, None) == [field for field, _ in FIELDS_DICT[Category.CAMPAIGN]]
+
+
+def test_analytics_query_requests_the_selected_metrics():
+    _, params = set_up_query(Category.CAMPAIGN_ANALYTICS, fields=["impressions", "clicks"])
+
+    assert params["fields"] == "pivotValue,impressions,clicks,dateRange"
+    assert params["projection"] == "(*,elements*(pivotValue,impressions,clicks,dateRange))"
+
+
+def test_creative_analytics_by_campaign_use_the_creative_fields():
+    _, params = set_up_query(Category.CREATIVE_ANALYTICS_BY_CAMPAIGN, fields=["costInUsd"])
+
+    assert params["pivot"] == "CREATIVE"
+    assert params["fields"] == "pivotValue,costInUsd,dateRange"
+
+
+def test_entity_listing_is_projected_only_with_a_selection():
+    accounts_filter = set_accounts_filter(["9"])
+
+    _, all_fields = set_up_query(Category.CAMPAIGN, accounts_filter)
+    _, selected_fields = set_up_query(Category.CAMPAIGN, accounts_filter, fields=["name"])
+
+    assert "projection" not in all_fields
+    assert selected_fields["projection"] == "(*,elements*(campaignGroup,changeAuditStamps,name,id,account))"
+    assert selected_fields["search.account.values[0]"] == "urn:li:sponsoredAccount:9"
+
+
+def test_output_columns_follow_the_selection():
+    elements = [{"pivotValue": "urn:li:sponsoredCampaign:1", "clicks": 2, "impressions": 5, "dateRange": {}}]
+
+    df = format_to_df({"elements": elements}, Category.CAMPAIGN_ANALYTICS, True, fields=["clicks"])
+
+    assert build_column_names(Category.CAMPAIGN_ANALYTICS, True, ["clicks"]) == ["pivotValue", "clicks", "dateRange", "exception", "raw_response"]
+    assert df.columns.tolist() == ["pivotValue", "clicks", "dateRange", "exception", "raw_response"]
@@ -0,0 +1,67 @@
+import pandas as pd
+
+from api_format import cast_column, format_to_df, get_nested_values
+from dku_constants import Category, ColumnType
+
+
+def get_date_range(day: int) -> dict:
+    return {"start": {"year": 2021, "month": 3, "day": day}, "end": {"year": 2021, "month": 3, "day": day}}
+
+
+ANALYTICS = {"elements": [
+    {"pivotValue": "urn:li:sponsoredCampaign:12", "costInUsd": "1.5", "impressions": 10, "clicks": 2, "dateRange": get_date_range(1)},
+    {"pivotValue": "urn:li:sponsoredCampaign:13", "dateRange": get_date_range(2)}
+]}
+
+
+def test_flattened_analytics_columns_are_typed():
+    df = format_to_df(ANALYTICS, Category.CAMPAIGN_ANALYTICS, False, flatten=True)
+
+    assert "dateRange" not in df.columns
+    assert str(df["pivotValue"].dtype) == "Int64"
+    assert str(df["impressions"].dtype) == str(df["clicks"].dtype) == "Int64"
+    assert df["costInUsd"].dtype == "float64"
+    assert pd.api.types.is_datetime64_any_dtype(df["date"])
+    assert df["pivotValue"].tolist() == [12, 13]
+    assert df["costInUsd"].tolist()[0] == 1.5
+    assert df["date"].tolist() == [pd.Timestamp(2021, 3, 1), pd.Timestamp(2021, 3, 2)]
+
+
+def test_missing_metrics_stay_missing():
+    df = format_to_df(ANALYTICS, Category.CAMPAIGN_ANALYTICS, False, flatten=True)
+
+    assert df["clicks"].isna().tolist() == [False, True]
+    assert df["costInUsd"].isna().tolist() == [False, True]
+
+
+def test_flattened_entities_columns():
+    creatives = {"elements": [{"id": 1, "campaign": "urn:li:sponsoredCampaign:12", "changeAuditStamps": {"created": {"time": 1609459200000}}}]}
+
+    df = format_to_df(creatives, Category.CREATIVE, False, flatten=True)
+
+    assert "changeAuditStamps" not in df.columns
+    assert df["campaign"].tolist() == [12]
+    assert df["created"].tolist() == [pd.Timestamp(2021, 1, 1)]
+    assert df["lastModified"].isna().all()
+
+
+def test_flattened_error_keeps_its_exception():
+    df = format_to_df({"error": "Error500"}, Category.CAMPAIGN_ANALYTICS, False, flatten=True)
+
+    assert len(df) == 1
+    assert df["exception"].tolist() == ["{'error': 'Error500'}"]
+    assert df["pivotValue"].isna().all()
+
+
+def test_nested_values_of_non_dict_columns_are_missing():
+    values = pd.Series([{"start": {"day": 1}}, None, {"start": {}}], dtype=object)
+
+    assert get_nested_values(values, ["start", "day"]).tolist()[0] == 1
+    assert get_nested_values(values, ["start", "day"])[1:].isna().all()
+    assert get_nested_values(pd.Series([1.0, 2.0]), ["start"]).isna().all()
+
+
+def test_invalid_values_are_cast_to_missing():
+    assert cast_column(pd.Series(["urn:li:sponsoredCampaign:12", "not a urn", None]), ColumnType.URN).isna().tolist() == [False, True, True]
+    assert cast_column(pd.Series(["3", "three"]), ColumnType.INT).isna().tolist() == [False, True]
+    assert cast_column(pd.Series(["1609459200000", "never"]), ColumnType.TIMESTAMP).isna().tolist() == [False, True]
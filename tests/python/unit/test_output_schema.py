@@ -0,0 +1,62 @@
+from api_format import format_to_df, get_output_schema
+from dataset_stubs import MemoryDataset
+from dataset_writer import RecipeOutputs
+from dku_constants import Category
+
+ROLE = "campaign_analytics_dataset"
+ELEMENTS = [{"pivotValue": "urn:li:sponsoredCampaign:100", "dateRange": {"start": {"year": 2021, "month": 3, "day": 1}}, "clicks": 3}]
+
+
+def get_types(schema: list) -> dict:
+    return {column["name"]: column["type"] for column in schema}
+
+
+def test_nested_analytics_schema():
+    schema = get_output_schema(Category.CAMPAIGN_ANALYTICS, raw_response=True)
+
+    assert [column["name"] for column in schema] == format_to_df({"elements": ELEMENTS}, Category.CAMPAIGN_ANALYTICS, True).columns.tolist()
+    assert get_types(schema) == {
+        "pivotValue": "string", "costInUsd": "double", "impressions": "bigint", "clicks": "bigint", "dateRange": "string",
+        "externalWebsitePostClickConversions": "bigint", "externalWebsitePostViewConversions": "bigint", "exception": "string", "raw_response": "string"
+    }
+
+
+def test_flattened_analytics_schema_follows_the_selected_fields():
+    schema = get_output_schema(Category.CAMPAIGN_ANALYTICS, raw_response=False, flatten=True, fields=["clicks"])
+
+    assert [column["name"] for column in schema] == format_to_df({"elements": ELEMENTS}, Category.CAMPAIGN_ANALYTICS, False, flatten=True,
+                                                                 fields=["clicks"]).columns.tolist()
+    assert get_types(schema) == {"pivotValue": "bigint", "clicks": "bigint", "date": "date", "exception": "string"}
+
+
+def test_flattened_entities_schema():
+    types = get_types(get_output_schema(Category.CAMPAIGN, raw_response=False, flatten=True))
+
+    assert (types["id"], types["account"], types["campaignGroup"], types["created"], types["test"]) == ("bigint", "bigint", "bigint", "date", "boolean")
+    assert types["targetingCriteria"] == "string"
+    assert "changeAuditStamps" not in types
+
+
+def test_schema_is_declared_before_the_first_chunk():
+    dataset = MemoryDataset()
+    schema = get_output_schema(Category.CAMPAIGN_ANALYTICS, raw_response=False)
+    error_chunk = format_to_df({"message": "Internal error", "status": 500}, Category.CAMPAIGN_ANALYTICS, False)
+    rows_chunk = format_to_df({"elements": ELEMENTS}, Category.CAMPAIGN_ANALYTICS, False)
+
+    writer = RecipeOutputs({ROLE: dataset}).write(ROLE, [error_chunk, rows_chunk], schema)
+
+    assert dataset.schema == schema
+    assert get_types(dataset.schema)["exception"] == "string"
+    assert get_types(dataset.schema)["clicks"] == "bigint"
+    assert (writer.rows, writer.has_exception) == (2, True)
+
+
+def test_chunks_are_written_with_the_columns_of_the_schema():
+    dataset = MemoryDataset()
+    schema = get_output_schema(Category.CAMPAIGN_ANALYTICS, raw_response=False)
+    chunk = format_to_df({"elements": ELEMENTS}, Category.CAMPAIGN_ANALYTICS, False)
+    previous_rows = chunk[["clicks", "dateRange", "pivotValue"]]
+
+    RecipeOutputs({ROLE: dataset}).write(ROLE, [previous_rows, chunk], schema)
+
+    assert all(df.columns.tolist() == [column["name"] for column in schema] for df in dataset.dataframes)
@@ -0,0 +1,78 @@
+import json
+import threading
+import time
+
+from api_call import iter_pages, query_with_pagination, set_up_query
+from dku_constants import Category
+from run_metrics import RunMetrics
+
+URL, INITIAL_PARAMS = set_up_query(Category.CAMPAIGN)
+TOTAL = 950
+
+
+class FakeResponse(object):
+    headers = {}
+
+    def __init__(self, status_code: int, body: dict):
+        self.status_code = status_code
+        self.content = json.dumps(body).encode("utf-8")
+
+
+class FakeClient(object):
+    """Client answering a listing of TOTAL campaigns. The later pages are answered faster, so that they finish first"""
+    cache = None
+    checkpoints = None
+
+    def __init__(self, failing_starts: list = (), max_workers: int = 4):
+        self.failing_starts = failing_starts
+        self.max_workers = max_workers
+        self.metrics = RunMetrics()
+        self.sent_starts = []
+        self.lock = threading.Lock()
+
+    def get(self, url: str, parameters: dict) -> FakeResponse:
+        start, count = int(parameters.get("start", 0)), int(parameters["count"])
+        with self.lock:
+            self.sent_starts.append(start)
+        time.sleep(0.001 * (TOTAL - start) / count)
+        if start in self.failing_starts:
+            return FakeResponse(500, {"message": "Internal error", "status": 500})
+        return FakeResponse(200, {"elements": [{"id": index} for index in range(start, min(start + count, TOTAL))],
+                                  "paging": {"start": start, "count": count, "total": TOTAL}})
+
+
+def test_concurrent_pages_are_returned_in_order():
+    client = FakeClient()
+
+    response = query_with_pagination(URL, client, INITIAL_PARAMS, page_size=100)
+
+    assert [element["id"] for element in response["elements"]] == list(range(TOTAL))
+    assert sorted(client.sent_starts) == list(range(0, TOTAL, 100))
+
+
+def test_single_page_listing():
+    client = FakeClient()
+
+    response = query_with_pagination(URL, client, INITIAL_PARAMS, page_size=1000)
+
+    assert len(response["elements"]) == TOTAL
+    assert client.sent_starts == [0]
+
+
+def test_page_in_error_is_returned_instead_of_the_listing():
+    response = query_with_pagination(URL, FakeClient(failing_starts=[300]), INITIAL_PARAMS, page_size=100)
+
+    assert response == {"error": "Error500"}
+
+
+def test_pages_stop_after_the_first_page_in_error():
+    pages = list(iter_pages(URL, FakeClient(failing_starts=[300], max_workers=1), INITIAL_PARAMS, page_size=100))
+
+    assert [page.get("paging", {}).get("start") for page in pages] == [0, 100, 200, None]
+
+
+def test_first_page_without_paging_is_an_exception():
+    pages = list(iter_pages(URL, FakeClient(failing_starts=[0]), INITIAL_PARAMS, page_size=100))
+
+    assert len(pages) == 1
+    assert "exception" in pages[0]
@@ -0,0 +1,62 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from api_format import format_to_df
+from dku_constants import Category, Constants
+from parent_ids import ParentIds
+
+CAMPAIGNS = {"elements": [
+    {"id": 100, "account": "urn:li:sponsoredAccount:9", "changeAuditStamps": {"created": {"time": 1614556800000}}},
+    {"id": 101, "account": "urn:li:sponsoredAccount:11", "changeAuditStamps": {"created": {"time": 1609459200000}}},
+    {"id": 102, "changeAuditStamps": {}}
+]}
+CREATIVES = {"elements": [{"id": 10, "campaign": "urn:li:sponsoredCampaign:100"}, {"id": 11, "campaign": "urn:li:sponsoredCampaign:100"},
+                          {"id": 20, "campaign": "urn:li:sponsoredCampaign:101"}, {"id": 30}]}
+
+
+def get_campaigns(flatten: bool = False) -> ParentIds:
+    return ParentIds.from_entities(format_to_df(CAMPAIGNS, Category.CAMPAIGN, False, flatten))
+
+
+def test_ids_of_nested_and_flattened_listings():
+    for flatten in [False, True]:
+        campaigns = get_campaigns(flatten)
+
+        assert campaigns.ids.tolist() == [100, 101, 102]
+        assert campaigns.accounts.tolist() == [9, 11, -1]
+        assert campaigns.campaigns is None
+        assert campaigns.first_activity_date == datetime(2021, 1, 1)
+
+
+def test_listing_in_error_or_empty():
+    invalid = ParentIds.from_entities(format_to_df({"error": "Error500"}, Category.CAMPAIGN, False))
+    empty = ParentIds.from_entities(pd.DataFrame())
+
+    assert len(invalid) == 0 and invalid.error is not None
+    assert len(empty) == 0 and empty.error is None
+    assert empty.first_activity_date == Constants.ANALYTICS_START_DATE
+
+
+def test_select_keeps_the_attributes_of_the_selected_ids():
+    selected = get_campaigns().select([102, 100, 999])
+
+    assert selected.ids.tolist() == [100, 102]
+    assert selected.accounts.tolist() == [9, -1]
+    assert selected.created.tolist()[0] == np.datetime64("2021-03-01T00:00:00.000")
+    assert selected.weights is None
+    assert len(get_campaigns().select([])) == 0
+
+
+def test_accounts_of_the_entities_with_a_known_account():
+    assert get_campaigns().get_accounts() == {100: 9, 101: 11}
+    assert ParentIds.from_entities(format_to_df(CREATIVES, Category.CREATIVE, False)).get_accounts() == {}
+
+
+def test_campaigns_of_the_creatives():
+    creatives = ParentIds.from_entities(format_to_df(CREATIVES, Category.CREATIVE, False))
+
+    assert creatives.get_campaign_urns().to_dict() == {10: "urn:li:sponsoredCampaign:100", 11: "urn:li:sponsoredCampaign:100",
+                                                       20: "urn:li:sponsoredCampaign:101"}
+    assert get_campaigns().with_creative_counts(creatives).weights.tolist() == [2, 1, 0]
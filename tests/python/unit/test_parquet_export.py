@@ -0,0 +1,92 @@
+import os
+import shutil
+
+import pyarrow.parquet as pq
+import pytest
+
+from dku_constants import Category
+from parquet_export import ParquetExport
+
+CATEGORY = Category.CAMPAIGN_ANALYTICS
+PIVOT_ACCOUNTS = {100: "9", 101: "11"}
+
+
+class LocalFolder(object):
+    """Stand-in for a dataiku.Folder on a local directory"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def get_writer(self, path: str):
+        full_path = os.path.join(self.directory, path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        return open(full_path, "wb")
+
+    def get_download_stream(self, path: str):
+        return open(os.path.join(self.directory, path), "rb")
+
+    def upload_stream(self, path: str, stream):
+        with self.get_writer(path) as writer:
+            shutil.copyfileobj(stream, writer)
+
+    def delete_path(self, path: str):
+        shutil.rmtree(os.path.join(self.directory, path), ignore_errors=True)
+
+    def list_files(self) -> list:
+        return sorted(os.path.relpath(os.path.join(root, file_name), self.directory) for root, _, file_names in os.walk(self.directory)
+                      for file_name in file_names)
+
+
+def get_response(day: int, clicks: int = 1) -> dict:
+    return {"elements": [{"pivotValue": "urn:li:sponsoredCampaign:{}".format(pivot_id), "clicks": clicks,
+                          "dateRange": {"start": {"year": 2021, "month": 3, "day": day}, "end": {"year": 2021, "month": 3, "day": day}}}
+                         for pivot_id in PIVOT_ACCOUNTS]}
+
+
+def get_clicks(folder: LocalFolder) -> int:
+    return sum(pq.read_table(os.path.join(folder.directory, path))["clicks"].to_pylist()[0] for path in folder.list_files()
+               if path.endswith(".parquet"))
+
+
+@pytest.fixture
+def folder(tmp_path):
+    folder = LocalFolder(str(tmp_path))
+    ParquetExport(folder).write(CATEGORY, [get_response(1), get_response(2)], PIVOT_ACCOUNTS)
+    return folder
+
+
+def test_export_is_partitioned_by_day_and_account(folder):
+    assert folder.list_files() == [
+        "CAMPAIGN_ANALYTICS/date=2021-03-01/account=11/part-00000.parquet", "CAMPAIGN_ANALYTICS/date=2021-03-01/account=9/part-00000.parquet",
+        "CAMPAIGN_ANALYTICS/date=2021-03-02/account=11/part-00000.parquet", "CAMPAIGN_ANALYTICS/date=2021-03-02/account=9/part-00000.parquet"
+    ]
+
+
+def test_new_export_replaces_the_previous_one(folder):
+    writer = ParquetExport(folder).write(CATEGORY, [get_response(3, clicks=5)], PIVOT_ACCOUNTS)
+
+    assert (writer.rows, writer.files, writer.has_exception) == (2, 2, False)
+    assert folder.list_files() == ["CAMPAIGN_ANALYTICS/date=2021-03-03/account=11/part-00000.parquet",
+                                   "CAMPAIGN_ANALYTICS/date=2021-03-03/account=9/part-00000.parquet"]
+    assert get_clicks(folder) == 10
+
+
+def test_failed_run_keeps_the_previous_export(folder):
+    def iter_responses():
+        yield get_response(3, clicks=5)
+        raise ValueError("Connection reset")
+
+    with pytest.raises(ValueError):
+        ParquetExport(folder, rows_per_file=1).write(CATEGORY, iter_responses(), PIVOT_ACCOUNTS)
+
+    assert len(folder.list_files()) == 4
+    assert get_clicks(folder) == 4
+
+
+def test_api_error_keeps_the_previous_export_and_reports_the_error(folder):
+    writer = ParquetExport(folder, rows_per_file=1).write(CATEGORY, [get_response(3, clicks=5), {"error": "Error500"}], PIVOT_ACCOUNTS)
+
+    assert writer.has_exception
+    assert "CAMPAIGN_ANALYTICS/_errors.jsonl" in folder.list_files()
+    assert len(folder.list_files()) == 5
+    assert get_clicks(folder) == 4
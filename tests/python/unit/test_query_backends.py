@@ -0,0 +1,129 @@
+import asyncio
+import json
+import threading
+from datetime import date
+
+import api_call
+import async_api_call
+from api_call import get_batch_error, get_next_page_starts, merge_outputs, set_up_query, split_chunk
+from dku_constants import Category
+from run_metrics import RunMetrics
+
+URL, INITIAL_PARAMS = set_up_query(Category.CAMPAIGN_ANALYTICS)
+
+
+class FakeResponse(object):
+    headers = {}
+
+    def __init__(self, status_code: int, body: dict):
+        self.status_code = status_code
+        self.content = json.dumps(body).encode("utf-8")
+
+    def json(self):
+        return json.loads(self.content)
+
+
+def answer(parameters: dict) -> FakeResponse:
+    """Analytics of one row per campaign and per day, refused over 4 rows"""
+    campaigns = [value for key, value in parameters.items() if key.startswith("campaigns[")]
+    first_day = date(parameters["dateRange.start.year"], parameters["dateRange.start.month"], parameters["dateRange.start.day"])
+    last_day = date(parameters["dateRange.end.year"], parameters["dateRange.end.month"], parameters["dateRange.end.day"])
+    days = [first_day.replace(day=day) for day in range(first_day.day, last_day.day + 1)]
+    if len(campaigns) * len(days) > 4:
+        return FakeResponse(400, {"message": "Request would return too many entities."})
+    return FakeResponse(200, {"elements": [{"pivotValue": campaign, "day": day.isoformat()} for campaign in campaigns for day in days]})
+
+
+class FakeCache(object):
+    """Cache recording the threads it is used from"""
+
+    def __init__(self):
+        self.responses = {}
+        self.threads = set()
+
+    def get(self, category: str, url: str, parameters: dict) -> dict:
+        self.threads.add(threading.get_ident())
+        return self.responses.get(str(sorted(parameters.items())))
+
+    def set(self, category: str, url: str, parameters: dict, response: dict):
+        self.threads.add(threading.get_ident())
+        self.responses[str(sorted(parameters.items()))] = response
+
+
+class FakeClient(object):
+    """Client of either backend, answering the queries with the fake API"""
+    max_workers = 2
+    checkpoints = None
+
+    def __init__(self, cache: FakeCache = None):
+        self.cache = cache
+        self.metrics = RunMetrics()
+
+    def get(self, url: str, parameters: dict) -> FakeResponse:
+        return answer(parameters)
+
+    async def fetch(self, url: str, parameters: dict) -> FakeResponse:
+        return answer(parameters)
+
+
+def query_chunk_sync(chunk: list, window_start: date, window_end: date) -> dict:
+    return api_call.query_chunk(chunk, window_start, window_end, Category.CAMPAIGN_ANALYTICS, URL, FakeClient(), INITIAL_PARAMS)
+
+
+def query_chunk_async(chunk: list, window_start: date, window_end: date) -> dict:
+    return asyncio.run(async_api_call.query_chunk(chunk, window_start, window_end, Category.CAMPAIGN_ANALYTICS, URL, FakeClient(), INITIAL_PARAMS))
+
+
+def test_both_backends_split_the_chunks_the_same_way():
+    for chunk, window_start, window_end in [([1, 2], date(2021, 3, 1), date(2021, 3, 2)), ([1, 2, 3, 4, 5], date(2021, 3, 1), date(2021, 3, 3)),
+                                             ([1], date(2021, 3, 1), date(2021, 3, 9))]:
+        sync_output = query_chunk_sync(chunk, window_start, window_end)
+        async_output = query_chunk_async(chunk, window_start, window_end)
+
+        assert len(sync_output["elements"]) == len(chunk) * (window_end - window_start).days + len(chunk)
+        assert async_output == sync_output
+
+
+def test_split_chunk():
+    too_many_entities = {"message": "Request would return too many entities."}
+
+    assert split_chunk({"elements": []}, [1, 2], date(2021, 3, 1), date(2021, 3, 2)) == []
+    assert split_chunk(too_many_entities, [1], date(2021, 3, 1), date(2021, 3, 1)) == []
+    assert [(half.tolist(), start, end) for half, start, end in split_chunk(too_many_entities, [1, 2, 3], date(2021, 3, 1), date(2021, 3, 2))] == [
+        ([1, 2], date(2021, 3, 1), date(2021, 3, 2)), ([3], date(2021, 3, 1), date(2021, 3, 2))
+    ]
+    assert split_chunk(too_many_entities, [1], date(2021, 3, 1), date(2021, 3, 4)) == [
+        ([1], date(2021, 3, 1), date(2021, 3, 2)), ([1], date(2021, 3, 3), date(2021, 3, 4))
+    ]
+
+
+def test_merge_outputs_and_batch_errors():
+    assert merge_outputs([{"elements": [1]}, {"elements": [2, 3]}]) == {"elements": [1, 2, 3]}
+    assert merge_outputs([{"elements": [1]}, {"error": "Error500"}, {"elements": [2]}]) == {"error": "Error500"}
+    assert get_batch_error({"elements": []}) is None
+    assert get_batch_error({"error": "Error500"}) == {"error": "Error500", "Hint": "consider decreasing the sample size"}
+
+
+def test_next_page_starts():
+    assert list(get_next_page_starts({"total": 250}, 100)) == [100, 200]
+    assert list(get_next_page_starts({"total": 100}, 100)) == []
+    assert list(get_next_page_starts({}, 100)) == []
+
+
+def test_async_cache_io_does_not_block_the_event_loop():
+    cache = FakeCache()
+    client = FakeClient(cache)
+    parameters = {**INITIAL_PARAMS, "campaigns[0]": "urn:li:sponsoredCampaign:1", "dateRange.start.year": 2021, "dateRange.start.month": 3,
+                  "dateRange.start.day": 1, "dateRange.end.year": 2021, "dateRange.end.month": 3, "dateRange.end.day": 1}
+
+    async def query_twice():
+        first_response = await async_api_call.query(URL, client, parameters, cache_category=Category.CAMPAIGN)
+        second_response = await async_api_call.query(URL, client, parameters, cache_category=Category.CAMPAIGN)
+        return first_response, second_response, threading.get_ident()
+
+    first_response, second_response, loop_thread = asyncio.run(query_twice())
+
+    assert first_response == second_response
+    assert len(cache.responses) == 1
+    assert cache.threads and loop_thread not in cache.threads
+    assert [request["cached"] for request in client.metrics.requests] == [False, True]
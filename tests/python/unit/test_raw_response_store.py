@@ -0,0 +1,67 @@
+import json
+import os
+
+import api_format
+from api_format import dump_json, format_to_df
+from dku_constants import Category
+from raw_response_store import RawResponseStore
+
+CATEGORY = Category.CAMPAIGN_ANALYTICS
+
+
+class LocalFolder(object):
+    """Stand-in for a dataiku.Folder on a local directory"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def get_writer(self, path: str):
+        return open(os.path.join(self.directory, path), "wb")
+
+    def read_lines(self, path: str) -> list:
+        with open(os.path.join(self.directory, path), "rb") as file:
+            return file.read().splitlines()
+
+
+def get_element(pivot_id: int) -> dict:
+    return {"pivotValue": "urn:li:sponsoredCampaign:{}".format(pivot_id), "clicks": pivot_id, "dateRange": {"start": {"year": 2021, "month": 3, "day": 1}}}
+
+
+def test_elements_are_written_as_json_lines(tmp_path):
+    folder = LocalFolder(str(tmp_path))
+    responses = [{"elements": [get_element(1), get_element(2)]}, {"elements": []}, {"error": "Error500"}, {"elements": [get_element(3)]}]
+
+    passed_through = list(RawResponseStore(folder).capture(CATEGORY, iter(responses)))
+
+    assert passed_through == responses
+    lines = folder.read_lines("CAMPAIGN_ANALYTICS.jsonl")
+    assert [json.loads(line) for line in lines] == [get_element(1), get_element(2), get_element(3)]
+    assert all(b" " not in line for line in lines)
+
+
+def test_responses_are_passed_through_as_they_arrive(tmp_path):
+    folder = LocalFolder(str(tmp_path))
+    consumed = []
+
+    def iter_responses():
+        for pivot_id in [1, 2]:
+            consumed.append(pivot_id)
+            yield {"elements": [get_element(pivot_id)]}
+
+    responses = RawResponseStore(folder).capture(CATEGORY, iter_responses())
+
+    next(responses)
+    assert consumed == [1]
+    assert list(responses) == [{"elements": [get_element(2)]}]
+
+
+def test_raw_response_column_is_compact_json():
+    df = format_to_df({"elements": [get_element(1)]}, CATEGORY, True)
+
+    assert df["raw_response"].tolist() == [json.dumps(get_element(1), separators=(",", ":"))]
+
+
+def test_compact_json_without_orjson(monkeypatch):
+    monkeypatch.setattr(api_format, "orjson", None)
+
+    assert dump_json(get_element(1)) == json.dumps(get_element(1), separators=(",", ":")).encode("utf-8")
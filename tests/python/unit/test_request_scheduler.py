@@ -0,0 +1,197 @@
+import asyncio
+import time
+from email.utils import formatdate
+
+import pytest
+
+import request_scheduler
+from request_scheduler import QuotaExhaustedError, RequestScheduler, TokenBucket, get_retry_after
+
+
+class FakeClock(object):
+    """Replaces the time module of the scheduler: sleeping moves the clock forward instantly"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+    async def sleep_async(self, seconds: float):
+        self.sleep(seconds)
+
+
+class FakeResponse(object):
+    def __init__(self, status_code: int, headers: dict = None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class FakeAPI(object):
+    """send_request returning the given responses, or raising the given errors, one per attempt"""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def send(self):
+        outcome = self.outcomes[min(self.calls, len(self.outcomes) - 1)]
+        self.calls += 1
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    async def send_async(self):
+        return self.send()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(request_scheduler, "time", clock)
+    monkeypatch.setattr(request_scheduler.asyncio, "sleep", clock.sleep_async)
+    return clock
+
+
+@pytest.fixture
+def max_backoff(monkeypatch):
+    """Backoff without jitter: always the upper bound of the random delay"""
+    monkeypatch.setattr(request_scheduler.random, "uniform", lambda low, high: high)
+
+
+def create_scheduler(**kwargs) -> RequestScheduler:
+    settings = {"requests_per_second": 1000, "max_retries": 5, "backoff_base_sec": 1, "backoff_max_sec": 60}
+    return RequestScheduler(**{**settings, **kwargs})
+
+
+def test_throttled_request_is_retried_after_retry_after_seconds(clock):
+    api = FakeAPI(FakeResponse(429, {"Retry-After": "7"}), FakeResponse(200))
+
+    response = create_scheduler().send(api.send)
+
+    assert response.status_code == 200
+    assert (response.attempts, response.throttles) == (2, 1)
+    assert clock.sleeps == [7]
+
+
+def test_retry_after_http_date():
+    retry_after = get_retry_after(FakeResponse(429, {"Retry-After": formatdate(time.time() + 30, usegmt=True)}))
+    assert 28 <= retry_after <= 30
+
+
+def test_retry_after_in_the_past_or_invalid():
+    assert get_retry_after(FakeResponse(429, {"Retry-After": formatdate(time.time() - 30, usegmt=True)})) == 0
+    assert get_retry_after(FakeResponse(429, {"Retry-After": "-5"})) == 0
+    assert get_retry_after(FakeResponse(429, {"Retry-After": "soon"})) is None
+    assert get_retry_after(FakeResponse(429)) is None
+
+
+def test_server_errors_are_retried_with_exponential_backoff(clock, max_backoff):
+    api = FakeAPI(FakeResponse(503), FakeResponse(500), FakeResponse(502), FakeResponse(200))
+
+    response = create_scheduler().send(api.send)
+
+    assert response.status_code == 200
+    assert (response.attempts, response.throttles) == (4, 0)
+    assert clock.sleeps == [1, 2, 4]
+
+
+def test_backoff_is_capped(max_backoff):
+    scheduler = create_scheduler(backoff_base_sec=1, backoff_max_sec=10)
+    assert [scheduler.get_backoff_delay(attempt_number) for attempt_number in range(1, 7)] == [1, 2, 4, 8, 10, 10]
+
+
+def test_backoff_stays_within_its_bounds():
+    scheduler = create_scheduler(backoff_base_sec=0.5, backoff_max_sec=8)
+    for attempt_number in range(1, 10):
+        for _ in range(50):
+            assert 0 <= scheduler.get_backoff_delay(attempt_number) <= min(8, 0.5 * 2 ** (attempt_number - 1))
+
+
+def test_client_errors_are_not_retried(clock):
+    api = FakeAPI(FakeResponse(400), FakeResponse(200))
+
+    response = create_scheduler().send(api.send)
+
+    assert response.status_code == 400
+    assert api.calls == 1
+    assert clock.sleeps == []
+
+
+def test_last_response_is_returned_once_the_retries_are_exhausted(clock, max_backoff):
+    api = FakeAPI(FakeResponse(503))
+
+    response = create_scheduler(max_retries=3).send(api.send)
+
+    assert response.status_code == 503
+    assert response.attempts == 3
+    assert api.calls == 3
+    assert clock.sleeps == [1, 2]
+
+
+def test_transport_errors_are_retried_then_raised(clock, max_backoff):
+    api = FakeAPI(ConnectionError("reset"), FakeResponse(200))
+    assert create_scheduler().send(api.send).status_code == 200
+
+    api = FakeAPI(ConnectionError("reset"))
+    with pytest.raises(ConnectionError):
+        create_scheduler(max_retries=3).send(api.send)
+    assert api.calls == 3
+
+
+def test_throttled_response_pauses_the_other_workers(clock):
+    scheduler = create_scheduler()
+    delay = scheduler.get_retry_delay(FakeResponse(429, {"Retry-After": "5"}), 1)
+    assert delay == 5
+
+    scheduler.wait_for_slot()
+    assert clock.sleeps == [5]
+    scheduler.wait_for_slot()
+    assert clock.sleeps == [5]
+
+
+def test_server_error_does_not_pause_the_other_workers(clock):
+    scheduler = create_scheduler()
+    scheduler.get_retry_delay(FakeResponse(503, {"Retry-After": "5"}), 1)
+    assert scheduler.get_pause() <= 0
+
+
+def test_requests_per_second_are_spread(clock):
+    bucket = TokenBucket(rate=2, capacity=2)
+    for _ in range(4):
+        bucket.acquire()
+    assert clock.sleeps == [0.5, 0.5]
+
+
+def test_quota_exhausted_when_retry_after_exceeds_the_max_backoff(clock):
+    scheduler = create_scheduler(backoff_max_sec=60)
+    api = FakeAPI(FakeResponse(429, {"Retry-After": "3600"}), FakeResponse(200))
+
+    with pytest.raises(QuotaExhaustedError):
+        scheduler.send(api.send)
+    assert api.calls == 1
+    assert clock.sleeps == []
+    assert scheduler.get_pause() <= 0
+
+
+def test_quota_exhausted_when_retry_after_is_a_distant_http_date(clock):
+    api = FakeAPI(FakeResponse(429, {"Retry-After": formatdate(time.time() + 86400, usegmt=True)}))
+
+    with pytest.raises(QuotaExhaustedError):
+        asyncio.run(create_scheduler().send_async(api.send_async))
+    assert api.calls == 1
+
+
+def test_async_send_retries_without_blocking(clock, max_backoff):
+    api = FakeAPI(FakeResponse(429, {"Retry-After": "3"}), FakeResponse(500), FakeResponse(200))
+
+    response = asyncio.run(create_scheduler().send_async(api.send_async))
+
+    assert response.status_code == 200
+    assert (response.attempts, response.throttles) == (3, 1)
+    assert clock.sleeps == [3, 2]
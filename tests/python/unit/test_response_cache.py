@@ -0,0 +1,83 @@
+import os
+import stat
+
+import response_cache
+from response_cache import ResponseCache
+
+CATEGORY = "CAMPAIGN"
+URL = "https://api.linkedin.com/v2/adCampaignsV2/"
+
+
+def create_cache(directory, **kwargs) -> ResponseCache:
+    return ResponseCache(str(directory), ttls={CATEGORY: 3600}, **kwargs)
+
+
+def get_mode(path) -> int:
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+
+def test_cached_response_is_returned_until_it_expires(tmp_path):
+    cache = create_cache(tmp_path)
+    cache.set(CATEGORY, URL, {"q": "search", "start": 0}, {"elements": [{"id": 1}]})
+
+    assert cache.get(CATEGORY, URL + "/", {"start": "0", "q": "search"}) == {"elements": [{"id": 1}]}
+    assert cache.get(CATEGORY, URL, {"q": "search", "start": 1}) is None
+    assert create_cache(tmp_path, namespace="other token").get(CATEGORY, URL, {"q": "search", "start": 0}) is None
+    assert ResponseCache(str(tmp_path), ttls={CATEGORY: -1}).get(CATEGORY, URL, {"q": "search", "start": 0}) is None
+
+
+def test_cache_files_are_private(tmp_path):
+    directory = tmp_path / "cache"
+    directory.mkdir(mode=0o755)
+    cache = create_cache(directory)
+
+    cache.set(CATEGORY, URL, {"start": 0}, {"elements": []})
+
+    assert get_mode(directory) == 0o700
+    assert [get_mode(directory / file_name) for file_name in os.listdir(directory)] == [0o600]
+
+
+def test_default_folder_is_per_user(monkeypatch, tmp_path):
+    monkeypatch.setattr(response_cache.tempfile, "gettempdir", lambda: str(tmp_path))
+
+    cache = ResponseCache(ttls={CATEGORY: 3600})
+
+    assert cache.directory == str(tmp_path / "dss-plugin-linkedin-marketing-cache-{}".format(os.getuid()))
+    assert get_mode(cache.directory) == 0o700
+
+
+def test_cache_is_disabled_when_the_folder_belongs_to_another_user(monkeypatch, tmp_path):
+    monkeypatch.setattr(response_cache.os, "getuid", lambda: os.stat(tmp_path).st_uid + 1)
+
+    cache = create_cache(tmp_path)
+    cache.set(CATEGORY, URL, {"start": 0}, {"elements": []})
+
+    assert not cache.enabled
+    assert os.listdir(tmp_path) == []
+
+
+def test_oldest_files_are_evicted_without_listing_the_folder(monkeypatch, tmp_path):
+    cache = create_cache(tmp_path, max_size_bytes=250)
+    monkeypatch.setattr(response_cache.os, "listdir", None)
+    monkeypatch.setattr(response_cache.os, "scandir", None)
+    response = {"elements": [{"name": "x" * 80}]}
+
+    for start in range(4):
+        cache.set(CATEGORY, URL, {"start": start}, response)
+
+    assert [cache.get(CATEGORY, URL, {"start": start}) is not None for start in range(4)] == [False, False, True, True]
+    monkeypatch.undo()
+    assert cache.total_size == sum(os.path.getsize(tmp_path / file_name) for file_name in os.listdir(tmp_path)) <= 250
+
+
+def test_sizes_of_the_previous_runs_are_loaded(tmp_path):
+    response = {"elements": [{"name": "x" * 80}]}
+    create_cache(tmp_path).set(CATEGORY, URL, {"start": 0}, response)
+    cache = create_cache(tmp_path, max_size_bytes=250)
+
+    cache.set(CATEGORY, URL, {"start": 0}, response)
+    cache.set(CATEGORY, URL, {"start": 1}, response)
+    cache.set(CATEGORY, URL, {"start": 2}, response)
+
+    assert len(os.listdir(tmp_path)) == len(cache.file_sizes) == 2
+    assert cache.get(CATEGORY, URL, {"start": 0}) is None
@@ -0,0 +1,94 @@
+import json
+import logging
+import pickle
+
+from run_metrics import RunMetrics, format_seconds
+
+
+def record_requests(metrics: RunMetrics, category: str, latencies: list, **kwargs):
+    for latency in latencies:
+        metrics.record_request("adAnalyticsV2", category, 200, latency, bytes_received=1000, **kwargs)
+
+
+def test_summary_by_endpoint_and_category():
+    metrics = RunMetrics()
+    record_requests(metrics, "CAMPAIGN_ANALYTICS", [0.1, 0.2, 0.3, 0.4])
+    metrics.record_request("adAnalyticsV2", "CAMPAIGN_ANALYTICS", 500, 1.0, attempts=3, throttles=1)
+    metrics.record_request("adAnalyticsV2", "CAMPAIGN_ANALYTICS", 200, 0.0, cached=True)
+    metrics.record_request("adAccountsV2", None, None, 0.5)
+
+    summary = metrics.get_summary()["requests"]
+
+    assert set(summary) == {"adAnalyticsV2 CAMPAIGN_ANALYTICS", "adAccountsV2"}
+    analytics = summary["adAnalyticsV2 CAMPAIGN_ANALYTICS"]
+    assert (analytics["requests"], analytics["cached"], analytics["errors"]) == (5, 1, 1)
+    assert (analytics["retries"], analytics["throttles"], analytics["bytes_received"]) == (2, 1, 4000)
+    assert abs(analytics["latency_mean_sec"] - 0.4) < 1e-9
+    assert analytics["latency_max_sec"] == 1.0
+    assert 0.4 < analytics["latency_p95_sec"] <= 1.0
+    assert summary["adAccountsV2"]["errors"] == 1
+
+
+def test_summary_of_cached_requests_only():
+    metrics = RunMetrics()
+    metrics.record_request("adCampaignsV2", "CAMPAIGN", 200, 0.0, cached=True)
+
+    summary = metrics.get_summary()["requests"]["adCampaignsV2 CAMPAIGN"]
+
+    assert (summary["requests"], summary["cached"], summary["latency_mean_sec"]) == (0, 1, None)
+
+
+def test_operations_are_added_up():
+    metrics = RunMetrics()
+    metrics.record_operation("format_to_df", "CAMPAIGN", 0.5, 10)
+    metrics.record_operation("format_to_df", "CAMPAIGN", 0.25, 5)
+    metrics.record_operation("pagination", None, 1.0)
+
+    assert metrics.get_summary()["operations"] == {
+        "format_to_df CAMPAIGN": {"calls": 2, "duration_sec": 0.75, "rows": 15},
+        "pagination": {"calls": 1, "duration_sec": 1.0, "rows": 0}
+    }
+
+
+def test_merge_adds_the_records_of_a_shard():
+    metrics, shard_metrics = RunMetrics(), RunMetrics()
+    record_requests(metrics, "CAMPAIGN", [0.1])
+    metrics.record_operation("pagination", "CAMPAIGN", 1.0, 100)
+    record_requests(shard_metrics, "CAMPAIGN", [0.2, 0.3])
+    shard_metrics.record_operation("pagination", "CAMPAIGN", 2.0, 50)
+    shard_metrics.record_operation("batch queries", "CREATIVE_ANALYTICS", 3.0, 10)
+
+    metrics.merge(pickle.loads(pickle.dumps(shard_metrics)))
+
+    summary = metrics.get_summary()
+    assert summary["requests"]["adAnalyticsV2 CAMPAIGN"]["requests"] == 3
+    assert summary["operations"]["pagination CAMPAIGN"] == {"calls": 2, "duration_sec": 3.0, "rows": 150}
+    assert summary["operations"]["batch queries CREATIVE_ANALYTICS"] == {"calls": 1, "duration_sec": 3.0, "rows": 10}
+    assert len(shard_metrics.requests) == 2
+
+
+def test_trace_and_request_log():
+    metrics = RunMetrics()
+    record_requests(metrics, "CAMPAIGN", [0.1, 0.2])
+
+    trace = json.loads(json.dumps(metrics.get_trace()))
+    request_log = metrics.get_request_log()
+
+    assert len(trace["requests"]) == 2
+    assert trace["summary"]["requests"]["adAnalyticsV2 CAMPAIGN"]["requests"] == 2
+    assert request_log.columns.tolist()[:3] == ["time", "endpoint", "category"]
+    assert len(request_log) == 2
+    assert len(RunMetrics().get_request_log()) == 0
+
+
+def test_log_summary(caplog):
+    metrics = RunMetrics()
+    record_requests(metrics, "CAMPAIGN", [0.1])
+    metrics.record_operation("pagination", "CAMPAIGN", 1.0, 100)
+
+    with caplog.at_level(logging.INFO):
+        metrics.log_summary()
+
+    assert "adAnalyticsV2 CAMPAIGN: 1 queries (0 cached, 0 errors), latency mean 0.100s" in caplog.text
+    assert "pagination CAMPAIGN: 1 calls, 1.00 seconds, 100 rows" in caplog.text
+    assert format_seconds(None) == "-"
@@ -0,0 +1,127 @@
+import json
+import os
+import pickle
+
+import pandas as pd
+import pytest
+
+import sharded_pull
+from api_client import LinkedinClient
+from dataset_stubs import MemoryDataset
+from dataset_writer import RecipeOutputs, SpillDataset
+from dku_constants import Constants
+from pull_pipeline import PullSettings
+from request_scheduler import RequestScheduler
+from sharded_pull import ShardResult, build_shards, check_shard_accounts, split_accounts, write_shard_results
+
+ROLE = Constants.CAMPAIGN_DATASET
+
+
+class FakeResponse(object):
+    status_code = 200
+    headers = {}
+
+    def __init__(self, body: dict):
+        self.content = json.dumps(body).encode("utf-8")
+
+
+class FakeSession(object):
+    """Stand-in for the requests.Session of the client, answering the queries of the accounts"""
+
+    def __init__(self, accessible_ids: list):
+        self.accessible_ids = accessible_ids
+        self.queries = 0
+
+    def get(self, url: str, params: dict) -> FakeResponse:
+        self.queries += 1
+        return FakeResponse({"elements": [{"id": account_id} for account_id in self.accessible_ids], "paging": {"total": len(self.accessible_ids)}})
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def session(monkeypatch):
+    session = FakeSession([9, 11])
+
+    def create_client(headers, scheduler=None, **kwargs):
+        client = LinkedinClient(headers, scheduler=RequestScheduler(requests_per_second=1000), **kwargs)
+        client.session = session
+        return client
+
+    monkeypatch.setattr(sharded_pull, "create_client", create_client)
+    return session
+
+
+def spill(directory, dataframes: list) -> SpillDataset:
+    dataset = SpillDataset(str(directory))
+    dataset.write_schema_from_dataframe(dataframes[0])
+    writer = dataset.get_writer()
+    for df in dataframes:
+        writer.write_dataframe(df)
+    return dataset
+
+
+def test_accounts_are_dealt_between_the_shards():
+    assert split_accounts(["1", "2", "3", "4", "5"], 2) == [["1", "3", "5"], ["2", "4"]]
+    assert split_accounts(["1", "2"], 4) == [["1"], ["2"]]
+
+
+def test_invalid_account_fails_the_run_before_dispatching_the_shards(session):
+    check_shard_accounts(["9", "11"], {}, 10, {"enabled": False})
+    assert session.queries == 1
+
+    with pytest.raises(ValueError, match="13"):
+        check_shard_accounts(["9", "11", "13"], {}, 10, {"enabled": False})
+
+
+def test_shards_do_not_check_their_accounts_again(tmp_path):
+    settings = PullSettings(["9", "11", "13"], 10)
+
+    shards = build_shards(settings.account_ids, 2, {}, settings, [ROLE], 4, 10, {"enabled": False}, str(tmp_path))
+
+    assert [shard.account_ids for shard in shards] == [["9", "13"], ["11"]]
+    assert all(shard.settings.accounts_checked for shard in shards)
+    assert len({shard.spill_directory for shard in shards}) == 2
+    assert all(shard.spill_directory.startswith(str(tmp_path)) for shard in shards)
+
+
+def test_shard_results_hold_file_paths_only(tmp_path):
+    result = ShardResult(["9"], {ROLE: spill(tmp_path, [pd.DataFrame({"id": range(1000)})])})
+
+    assert len(pickle.dumps(result)) < 1000
+    assert len(next(pickle.loads(pickle.dumps(result)).datasets[ROLE].iter_dataframes())) == 1000
+
+
+def test_shard_rows_are_merged_file_by_file(tmp_path):
+    results = [
+        ShardResult(["9"], {ROLE: spill(tmp_path / "shard-0", [pd.DataFrame({"id": [1, 2]}), pd.DataFrame({"id": [3]})])}),
+        ShardResult(["11"], error="boom"),
+        ShardResult(["13"], {ROLE: spill(tmp_path / "shard-2", [pd.DataFrame({"id": [4]})])})
+    ]
+    dataset = MemoryDataset()
+
+    write_shard_results(results, RecipeOutputs({ROLE: dataset}), [ROLE], PullSettings(["9", "11", "13"], 10))
+
+    assert [len(df) for df in dataset.dataframes] == [2, 1, 1, 1]
+    output = dataset.get_dataframe()
+    assert output["id"].dropna().tolist() == [1, 2, 3, 4]
+    assert output["exception"].notna().sum() == 1
+    assert dataset.schema[0] == {"name": "test", "type": "boolean"}
+
+
+def test_all_shards_failing_fails_the_run(tmp_path):
+    results = [ShardResult(["9"], error="boom"), ShardResult(["11"], error="bang")]
+
+    with pytest.raises(ValueError, match="boom; bang"):
+        write_shard_results(results, RecipeOutputs({ROLE: MemoryDataset()}), [ROLE], PullSettings(["9", "11"], 10))
+
+
+def test_spilled_files_are_replaced_when_the_schema_is_written_again(tmp_path):
+    dataset = spill(tmp_path, [pd.DataFrame({"id": [1]}), pd.DataFrame({"id": [2]})])
+
+    dataset.write_schema([{"name": "id", "type": "bigint"}])
+    dataset.get_writer().write_dataframe(pd.DataFrame({"id": [3]}))
+
+    assert [df["id"].tolist() for df in dataset.iter_dataframes()] == [[3]]
+    assert os.listdir(tmp_path) == ["part-00000.pkl"]
@@ -0,0 +1,233 @@
+import json
+from datetime import date, datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import pull_pipeline
+from dataset_stubs import MemoryDataset
+from dataset_writer import RecipeOutputs
+from dku_constants import Category, Constants
+from parent_ids import ParentIds
+from pull_pipeline import PullSettings, pull_analytics
+from sync_state import SyncState, drop_refreshed_rows, get_settled_date
+
+CATEGORY = Category.CAMPAIGN_ANALYTICS
+ROLE = Constants.CAMPAIGN_ANALYTICS_DATASET
+PIVOT_ACCOUNTS = {100: "9", 101: "9", 200: "8"}
+
+
+def get_date_range(day: date) -> dict:
+    return {"start": {"year": day.year, "month": day.month, "day": day.day}, "end": {"year": day.year, "month": day.month, "day": day.day}}
+
+
+def build_rows(pivot_ids: list, first_day: date, last_day: date) -> list:
+    days = [first_day + timedelta(days=offset) for offset in range((last_day - first_day).days + 1)]
+    return [{"pivotValue": "urn:li:sponsoredCampaign:{}".format(pivot_id), "dateRange": get_date_range(day), "clicks": 1} for pivot_id in pivot_ids
+            for day in days]
+
+
+def test_first_run_retrieves_every_pivot_from_the_start_date():
+    state = SyncState()
+
+    plan = state.plan(CATEGORY, PIVOT_ACCOUNTS, 7, datetime(2021, 3, 1), datetime(2021, 3, 31))
+
+    assert plan == {date(2021, 3, 1): [100, 101, 200]}
+    assert state.plans[CATEGORY] == plan
+
+
+def test_first_run_without_start_date_retrieves_all_time():
+    assert SyncState().plan(CATEGORY, PIVOT_ACCOUNTS, 7, None, datetime(2021, 3, 31)) == {None: [100, 101, 200]}
+
+
+def test_commit_moves_the_marks_to_the_settled_day():
+    state = SyncState()
+
+    state.commit(CATEGORY, PIVOT_ACCOUNTS, datetime(2021, 3, 31))
+
+    assert state.marks == {CATEGORY: {"9": {"100": "2021-03-31", "101": "2021-03-31"}, "8": {"200": "2021-03-31"}}}
+
+
+def test_settled_day_is_yesterday_at_most():
+    yesterday = datetime.now(timezone.utc).date() - timedelta(days=1)
+    assert get_settled_date(None) == yesterday
+    assert get_settled_date(datetime.now() + timedelta(days=10)) == yesterday
+    assert get_settled_date(datetime(2021, 3, 31)) == date(2021, 3, 31)
+
+
+def test_next_run_downloads_the_lookback_window_again():
+    state = SyncState({CATEGORY: {"9": {"100": "2021-03-10", "101": "2021-03-20"}}})
+
+    plan = state.plan(CATEGORY, PIVOT_ACCOUNTS, 3, datetime(2021, 3, 1), datetime(2021, 3, 31))
+
+    assert plan == {date(2021, 3, 8): [100], date(2021, 3, 18): [101], date(2021, 3, 1): [200]}
+
+
+def test_lookback_window_does_not_start_before_the_start_date():
+    state = SyncState({CATEGORY: {"9": {"100": "2021-03-02"}}})
+
+    plan = state.plan(CATEGORY, {100: "9"}, 7, datetime(2021, 3, 1), datetime(2021, 3, 31))
+
+    assert plan == {date(2021, 3, 1): [100]}
+
+
+def test_pivots_up_to_date_are_left_out():
+    state = SyncState({CATEGORY: {"9": {"100": "2021-03-31"}}})
+
+    assert state.plan(CATEGORY, {100: "9"}, 0, datetime(2021, 3, 1), datetime(2021, 3, 31)) == {}
+    assert state.plan(CATEGORY, {100: "9"}, 1, datetime(2021, 3, 1), datetime(2021, 3, 31)) == {date(2021, 3, 31): [100]}
+
+
+def test_marks_are_kept_per_account():
+    state = SyncState({CATEGORY: {"8": {"100": "2021-03-20"}}})
+
+    assert state.plan(CATEGORY, {100: "9"}, 0, datetime(2021, 3, 1), datetime(2021, 3, 31)) == {date(2021, 3, 1): [100]}
+
+
+def test_commit_never_moves_a_mark_backwards():
+    state = SyncState({CATEGORY: {"9": {"100": "2021-04-30"}}})
+
+    state.commit(CATEGORY, {100: "9"}, datetime(2021, 3, 31))
+
+    assert state.get_mark(CATEGORY, "9", 100) == date(2021, 4, 30)
+
+
+def test_merge_of_the_shard_states():
+    state = SyncState({CATEGORY: {"9": {"100": "2021-03-10"}}})
+    first_shard = SyncState({CATEGORY: {"9": {"100": "2021-03-31", "101": "2021-03-31"}}})
+    first_shard.plans[CATEGORY] = {date(2021, 3, 1): [100, 101]}
+    second_shard = SyncState({CATEGORY: {"8": {"200": "2021-03-31"}}, Category.CREATIVE_ANALYTICS: {"8": {"300": "2021-03-05"}}})
+    second_shard.plans[CATEGORY] = {date(2021, 3, 1): [200]}
+    late_shard = SyncState({CATEGORY: {"9": {"100": "2021-03-05"}}})
+
+    for shard_state in [first_shard, second_shard, late_shard]:
+        state.merge(shard_state)
+
+    assert state.marks == {
+        CATEGORY: {"9": {"100": "2021-03-31", "101": "2021-03-31"}, "8": {"200": "2021-03-31"}},
+        Category.CREATIVE_ANALYTICS: {"8": {"300": "2021-03-05"}}
+    }
+    assert state.plans[CATEGORY] == {date(2021, 3, 1): [100, 101, 200]}
+
+
+def test_drop_refreshed_rows_with_nested_date_ranges():
+    existing = pd.DataFrame(build_rows([100, 101, 200], date(2021, 3, 1), date(2021, 3, 10)))
+    plan = {date(2021, 3, 8): [100], date(2021, 3, 1): [101]}
+
+    kept_rows = drop_refreshed_rows(existing, plan)
+
+    kept = set(zip(kept_rows["pivotValue"], kept_rows["dateRange"].map(lambda date_range: date_range["start"]["day"])))
+    assert kept == {("urn:li:sponsoredCampaign:100", day) for day in range(1, 8)} | {("urn:li:sponsoredCampaign:200", day) for day in range(1, 11)}
+
+
+def test_drop_refreshed_rows_with_flattened_dates():
+    existing = pd.DataFrame({
+        "pivotValue": pd.array([100] * 10 + [200] * 10, dtype="Int64"),
+        "date": list(pd.date_range("2021-03-01", "2021-03-10")) * 2,
+        "clicks": 1
+    })
+
+    kept_rows = drop_refreshed_rows(existing, {date(2021, 3, 6): [100, 200]})
+
+    assert len(kept_rows) == 10
+    assert kept_rows["date"].max() == pd.Timestamp("2021-03-05")
+
+
+def test_drop_refreshed_rows_with_date_ranges_read_back_as_strings():
+    rows = build_rows([100], date(2021, 3, 1), date(2021, 3, 4))
+    existing = pd.DataFrame({
+        "pivotValue": [row["pivotValue"] for row in rows] * 2,
+        "dateRange": [str(row["dateRange"]) for row in rows] + [json.dumps(row["dateRange"]) for row in rows]
+    })
+
+    kept_rows = drop_refreshed_rows(existing, {date(2021, 3, 3): [100]})
+
+    assert kept_rows.index.tolist() == [0, 1, 4, 5]
+
+
+def test_drop_refreshed_rows_all_time_plan_and_exception_rows():
+    existing = pd.DataFrame(build_rows([100, 200], date(2021, 3, 1), date(2021, 3, 3)))
+    existing["exception"] = np.nan
+    existing.loc[len(existing)] = {"exception": "{'message': 'boom'}"}
+
+    kept_rows = drop_refreshed_rows(existing, {None: [100]})
+
+    assert set(kept_rows["pivotValue"]) == {"urn:li:sponsoredCampaign:200"}
+    assert kept_rows["exception"].isna().all()
+    assert len(drop_refreshed_rows(existing, {})) == 6
+
+
+class FakeClient(object):
+    metrics = None
+
+
+class BrokenDataset(MemoryDataset):
+    """Previous output whose rows cannot be read, ex - storage temporarily unavailable"""
+
+    def iter_dataframes(self, chunksize: int = 10000):
+        yield self.dataframes[0]
+        raise IOError("Connection reset")
+
+
+def run_incremental_pull(monkeypatch, state: SyncState, previous_rows: list, fail: bool = False,
+                         previous_dataset: MemoryDataset = None) -> pd.DataFrame:
+    """Pull the campaign analytics of March 2021 incrementally, with a fake API failing after the first batch if asked.
+    The previous rows are read back in chunks of 10 rows."""
+
+    def iter_analytics(client, category, parent, start_date=None, end_date=None, **kwargs):
+        yield {"elements": build_rows(parent.ids.tolist(), start_date.date(), end_date.date())}
+        if fail:
+            yield {"message": "Internal error", "status": 500}
+
+    monkeypatch.setattr(pull_pipeline, "iter_analytics", iter_analytics)
+    previous_dataset = previous_dataset or MemoryDataset()
+    for start in range(0, len(previous_rows), 10):
+        previous_dataset.write_dataframe(pd.DataFrame(previous_rows[start:start + 10]))
+    dataset = MemoryDataset()
+    settings = PullSettings(["9"], 10, start_date=datetime(2021, 3, 1), end_date=datetime(2021, 3, 31), sync_state=state, lookback_days=3)
+    parent = ParentIds(np.array([100, 101], dtype=np.int64), accounts=np.array([9, 9], dtype=np.int64))
+    pull_analytics(FakeClient(), CATEGORY, ROLE, parent, None, settings, RecipeOutputs({ROLE: dataset}, {ROLE: previous_dataset}))
+    return dataset.get_dataframe()
+
+
+def test_incremental_pull_replaces_the_refreshed_rows(monkeypatch):
+    state = SyncState({CATEGORY: {"9": {"100": "2021-03-20", "101": "2021-03-20"}}})
+    previous_rows = build_rows([100, 101], date(2021, 3, 1), date(2021, 3, 20))
+
+    output = run_incremental_pull(monkeypatch, state, previous_rows)
+
+    assert len(output) == 2 * 31
+    assert not (output["pivotValue"] + output["dateRange"].astype(str)).duplicated().any()
+    assert state.get_mark(CATEGORY, "9", 100) == date(2021, 3, 31)
+    assert state.get_mark(CATEGORY, "9", 101) == date(2021, 3, 31)
+
+
+def test_marks_do_not_move_when_the_write_fails(monkeypatch):
+    state = SyncState({CATEGORY: {"9": {"100": "2021-03-20", "101": "2021-03-20"}}})
+    previous_rows = build_rows([100, 101], date(2021, 3, 1), date(2021, 3, 20))
+
+    output = run_incremental_pull(monkeypatch, state, previous_rows, fail=True)
+
+    assert output["exception"].notna().sum() == 1
+    assert state.get_mark(CATEGORY, "9", 100) == date(2021, 3, 20)
+    assert state.get_mark(CATEGORY, "9", 101) == date(2021, 3, 20)
+
+
+def test_first_incremental_pull_without_previous_output(monkeypatch):
+    state = SyncState()
+
+    output = run_incremental_pull(monkeypatch, state, [])
+
+    assert len(output) == 2 * 31
+    assert state.marks == {CATEGORY: {"9": {"100": "2021-03-31", "101": "2021-03-31"}}}
+
+
+def test_marks_do_not_move_when_the_previous_output_cannot_be_read(monkeypatch):
+    state = SyncState({CATEGORY: {"9": {"100": "2021-03-20", "101": "2021-03-20"}}})
+    previous_rows = build_rows([100, 101], date(2021, 3, 1), date(2021, 3, 20))
+
+    with pytest.raises(IOError):
+        run_incremental_pull(monkeypatch, state, previous_rows, previous_dataset=BrokenDataset())
+
+    assert state.get_mark(CATEGORY, "9", 100) == date(2021, 3, 20)